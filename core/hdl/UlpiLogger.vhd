@@ -17,7 +17,10 @@ entity UlpiLogger is
    generic (
       LD_MEM_DEPTH_G : natural := 12;
       MARK_DEBUG_G   : boolean := true;
-      DROP_SOF_G     : boolean := true
+      DROP_SOF_G     : boolean := true;
+      -- record the number of ulpi clock cycles elapsed since the
+      -- previous record (16-bit, saturating) with every record
+      TIMESTAMP_G    : boolean := false
    );
    port (
       ulpiClk        : in  std_logic;
@@ -30,7 +33,8 @@ entity UlpiLogger is
       -- pause writing (completes logging ongoing transfer)
       pause          : in  std_logic := '0';
       -- data(lsb) and flags(msb) are streamed in little-endian
-      -- byte order
+      -- byte order; with TIMESTAMP_G the cycle delta follows
+      -- (also little-endian), i.e., each record is 4 bytes long.
       datOut         : out std_logic_vector(7 downto 0);
       -- the usual valid/ready/last handshake also used
       -- by axi streams
@@ -49,7 +53,10 @@ architecture rtl of UlpiLogger is
 
    type WrStateType is ( IDLE, LOG_RX, LOG_TX, LOG_RD );
 
-   constant MEM_WIDTH_C  : natural := 9;
+   constant TS_WIDTH_C   : natural := ite( TIMESTAMP_G, 16, 0 );
+   constant MEM_WIDTH_C  : natural := 9 + TS_WIDTH_C;
+   -- bytes per record when streaming out
+   constant NUM_BYTES_C  : natural := ite( TIMESTAMP_G, 4, 2 );
 
    subtype MemWord  is std_logic_vector( MEM_WIDTH_C - 1 downto 0 );
    type    MemArray is array(0 to 2**LD_MEM_DEPTH_G - 1) of MemWord;
@@ -62,6 +69,7 @@ architecture rtl of UlpiLogger is
       lstHalt     : std_logic;
       isSOF       : boolean;
       isPID       : boolean;
+      tsCnt       : unsigned(15 downto 0);
    end record WrRegType;
 
    constant WR_REG_INIT_C : WrRegType := (
@@ -71,23 +79,26 @@ architecture rtl of UlpiLogger is
       reqTgl      => '0',
       lstHalt     => '0',
       isSOF       => false,
-      isPID       => true
+      isPID       => true,
+      tsCnt       => (others => '0')
    );
 
    type RdRegType is record
       rptr        : unsigned(LD_MEM_DEPTH_G - 1 downto 0);
-      even        : std_logic;
+      arm         : std_logic;
+      bcnt        : natural range 0 to NUM_BYTES_C - 1;
       vld         : std_logic;
       repTgl      : std_logic;
-      hiByte      : std_logic_vector(7 downto 0);
+      hiBytes     : std_logic_vector(8*(NUM_BYTES_C - 1) - 1 downto 0);
    end record RdRegType;
 
    constant RD_REG_INIT_C : RdRegType := (
       rptr        => (others => '0'),
-      even        => '1',
+      arm         => '0',
+      bcnt        => 0,
       vld         => '0',
       repTgl      => '0',
-      hiByte      => (others => '0')
+      hiBytes     => (others => '0')
    );
 
    signal memory : MemArray  := (others => (others => '0'));
@@ -149,12 +160,13 @@ begin
    P_WR_COMB : process ( rWr, ulpiRx, halt, repTgl, pause ) is
       variable v   : WrRegType;
       variable wen : std_logic;
+      variable d   : std_logic_vector(8 downto 0);
    begin
       v         := rWr;
 
       v.lstHalt := halt;
       wen       := '0';
-      wrDat     <= ulpiRx.dir & ulpiRx.dat;
+      d         := ulpiRx.dir & ulpiRx.dat;
 
       if ( repTgl /= rWr.reqTgl ) then
          -- readout active
@@ -182,7 +194,7 @@ begin
                   if ( rWr.haveRx ) then
                     -- write end marker
                     wen   := '1';
-                    wrDat <=  (others => '0');
+                    d     :=  (others => '0');
                   end if;
                elsif ( ulpiRx.nxt = '1' ) then
                   wen      := '1';
@@ -205,7 +217,7 @@ begin
                   wen    := '1';
                   if ( ulpiRx.stp = '1' ) then
                      -- mark this as EOP by flipping preserving the status
-                     wrDat(8) <= '1';
+                     d(8) := '1';
                   end if;
                end if;
                if ( ulpiRx.stp = '1' ) then
@@ -215,8 +227,8 @@ begin
                   -- register read (nxt = '0') or register op abort
 
                   -- mark end of TX
-                  wrDat    <= (others => '0');
-                  wrDat(8) <= '1';
+                  d        := (others => '0');
+                  d(8)     := '1';
                   wen      := '1';
                   if ( ulpiRx.nxt = '1' ) then
                      -- register abort by RX
@@ -233,7 +245,7 @@ begin
                  v.haveRx := true;
                else
                  -- read done; end marker
-                 wrDat    <= (others => '0');
+                 d        := (others => '0');
                  wen      := '1';
                  v.haveRx := false;
                  if ( ulpiRx.dir = '0' ) then
@@ -258,6 +270,14 @@ begin
          end if;
       end if;
 
+      -- cycles elapsed since the last record (saturating)
+      if ( wen = '1' ) then
+         v.tsCnt := to_unsigned( 1, v.tsCnt'length );
+      elsif ( rWr.tsCnt /= 2**rWr.tsCnt'length - 1 ) then
+         v.tsCnt := rWr.tsCnt + 1;
+      end if;
+
+      wrDat  <= std_logic_vector( rWr.tsCnt( TS_WIDTH_C - 1 downto 0 ) ) & d;
       memWen <= wen;
       rWrIn  <= v;
    end process P_WR_COMB;
@@ -278,16 +298,16 @@ begin
       variable v : RdRegType;
    begin
       v     := rRd;
-      if ( rRd.even = '1' ) then
+      if ( rRd.bcnt = 0 ) then
          datOut <= rdDat(7 downto 0);
       else
-         datOut <= rRd.hiByte;
+         datOut <= rRd.hiBytes(7 downto 0);
       end if;
       datLst <= '0';
       if ( rRd.vld = '0' ) then
          if ( reqTgl /= rRd.repTgl ) then
-            v.even := not rRd.even;
-            if ( rRd.even = '1' ) then
+            v.arm := not rRd.arm;
+            if ( rRd.arm = '0' ) then
                v.rptr := wrPtr;
             else
                v.vld  := '1';
@@ -295,15 +315,23 @@ begin
          end if;
       else
          if ( datRdy = '1' ) then
-            v.even := not rRd.even;
-            if ( rRd.even = '1' ) then
-               v.hiByte(0) := rdDat(8);
-               v.rptr      := rRd.rptr + 1;
+            if ( rRd.bcnt = 0 ) then
+               v.hiBytes                                := (others => '0');
+               v.hiBytes(0)                             := rdDat(8);
+               v.hiBytes(v.hiBytes'left downto 8)       := rdDat(rdDat'left downto 9);
+               v.rptr                                   := rRd.rptr + 1;
+               v.bcnt                                   := 1;
             else
-               if ( rRd.rptr = wrPtr ) then
-                  datLst   <= '1';
-                  v.vld    := '0';
-                  v.repTgl := not rRd.repTgl;
+               v.hiBytes := x"00" & rRd.hiBytes(rRd.hiBytes'left downto 8);
+               if ( rRd.bcnt = NUM_BYTES_C - 1 ) then
+                  v.bcnt := 0;
+                  if ( rRd.rptr = wrPtr ) then
+                     datLst   <= '1';
+                     v.vld    := '0';
+                     v.repTgl := not rRd.repTgl;
+                  end if;
+               else
+                  v.bcnt := rRd.bcnt + 1;
                end if;
             end if;
          end if;
@@ -0,0 +1,314 @@
+# Module to analyze ulpi log captures
+
+# Copyright Till Straumann, 2023. Licensed under the EUPL-1.2 or later.
+# You may obtain a copy of the license at
+#   https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# This notice must not be removed.
+
+# The analysis routines operate on the packet table (see
+# UlpiLogParser.table()) and are vectorized over the entire capture.
+#
+#   p = UlpiLogParser.open( "capture.bin" )
+#   printEpStats( epStats( p.table() ) )
+#
+# Time-stamped captures (UlpiLogger with TIMESTAMP_G) also support
+# latency analysis:
+#
+#   p = UlpiLogParser.open( "capture.bin", recSize = ULPI_REC_SIZE_TS )
+#   printLatStats( *latStats( p.table(), *p.times() ) )
+
+import sys
+import numpy as np
+
+from UlpiLogParser import ( ulpiBoundary, ulpiOwner, ulpiCyclesToNs, KIND_PKT,
+  PID_ACK, PID_PING, PID_SOF, PID_NYET, PID_IN, PID_NAK, PID_STALL, PID_SETUP )
+
+# Packet-size histogram bins (payload bytes); the last bin collects
+# everything >= 513 (high-speed iso/interrupt)
+EP_HIST_BINS = np.array( [ 0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 513 ] )
+
+# NAK ratio above which an endpoint is considered device-limited
+EP_DEV_LIMIT = 0.5
+
+# data packets w/o handshake needed per handshake for an endpoint to be
+# considered isochronous (a corrupted packet may decode as a handshake)
+EP_ISO_RATIO = 8
+
+# Statistics of one endpoint/direction (SETUP is accounted as OUT)
+#  addr, endp, isIn
+#  tokens  : number of tokens (incl. PING)
+#  pings   : number of PING tokens
+#  pkts    : number of data packets
+#  bytes   : payload bytes of all data packets (incl. retries)
+#  payload : payload bytes delivered (ACK or NYET, excluding repeats of the
+#            previous toggle, i.e., retransmits after a lost ACK; data
+#            w/o handshake only on isochronous endpoints, i.e., those
+#            with (almost, see EP_ISO_RATIO) no handshakes)
+#  naks    : NAK handshakes
+#  nyets   : NYET handshakes
+#  stalls  : STALL handshakes
+#  short   : short packets (< max. packet size; incl. ZLP, excl. SETUP)
+#  zlps    : zero-length packets
+#  busBytes: bytes on the bus (all packets of all transactions)
+#  hist    : packet-size histogram (see EP_HIST_BINS)
+class EpStats(object):
+
+  def __init__(self, addr, endp, isIn):
+    self.addr     = addr
+    self.endp     = endp
+    self.isIn     = isIn
+    self.tokens   = 0
+    self.pings    = 0
+    self.pkts     = 0
+    self.bytes    = 0
+    self.payload  = 0
+    self.naks     = 0
+    self.nyets    = 0
+    self.stalls   = 0
+    self.short    = 0
+    self.zlps     = 0
+    self.busBytes = 0
+    self.hist     = np.zeros( len( EP_HIST_BINS ), dtype = np.int64 )
+
+  @property
+  def nakRatio(self):
+    return self.naks / self.tokens if self.tokens > 0 else 0.0
+
+  @property
+  def nyetRatio(self):
+    return self.nyets / self.pkts if self.pkts > 0 else 0.0
+
+  @property
+  def pingRatio(self):
+    return self.pings / self.tokens if self.tokens > 0 else 0.0
+
+  # fraction of the bus bytes which are not delivered payload
+  @property
+  def overhead(self):
+    return 1.0 - self.payload / self.busBytes if self.busBytes > 0 else 0.0
+
+  # a high NAK ratio means the device does not keep up; otherwise
+  # the host does not schedule enough transactions
+  @property
+  def limit(self):
+    return "device" if self.nakRatio > EP_DEV_LIMIT else "host"
+
+# Compute per-endpoint statistics of a packet table in one pass.
+# 'mps' maps ( addr, endp ) to the max. packet size; endpoints not
+# listed use 'dfltMps'. 'pktOvh' is added to the size of every packet
+# when computing bus bytes (e.g., 5 for high-speed SYNC + EOP).
+# Returns a list of EpStats sorted by address, endpoint and direction.
+def epStats(tbl, mps = None, dfltMps = 512, pktOvh = 0):
+  n    = len( tbl )
+  if ( n == 0 ):
+    return []
+  pid  = tbl['pid'].astype( np.int64 )
+  ln   = tbl['len'].astype( np.int64 )
+  # every packet belongs to the most recent token; SOF and SPLIT end
+  # a transaction, too.
+  bnd  = ulpiBoundary( tbl )
+  tok  = bnd & ( tbl['addr'] >= 0 )
+  ti, own = ulpiOwner( tbl )
+  tix  = np.maximum( ti, 0 )
+  isIn = ( pid[tix] == PID_IN )
+  key  = ( ( tbl['addr'][tix].astype( np.int64 ) << 5 ) | ( tbl['endp'][tix].astype( np.int64 ) << 1 ) | isIn )
+  dat  = own & ~ tok & ( ( pid & 3 ) == 3 )
+  hsk  = own & ~ tok & np.isin( pid, [ PID_ACK, PID_NAK, PID_NYET, PID_STALL ] )
+  # handshake following a data packet of the same transaction
+  nxt  = np.zeros( n, dtype = np.int64 )
+  nxh  = np.zeros( n, dtype = bool )
+  nxt[:-1] = pid[1:]
+  nxh[:-1] = hsk[1:] & ( ti[1:] == ti[:-1] )
+  ack  = dat & nxh & np.isin( nxt, [ PID_ACK, PID_NYET ] )
+  pay  = np.where( dat, np.maximum( ln - 3, 0 ), 0 )
+  stp  = own & ( pid[tix] == PID_SETUP )
+  # acknowledged data with the same toggle as the previous acknowledged
+  # packet of the endpoint/direction (since the last SETUP to the
+  # endpoint) were retransmitted after the ACK was lost. Sort ACKed data
+  # and SETUP tokens by endpoint (stable, i.e., in time order) to number
+  # the SETUPs, then the ACKed data by endpoint/direction.
+  ev   = np.flatnonzero( ack | ( tok & stp ) )
+  ev   = ev[ np.argsort( key[ev] >> 1, kind = 'stable' ) ]
+  epo  = np.cumsum( tok[ev] )[ ack[ev] ]
+  ev   = ev[ ack[ev] ]
+  o    = np.argsort( key[ev], kind = 'stable' )
+  ev, epo = ev[o], epo[o]
+  rep  = np.zeros( n, dtype = bool )
+  rep[ev[1:]] = ( key[ev[1:]] == key[ev[:-1]] ) & ( epo[1:] == epo[:-1] ) & ( pid[ev[1:]] == pid[ev[:-1]] )
+
+  keys, grp = np.unique( key[own], return_inverse = True )
+  ng   = len( keys )
+  one  = np.ones( n, dtype = np.int64 )
+  def cnt(sel, w = one):
+    return np.bincount( grp, weights = np.where( sel, w, 0 )[own], minlength = ng ).astype( np.int64 )
+  # data w/o handshake are delivered only on endpoints which (almost)
+  # never handshake (isochronous); otherwise they were corrupted or lost
+  iso  = np.zeros( n, dtype = bool )
+  iso[own] = ( cnt( dat & ~ nxh ) >= EP_ISO_RATIO * np.maximum( cnt( hsk ), 1 ) )[grp]
+  dlv  = ( ack & ~ rep ) | ( dat & ~ nxh & iso )
+  mpsA = np.array( [ ( mps or {} ).get( ( int(x >> 5), int( (x >> 1) & 0xf ) ), dfltMps ) for x in keys ], dtype = np.int64 )
+  shrt = np.zeros( n, dtype = bool )
+  shrt[own] = dat[own] & ~ stp[own] & ( pay[own] < mpsA[grp] )
+  nb   = len( EP_HIST_BINS )
+  hb   = np.digitize( pay, EP_HIST_BINS ) - 1
+  hist = np.bincount( grp * nb + hb[own], weights = dat[own], minlength = ng * nb ).astype( np.int64 ).reshape( ng, nb )
+
+  cols = dict(
+    tokens   = cnt( tok ),
+    pings    = cnt( tok & ( pid == PID_PING ) ),
+    pkts     = cnt( dat ),
+    bytes    = cnt( dat, pay ),
+    payload  = cnt( dlv, pay ),
+    naks     = cnt( hsk & ( pid == PID_NAK   ) ),
+    nyets    = cnt( hsk & ( pid == PID_NYET  ) ),
+    stalls   = cnt( hsk & ( pid == PID_STALL ) ),
+    short    = cnt( shrt ),
+    zlps     = cnt( dat & ( pay == 0 ) ),
+    busBytes = cnt( own, ln + pktOvh ),
+  )
+  rv = []
+  for i in range( ng ):
+    x = int( keys[i] )
+    s = EpStats( x >> 5, ( x >> 1 ) & 0xf, ( x & 1 ) != 0 )
+    for nm, v in cols.items():
+      setattr( s, nm, int( v[i] ) )
+    s.hist = hist[i]
+    rv.append( s )
+  return rv
+
+def printEpStats(stats, f = sys.stdout, hist = False):
+  tot = sum( [ s.busBytes for s in stats ] )
+  print("ADDR EP DIR   TOKENS     PKTS      PAYLOAD  NAK%  NYET%  PING%  SHORT   ZLP  OVH%  BUS%  LIMIT", file = f)
+  for s in stats:
+    print("{:4d} {:2d} {:3s} {:8d} {:8d} {:12d} {:5.1f} {:6.1f} {:6.1f} {:6d} {:5d} {:5.1f} {:5.1f}  {}".format(
+          s.addr, s.endp, "IN" if s.isIn else "OUT", s.tokens, s.pkts, s.payload,
+          100.0*s.nakRatio, 100.0*s.nyetRatio, 100.0*s.pingRatio, s.short, s.zlps,
+          100.0*s.overhead, 100.0*s.busBytes/tot if tot > 0 else 0.0, s.limit ), file = f)
+    if ( hist ):
+      for i in range( len( EP_HIST_BINS ) ):
+        if ( s.hist[i] > 0 ):
+          if ( i + 1 < len( EP_HIST_BINS ) ):
+            rng = "{:d}-{:d}".format( EP_HIST_BINS[i], EP_HIST_BINS[i+1] - 1 )
+          else:
+            rng = ">={:d}".format( EP_HIST_BINS[i] )
+          print("      {:>9s}: {:d}".format( rng, s.hist[i] ), file = f)
+
+# Latency analysis; all times are in ulpi clock cycles (at high speed
+# one cycle corresponds to one byte on the bus).
+
+# microframe (125us)
+UFRAME_CYCLES = 7500
+# latency histogram bins (cycles): 0, 1, 2, 4, ..., 65536
+LAT_HIST_BINS = np.concatenate( ( [ 0 ], 2**np.arange( 17 ) ) )
+# microframe occupancy histogram bins (percent)
+OCC_HIST_BINS = np.arange( 0, 101, 10 )
+
+# Turnaround latencies of one endpoint/direction (SETUP is accounted as
+# OUT); measured from the last byte of a packet to the first byte of
+# the next packet of the same transaction:
+#  addr, endp, isIn
+#  tokRsp : token -> data or handshake. For IN this is the response
+#           time of the device, for OUT/SETUP the host's.
+#  datHsk : data -> handshake. For OUT/SETUP this is the response
+#           time of the device, for IN the host's.
+class EpLatency(object):
+
+  def __init__(self, addr, endp, isIn, tokRsp, datHsk):
+    self.addr   = addr
+    self.endp   = endp
+    self.isIn   = isIn
+    self.tokRsp = tokRsp
+    self.datHsk = datHsk
+
+# histogram of latencies 'x' (see LAT_HIST_BINS)
+def latHist(x):
+  return np.bincount( np.digitize( x, LAT_HIST_BINS ) - 1, minlength = len( LAT_HIST_BINS ) )
+
+# Compute the latency statistics of a packet table given the packet
+# times 't0', 't1' (see UlpiLogParser.times()).
+# Returns ( eps, gaps, occ ):
+#   eps  : list of EpLatency sorted by address, endpoint and direction
+#   gaps : inter-transaction gaps (last packet of a transaction to
+#          the next token)
+#   occ  : bus occupancy (fraction of the cycles spent transferring
+#          packets) of every microframe. Microframes are aligned to the
+#          first SOF; if SOFs were dropped by the logger (DROP_SOF_G)
+#          they are aligned to the first packet. SYNC/EOP are not
+#          accounted for.
+def latStats(tbl, t0, t1):
+  n    = len( tbl )
+  e    = np.zeros( 0, dtype = np.int64 )
+  if ( n == 0 ):
+    return [], e, e.astype( np.float64 )
+  t0   = t0.astype( np.int64 )
+  t1   = t1.astype( np.int64 )
+  pid  = tbl['pid'].astype( np.int64 )
+  pkt  = ( tbl['kind'] == KIND_PKT )
+  tok  = ulpiBoundary( tbl ) & ( tbl['addr'] >= 0 )
+  ti, own = ulpiOwner( tbl )
+  tix  = np.maximum( ti, 0 )
+  isIn = ( pid[tix] == PID_IN )
+  key  = ( ( tbl['addr'][tix].astype( np.int64 ) << 5 ) | ( tbl['endp'][tix].astype( np.int64 ) << 1 ) | isIn )
+  # turnaround to the next packet of the same transaction
+  nxt  = np.zeros( n, dtype = bool )
+  nxt[:-1] = own[1:] & ( ti[1:] == ti[:-1] )
+  lat  = np.zeros( n, dtype = np.int64 )
+  lat[:-1] = t0[1:] - t1[:-1]
+  nxh  = np.zeros( n, dtype = bool )
+  nxh[:-1] = np.isin( pid[1:], [ PID_ACK, PID_NAK, PID_NYET, PID_STALL ] )
+  rsp  = tok & nxt
+  dhs  = own & ~ tok & ( ( pid & 3 ) == 3 ) & nxt & nxh
+  eps  = []
+  for k in np.unique( key[ rsp | dhs ] ):
+    k = int( k )
+    m = ( key == k )
+    eps.append( EpLatency( k >> 5, ( k >> 1 ) & 0xf, ( k & 1 ) != 0, lat[ rsp & m ], lat[ dhs & m ] ) )
+
+  ix   = np.flatnonzero( tok )
+  ix   = ix[ ix > 0 ]
+  gaps = t0[ix] - t1[ix - 1]
+
+  sof  = np.flatnonzero( pkt & tbl['dir'] & ( pid == PID_SOF ) )
+  base = t0[ sof[0] ] if len( sof ) > 0 else t0[0]
+  uf   = ( t0 - base ) // UFRAME_CYCLES
+  sel  = pkt & ( uf >= 0 )
+  busy = np.bincount( uf[sel], weights = ( t1 - t0 + 1 )[sel] )
+  # the last microframe is incomplete
+  occ  = np.minimum( busy[:-1] / UFRAME_CYCLES, 1.0 )
+  return eps, gaps, occ
+
+def _latSummary(x):
+  if ( len( x ) == 0 ):
+    return "{:8d} {:>8s} {:>8s} {:>8s} {:>8s}".format( 0, "-", "-", "-", "-" )
+  p = np.percentile( x, [ 0, 50, 99, 100 ] )
+  return "{:8d} {:8d} {:8d} {:8d} {:8d}".format( len( x ), *[ ulpiCyclesToNs( int( v ) ) for v in p ] )
+
+def _printLatHist(x, f):
+  h = latHist( x )
+  for i in range( len( h ) ):
+    if ( h[i] > 0 ):
+      if ( i + 1 < len( LAT_HIST_BINS ) ):
+        rng = "{:d}-{:d}".format( LAT_HIST_BINS[i], LAT_HIST_BINS[i+1] - 1 )
+      else:
+        rng = ">={:d}".format( LAT_HIST_BINS[i] )
+      print("      {:>13s}: {:d}".format( rng, h[i] ), file = f)
+
+# print latency statistics (as returned by latStats); latencies are
+# listed in ns (min, median, 99th percentile, max), histograms in cycles
+def printLatStats(eps, gaps, occ, f = sys.stdout, hist = False):
+  hdr = "{:>8s} {:>8s} {:>8s} {:>8s} {:>8s}"
+  print(("ADDR EP DIR  WHAT   " + hdr).format( "N", "MIN", "MED", "P99", "MAX" ), file = f)
+  for s in eps:
+    for nm, x in ( ( "TK>RS", s.tokRsp ), ( "DT>HS", s.datHsk ) ):
+      print("{:4d} {:2d} {:3s}  {:5s}  {}".format( s.addr, s.endp, "IN" if s.isIn else "OUT", nm, _latSummary( x ) ), file = f)
+      if ( hist ):
+        _printLatHist( x, f )
+  print("Inter-transaction gaps:  {}".format( _latSummary( gaps ) ), file = f)
+  if ( hist ):
+    _printLatHist( gaps, f )
+  if ( len( occ ) > 0 ):
+    print("Microframe occupancy: {:d} microframes, mean {:5.1f}%, max {:5.1f}%".format(
+          len( occ ), 100.0*np.mean( occ ), 100.0*np.max( occ ) ), file = f)
+    h = np.bincount( np.minimum( ( 100.0*occ ).astype( np.int64 ) // 10, 9 ), minlength = 10 )
+    for i in range( len( h ) ):
+      print("      {:3d}-{:3d}%: {:d}".format( OCC_HIST_BINS[i], OCC_HIST_BINS[i+1], h[i] ), file = f)
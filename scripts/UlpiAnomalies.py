@@ -0,0 +1,338 @@
+# Module to detect protocol anomalies in ulpi log captures
+
+# Copyright Till Straumann, 2023. Licensed under the EUPL-1.2 or later.
+# You may obtain a copy of the license at
+#   https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# This notice must not be removed.
+
+# The detector consumes a packet stream (as produced by UlpiLogParser,
+# UlpiStreamParser or UlpiCaptureSession), decodes the transactions and
+# tracks the toggle and handshake state of every endpoint. It flags
+#
+#   NAK_STREAK : >= nakStreak consecutive NAKed IN/OUT transactions
+#   PING_STORM : >= pingStorm consecutive NAKed PINGs
+#   RETRY      : data retransmitted after they were not acknowledged
+#                (corrupted data or lost ACK on IN endpoints)
+#   LOST_ACK   : OUT data repeated (same toggle) after the device ACKed;
+#                the host missed the ACK
+#   TOGGLE     : IN data toggle not advanced after the host ACKed, or
+#                advanced without an ACK
+#   ISO_MISS   : isochronous microframes without a transaction
+#   ISO_NODATA : isochronous IN token not answered by the device
+#
+# Missed isochronous microframes can only be detected if the capture
+# has time stamps ('timeFn') or holds SOF tokens (UlpiLogger w/o
+# DROP_SOF_G). The service interval of an isochronous endpoint is taken
+# to be the smallest interval observed; a pause longer than
+# ANOM_ISO_MAX_MISS intervals is considered a restart of the stream
+# (e.g., interface alternate setting changed), not a miss.
+#
+# An endpoint is isochronous if 'isoEps' (a set of ( addr, endp, isIn )
+# keys, e.g., from the descriptors) says so. Otherwise it is classified
+# from evidence: at least ANOM_ISO_RATIO times as many data transactions
+# without handshake as with one (NAKs included). The first
+# ANOM_ISO_MIN_XACT data transactions of an endpoint are held back until
+# there are enough of them to decide (endpoints receiving SETUP are
+# control endpoints and never held back); a lone timeout or CRC error thus
+# does not turn a bulk endpoint into an isochronous one and a single
+# handshake does not turn an isochronous endpoint into a bulk one.
+#
+# The state kept is O(1) per endpoint; only the first ANOM_MAX_LOC
+# locations (packet indices) of every anomaly are recorded.
+#
+#   d = UlpiAnomalyDetector()
+#   d.run( UlpiLogParser.open( "capture.bin" ).packets() )
+#   d.report()
+
+import sys
+
+from UlpiLogParser    import ( UlpiGap,
+  PID_OUT, PID_ACK, PID_DATA0, PID_PING, PID_SOF, PID_NYET, PID_IN, PID_NAK, PID_DATA1 )
+from UlpiTransactions import UsbTransactionDecoder, pktKind
+
+ANOM_NAK_STREAK = "NAK_STREAK"
+ANOM_PING_STORM = "PING_STORM"
+ANOM_RETRY      = "RETRY"
+ANOM_LOST_ACK   = "LOST_ACK"
+ANOM_TOGGLE     = "TOGGLE"
+ANOM_ISO_MISS   = "ISO_MISS"
+ANOM_ISO_NODATA = "ISO_NODATA"
+
+ANOM_KINDS      = ( ANOM_NAK_STREAK, ANOM_PING_STORM, ANOM_RETRY, ANOM_LOST_ACK,
+                    ANOM_TOGGLE, ANOM_ISO_MISS, ANOM_ISO_NODATA )
+
+# default thresholds (transactions)
+ANOM_NAK_STREAK_MIN = 100
+ANOM_PING_STORM_MIN = 20
+
+# max. number of locations recorded per anomaly and endpoint
+ANOM_MAX_LOC        = 8
+
+# max. number of consecutive missed isochronous intervals
+ANOM_ISO_MAX_MISS   = 8
+
+# data transactions w/o handshake needed per handshaked one for an
+# endpoint to be considered isochronous; number of data transactions
+# held back until an endpoint is classified
+ANOM_ISO_RATIO      = 8
+ANOM_ISO_MIN_XACT   = 16
+
+# ulpi clock cycles per microframe
+ANOM_UFRAME_CYCLES  = 7500
+
+# Anomalies of one endpoint/direction:
+#  addr, endp, isIn
+#  counts  : number of occurrences, keyed by anomaly kind
+#  locs    : packet indices of the first ANOM_MAX_LOC occurrences
+#  longest : longest NAK streak / PING storm (transactions)
+class EpAnomalies(object):
+
+  def __init__(self, addr, endp, isIn):
+    self.addr     = addr
+    self.endp     = endp
+    self.isIn     = isIn
+    self.counts   = dict()
+    self.locs     = dict()
+    self.longest  = dict()
+    # expected data PID after the last acknowledged packet (or None)
+    self._tgl     = None
+    # PID of data not acknowledged (or None)
+    self._unacked = None
+    # current NAK streak / PING storm: ( first packet index, length )
+    self._naks    = None
+    self._pings   = None
+    # data transactions with/without handshake; transactions held back
+    # until there are enough of them to classify the endpoint (None
+    # once classified)
+    self._nHsk    = 0
+    self._nNoHsk  = 0
+    self._held    = []
+    # isochronous (True/False as given by the user, None: from evidence)
+    self._isoSet  = None
+    # isochronous: time (microframes) of the last transaction and
+    # service interval
+    self._isoT    = None
+    self._isoIval = None
+
+  @property
+  def total(self):
+    return sum( self.counts.values() )
+
+  @property
+  def isIso(self):
+    if ( not self._isoSet is None ):
+      return self._isoSet
+    return self._nNoHsk >= ANOM_ISO_RATIO * max( self._nHsk, 1 )
+
+  def add(self, kind, idx, n = 1):
+    self.counts[kind] = self.counts.get( kind, 0 ) + n
+    l = self.locs.setdefault( kind, [] )
+    if ( len( l ) < ANOM_MAX_LOC ):
+      l.append( idx )
+
+class UlpiAnomalyDetector(object):
+
+  # 'timeFn' maps a packet index to its time (ulpi clock cycles); e.g.,
+  # lambda i: t0[i] with t0 from UlpiLogParser.times()
+  # 'isoEps' is a set of ( addr, endp, isIn ) keys of the isochronous
+  # endpoints; if given, all other endpoints are not isochronous
+  def __init__(self, nakStreak = ANOM_NAK_STREAK_MIN, pingStorm = ANOM_PING_STORM_MIN, timeFn = None, isoEps = None):
+    self._nakMin  = nakStreak
+    self._pingMin = pingStorm
+    self._timeFn  = timeFn
+    self._isoEps  = isoEps
+    self._dec     = UsbTransactionDecoder()
+    self._n       = 0
+    self._sofs    = 0
+    # time (in microframes, see _uframe) of the packets decoded so far
+    self._uf      = dict()
+    # EpAnomalies keyed by ( addr, endp, isIn )
+    self.eps      = dict()
+    # recording gaps
+    self.gaps     = 0
+
+  def ep(self, addr, endp, isIn):
+    key = ( addr, endp, isIn )
+    e   = self.eps.get( key )
+    if ( e is None ):
+      e = EpAnomalies( addr, endp, isIn )
+      if ( not self._isoEps is None ):
+        e._isoSet = key in self._isoEps
+        e._held   = None
+      self.eps[key] = e
+    return e
+
+  def feed(self, pkt):
+    if ( isinstance( pkt, UlpiGap ) ):
+      for tr in self._dec.feed( pkt ):
+        self._xact( tr )
+      self._gap()
+      return
+    data, isRx = pkt
+    idx        = self._n
+    self._n   += 1
+    pid        = pktKind( data, isRx )[1] if ( isRx and len( data ) > 0 ) else None
+    if ( pid == PID_SOF ):
+      self._sofs += 1
+    for tr in self._dec.feed( pkt ):
+      self._xact( tr )
+    if ( pid in ( PID_IN, PID_OUT ) ):
+      # remember the microframe of the pending transaction (the
+      # decoder holds at most one)
+      self._uf = { idx: self._uframe( idx ) }
+
+  # microframe of packet #idx (None if unknown)
+  def _uframe(self, idx):
+    if ( not self._timeFn is None ):
+      return self._timeFn( idx ) / ANOM_UFRAME_CYCLES
+    if ( self._sofs > 0 ):
+      return self._sofs
+    return None
+
+  def _gap(self):
+    self.gaps += 1
+    for e in self.eps.values():
+      self._endStreaks( e )
+      self._release( e )
+      e._tgl     = None
+      e._unacked = None
+      e._isoT    = None
+
+  def _endStreaks(self, e):
+    if ( not e._naks is None ):
+      self._streak( e, ANOM_NAK_STREAK, e._naks, self._nakMin )
+      e._naks = None
+    if ( not e._pings is None ):
+      self._streak( e, ANOM_PING_STORM, e._pings, self._pingMin )
+      e._pings = None
+
+  def _streak(self, e, kind, s, minLen):
+    if ( s[1] >= minLen ):
+      e.add( kind, s[0] )
+      e.longest[kind] = max( e.longest.get( kind, 0 ), s[1] )
+
+  def _xact(self, tr):
+    if ( tr.tok == PID_PING ):
+      e = self.ep( tr.addr, tr.endp, False )
+      if ( tr.hsk == PID_NAK ):
+        e._pings = ( tr.idx, 1 ) if e._pings is None else ( e._pings[0], e._pings[1] + 1 )
+      elif ( not e._pings is None ):
+        self._streak( e, ANOM_PING_STORM, e._pings, self._pingMin )
+        e._pings = None
+      return
+    if ( not tr.tok in ( PID_IN, PID_OUT ) ):
+      # SETUP resets the toggles; control endpoints are never isochronous
+      # (check the transactions held back before the reset)
+      for isIn in ( True, False ):
+        e          = self.ep( tr.addr, tr.endp, isIn )
+        if ( e._isoSet is None ):
+          e._isoSet = False
+        self._release( e )
+        e._tgl     = PID_DATA1 if tr.hsk == PID_ACK else None
+        e._unacked = None
+      return
+    e = self.ep( tr.addr, tr.endp, tr.isIn )
+    if ( tr.hsk is None ):
+      e._nNoHsk += 1
+    else:
+      e._nHsk   += 1
+    if ( tr.hsk == PID_NAK ):
+      e._naks = ( tr.idx, 1 ) if e._naks is None else ( e._naks[0], e._naks[1] + 1 )
+      return
+    if ( not e._naks is None ):
+      self._streak( e, ANOM_NAK_STREAK, e._naks, self._nakMin )
+      e._naks = None
+    if ( not e._held is None ):
+      e._held.append( ( tr, self._uf.get( tr.idx ) ) )
+      if ( e._nHsk + e._nNoHsk >= ANOM_ISO_MIN_XACT ):
+        self._release( e )
+      return
+    self._data( e, tr, self._uf.get( tr.idx ) )
+
+  # classify an endpoint and check the transactions held back so far
+  def _release(self, e):
+    if ( e._held is None ):
+      return
+    held    = e._held
+    e._held = None
+    for tr, t in held:
+      self._data( e, tr, t )
+
+  # check a (non-NAKed) data transaction; 't' is its microframe
+  def _data(self, e, tr, t):
+    if ( e.isIso ):
+      self._iso( e, tr, t )
+      return
+    if ( not tr.dat in ( PID_DATA0, PID_DATA1 ) ):
+      return
+    acked = tr.hsk in ( PID_ACK, PID_NYET )
+    if   ( not e._unacked is None ):
+      if   ( tr.dat == e._unacked ):
+        e.add( ANOM_RETRY, tr.idx )
+      elif ( tr.isIn ):
+        # device advanced w/o ACK
+        e.add( ANOM_TOGGLE, tr.idx )
+    elif ( not e._tgl is None and tr.dat != e._tgl ):
+      # repeated after an ACK
+      e.add( ANOM_TOGGLE if tr.isIn else ANOM_LOST_ACK, tr.idx )
+    if ( acked ):
+      e._tgl     = PID_DATA0 if tr.dat == PID_DATA1 else PID_DATA1
+      e._unacked = None
+    elif ( tr.hsk is None ):
+      e._unacked = tr.dat
+
+  def _iso(self, e, tr, t):
+    if ( tr.dat is None and tr.isIn ):
+      # microframe serviced but no data available
+      e.add( ANOM_ISO_NODATA, tr.idx )
+    if ( t is None ):
+      return
+    if ( not e._isoT is None ):
+      dt = t - e._isoT
+      if ( dt >= 0.5 ):
+        if ( e._isoIval is None or dt < e._isoIval - 0.5 ):
+          e._isoIval = max( round( dt ), 1 )
+        miss = round( dt / e._isoIval ) - 1
+        if ( miss > 0 and miss <= ANOM_ISO_MAX_MISS ):
+          e.add( ANOM_ISO_MISS, tr.idx, miss )
+    e._isoT = t
+
+  # flush pending state; call at the end of the stream
+  def flush(self):
+    for tr in self._dec.flush():
+      self._xact( tr )
+    for e in self.eps.values():
+      self._endStreaks( e )
+      self._release( e )
+
+  # consume an entire packet stream
+  def run(self, pkts):
+    for p in pkts:
+      self.feed( p )
+    self.flush()
+    return self
+
+  # total number of anomalies
+  @property
+  def total(self):
+    return sum( [ e.total for e in self.eps.values() ] )
+
+  # print a compact report (one line per endpoint and anomaly); 'idxFn'
+  # maps the packet indices (e.g., to the capture if only part of it
+  # was fed)
+  def report(self, f = sys.stdout, idxFn = None):
+    if ( idxFn is None ):
+      idxFn = lambda i: i
+    print("ADDR EP DIR  ANOMALY        COUNT  LONGEST  LOCATIONS", file = f)
+    for k in sorted( self.eps ):
+      e = self.eps[k]
+      for kind in ANOM_KINDS:
+        if ( kind in e.counts ):
+          l = e.longest.get( kind )
+          print("{:4d} {:2d} {:3s}  {:12s} {:7d} {:>8s}  {}".format(
+                e.addr, e.endp, "IN" if e.isIn else "OUT", kind, e.counts[kind],
+                "-" if l is None else str( l ),
+                " ".join( [ "#{:d}".format( idxFn( i ) ) for i in e.locs[kind] ] ) ), file = f)
+    timing = "time stamps" if not self._timeFn is None else ( "SOF" if self._sofs > 0 else "none (ISO_MISS not detected)" )
+    print("ANOMALIES: {:d}  (packets: {:d}, gaps: {:d}, iso timing: {})".format(
+          self.total, self._n, self.gaps, timing ), file = f)
@@ -0,0 +1,561 @@
+# Module to decode control transfers in ulpi log captures
+
+# Copyright Till Straumann, 2023. Licensed under the EUPL-1.2 or later.
+# You may obtain a copy of the license at
+#   https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# This notice must not be removed.
+
+# The decoder follows the control transfers of every control endpoint
+# (i.e., every endpoint that has seen a SETUP), collects the data stage
+# and names the standard and class requests (CDC ACM/ECM/NCM and UAC2;
+# the class of the addressed interface is looked up in the descriptors
+# if available).
+#
+# If the Usb2DescContext which was used to build the firmware is given
+# then the descriptor served in response to GET_DESCRIPTOR is
+# identified the way Usb2StdCtlEp selects it:
+#
+#   DEVICE, CONFIGURATION,  : from the set of the current speed (the
+#   DEVICE_QUALIFIER          second set of a dual-speed context is the
+#                             high-speed one); configurations are
+#                             numbered from 0 and include all descriptors
+#                             up to the next configuration (wTotalLength)
+#   OTHER_SPEED_CONF.       : configuration of the other set with its
+#                             type patched
+#   STRING                  : the n-th string descriptor (the language
+#                             ID is ignored)
+#
+# and the bytes returned are compared against it (truncated to wLength).
+# The speed is taken from the writes of UlpiLineState to the PHY's
+# function control register (high-speed is assumed if there are none).
+#
+# Every request is timed (if the capture has time stamps, 'timeFn'):
+#
+#   latency  : from SETUP to the device's answer, i.e., the first data
+#              packet of a device-to-host request or the status-stage
+#              ZLP of a host-to-device request; the NAKs sent until
+#              then reflect the time the handler (e.g., an application
+#              endpoint using Usb2EpGenericCtl) was busy.
+#   duration : from SETUP to the end of the status stage.
+#
+#   d = UsbControlDecoder( ctx = mkExampleDevDescriptors( yml ), timeFn = lambda i: t0[i] )
+#   d.run( UlpiLogParser.open( "capture.bin", recSize = ULPI_REC_SIZE_TS ).packets() )
+#   d.report()
+
+import sys
+import io
+
+from UlpiLogParser    import ( UlpiGap, ulpiCyclesToNs, KIND_REGW,
+  PID_ACK, PID_DATA0, PID_NYET, PID_NAK, PID_DATA1, PID_SETUP, PID_STALL, PID_PING )
+from UlpiTransactions import ( UsbTransactionDecoder, pktKind, XFER_OK, XFER_STALL, XFER_ABORT )
+
+USB_REQ_SET_ADDRESS       = 0x05
+USB_REQ_GET_DESCRIPTOR    = 0x06
+USB_REQ_SET_CONFIGURATION = 0x09
+USB_REQ_SET_INTERFACE     = 0x0b
+
+USB_REQ_NAMES = {
+  0x00 : "GET_STATUS",
+  0x01 : "CLEAR_FEATURE",
+  0x03 : "SET_FEATURE",
+  0x05 : "SET_ADDRESS",
+  0x06 : "GET_DESCRIPTOR",
+  0x07 : "SET_DESCRIPTOR",
+  0x08 : "GET_CONFIGURATION",
+  0x09 : "SET_CONFIGURATION",
+  0x0a : "GET_INTERFACE",
+  0x0b : "SET_INTERFACE",
+  0x0c : "SYNCH_FRAME",
+}
+
+USB_DSC_DEVICE            = 0x01
+USB_DSC_CONFIGURATION     = 0x02
+USB_DSC_STRING            = 0x03
+USB_DSC_DEVICE_QUALIFIER  = 0x06
+USB_DSC_OTHER_SPEED       = 0x07
+
+USB_DSC_NAMES = {
+  0x01 : "DEVICE",
+  0x02 : "CONFIGURATION",
+  0x03 : "STRING",
+  0x06 : "DEVICE_QUALIFIER",
+  0x07 : "OTHER_SPEED_CONFIGURATION",
+  0x0f : "BOS",
+}
+
+# class-specific requests (see Usb2Pkg.vhd)
+CDC_REQ_SET_LINE_CODING     = 0x20
+CDC_REQ_GET_NTB_PARAMETERS  = 0x80
+
+CDC_REQ_NAMES = {
+  0x00 : "SEND_ENCAPSULATED_COMMAND",
+  0x01 : "GET_ENCAPSULATED_RESPONSE",
+  0x20 : "SET_LINE_CODING",
+  0x21 : "GET_LINE_CODING",
+  0x22 : "SET_CONTROL_LINE_STATE",
+  0x23 : "SEND_BREAK",
+  0x40 : "SET_ETHERNET_MULTICAST_FILTERS",
+  0x41 : "SET_ETHERNET_PM_PATTERN_FILTER",
+  0x42 : "GET_ETHERNET_PM_PATTERN_FILTER",
+  0x43 : "SET_ETHERNET_PACKET_FILTER",
+  0x44 : "GET_ETHERNET_STATISTIC",
+  0x80 : "GET_NTB_PARAMETERS",
+  0x81 : "GET_NET_ADDRESS",
+  0x82 : "SET_NET_ADDRESS",
+  0x83 : "GET_NTB_FORMAT",
+  0x84 : "SET_NTB_FORMAT",
+  0x85 : "GET_NTB_INPUT_SIZE",
+  0x86 : "SET_NTB_INPUT_SIZE",
+  0x87 : "GET_MAX_DATAGRAM_SIZE",
+  0x88 : "SET_MAX_DATAGRAM_SIZE",
+  0x89 : "GET_CRC_MODE",
+  0x8a : "SET_CRC_MODE",
+}
+
+UAC2_REQ_NAMES = {
+  0x01 : "CUR",
+  0x02 : "RANGE",
+  0x03 : "MEM",
+}
+
+# interface classes
+IFC_CLASS_AUDIO = 0x01
+IFC_CLASS_CDC   = 0x02
+
+# descriptor types of Usb2DescContext not sent to the host
+_DSC_SENTINEL   = 0xff
+
+# ulpi function control register and the values UlpiLineState writes
+# when entering high-/full-speed
+_REG_FUN_CTL    = 0x04
+_FUN_CTL_HS     = 0x40
+_FUN_CTL_FS     = 0x45
+
+# short description of a SETUP request; 'ifcClass' is the class of the
+# interface addressed by a class request (None if unknown)
+def setupStr(setup, ifcClass = None):
+  return _setupNames( setup, ifcClass )[1]
+
+# return ( key, description ) of a SETUP request; the key is the name
+# of the request w/o parameters (used for statistics)
+def _setupNames(setup, ifcClass = None):
+  rt   = setup[0]
+  req  = setup[1]
+  wVal = setup[2] | ( setup[3] << 8 )
+  wIdx = setup[4] | ( setup[5] << 8 )
+  wLen = setup[6] | ( setup[7] << 8 )
+  typ  = ( rt & 0x60 )
+  if ( typ == 0x20 ):
+    cls = ifcClass
+    if ( cls is None ):
+      # guess; UAC2 requests address a control of an entity
+      cls = IFC_CLASS_AUDIO if ( req in UAC2_REQ_NAMES and ( wIdx >> 8 ) != 0 ) else IFC_CLASS_CDC
+    if   ( cls == IFC_CLASS_AUDIO and req in UAC2_REQ_NAMES ):
+      nam = "UAC2 {} {}".format( "GET" if ( rt & 0x80 ) else "SET", UAC2_REQ_NAMES[req] )
+      return nam, "{}(entity {:d}, CS 0x{:02x}, CN {:d}) wLength {:d}".format(
+                  nam, wIdx >> 8, wVal >> 8, wVal & 0xff, wLen )
+    elif ( cls == IFC_CLASS_CDC and req in CDC_REQ_NAMES ):
+      nam = "CDC {}".format( CDC_REQ_NAMES[req] )
+      return nam, "{}(ifc {:d}) wValue 0x{:04x} wLength {:d}".format( nam, wIdx & 0xff, wVal, wLen )
+    nam = "CLASS_REQ(0x{:02x})".format( req )
+  elif ( typ != 0 ):
+    nam = "VENDOR_REQ(0x{:02x})".format( req )
+  else:
+    nam = USB_REQ_NAMES.get( req, "REQ(0x{:02x})".format( req ) )
+    if ( req == USB_REQ_GET_DESCRIPTOR ):
+      nam = "{}({})".format( nam, USB_DSC_NAMES.get( wVal >> 8, "0x{:02x}".format( wVal >> 8 ) ) )
+      return nam, "{}[{:d}] wLength {:d}".format( nam, wVal & 0xff, wLen )
+    if ( req in ( USB_REQ_SET_ADDRESS, USB_REQ_SET_CONFIGURATION ) ):
+      return nam, "{}({:d})".format( nam, wVal )
+    if ( req == USB_REQ_SET_INTERFACE ):
+      return nam, "{}(ifc {:d}, alt {:d})".format( nam, wIdx, wVal )
+  return nam, "{} wValue 0x{:04x} wIndex 0x{:04x} wLength {:d}".format( nam, wVal, wIdx, wLen )
+
+def _le(b, off, n):
+  return int.from_bytes( b[off : off + n], "little" )
+
+# decode the data of a few well-known class requests (None if there
+# is nothing to decode)
+def dataStr(setup, data, ifcClass = None):
+  req = setup[1]
+  if ( ( setup[0] & 0x60 ) != 0x20 or ifcClass == IFC_CLASS_AUDIO ):
+    return None
+  if   ( req in ( CDC_REQ_SET_LINE_CODING, CDC_REQ_SET_LINE_CODING + 1 ) and len( data ) >= 7 ):
+    return "{:d} baud, {:d}{}{}".format( _le( data, 0, 4 ), data[6],
+           "NOEMS"[data[5]] if data[5] < 5 else "?", ( "1", "1.5", "2" )[data[4]] if data[4] < 3 else "?" )
+  elif ( req == CDC_REQ_SET_LINE_CODING + 2 ):
+    return "DTR {:d}, RTS {:d}".format( setup[2] & 1, ( setup[2] >> 1 ) & 1 )
+  elif ( req == CDC_REQ_GET_NTB_PARAMETERS and len( data ) >= 28 ):
+    return "formats 0x{:x}, in max {:d} div {:d} rem {:d} align {:d}, out max {:d} div {:d} rem {:d} align {:d}, out max dgrams {:d}".format(
+           _le( data, 2, 2 ),
+           _le( data,  4, 4 ), _le( data,  8, 2 ), _le( data, 10, 2 ), _le( data, 12, 2 ),
+           _le( data, 16, 4 ), _le( data, 20, 2 ), _le( data, 22, 2 ), _le( data, 24, 2 ), _le( data, 26, 2 ) )
+  return None
+
+# The descriptors of a Usb2DescContext as served by Usb2StdCtlEp
+class UsbDescImage(object):
+
+  def __init__(self, ctx):
+    # descriptor sets (one per speed; the strings are not part of them)
+    self.sets    = []
+    self.strings = []
+    cur          = []
+    for d in ctx:
+      t = d.bDescriptorType()
+      if   ( t == USB_DSC_STRING ):
+        self.strings.append( d )
+      elif ( t == _DSC_SENTINEL ):
+        if ( len( cur ) > 0 ):
+          self.sets.append( cur )
+        cur = []
+      else:
+        cur.append( d )
+    if ( len( cur ) > 0 ):
+      self.sets.append( cur )
+
+  def _set(self, hiSpeed):
+    if ( len( self.sets ) == 0 ):
+      return None
+    return self.sets[-1] if hiSpeed else self.sets[0]
+
+  def _otherSet(self, hiSpeed):
+    if ( len( self.sets ) < 2 ):
+      return None
+    return self._set( not hiSpeed )
+
+  @staticmethod
+  def _first(dset, typ):
+    for d in dset:
+      if ( d.bDescriptorType() == typ ):
+        return d
+    return None
+
+  # the descriptors making up configuration #n of a set
+  @staticmethod
+  def _config(dset, n):
+    rv = None
+    for d in dset:
+      t = d.bDescriptorType()
+      if   ( t == USB_DSC_CONFIGURATION ):
+        if ( n < 0 ):
+          break
+        if ( n == 0 ):
+          rv = []
+        n -= 1
+      elif ( t in ( USB_DSC_DEVICE, USB_DSC_DEVICE_QUALIFIER ) ):
+        continue
+      if ( not rv is None ):
+        rv.append( d )
+    return rv
+
+  # return ( name, bytes, list of descriptors ) served for a GET_DESCRIPTOR
+  # request (or None if there is none)
+  def lookup(self, typ, idx, hiSpeed = True):
+    spd  = "HS" if hiSpeed else "FS"
+    dset = self._set( hiSpeed )
+    if   ( typ == USB_DSC_STRING ):
+      if ( idx >= len( self.strings ) ):
+        return None
+      d = self.strings[idx]
+      return "{}[{:d}] '{}'".format( d.className(), idx, repr( d ) if not d.isLangId else "LANGID" ), bytes( d.cont ), [ d ]
+    elif ( dset is None ):
+      return None
+    elif ( typ in ( USB_DSC_DEVICE, USB_DSC_DEVICE_QUALIFIER ) ):
+      d = self._first( dset, typ )
+      if ( d is None ):
+        return None
+      return "{} ({})".format( d.className(), spd ), bytes( d.cont ), [ d ]
+    elif ( typ in ( USB_DSC_CONFIGURATION, USB_DSC_OTHER_SPEED ) ):
+      if ( typ == USB_DSC_OTHER_SPEED ):
+        dset = self._otherSet( hiSpeed )
+        spd  = "FS" if hiSpeed else "HS"
+        if ( dset is None ):
+          return None
+      l = self._config( dset, idx )
+      if ( l is None ):
+        return None
+      b = bytearray()
+      for d in l:
+        b.extend( d.cont )
+      b[1] = typ
+      return "{}[{:d}] ({}, {:d} descriptors)".format( l[0].className(), idx, spd, len( l ) ), bytes( b ), l
+    return None
+
+  # class of interface 'ifc' (None if unknown)
+  def ifcClass(self, ifc, hiSpeed = True):
+    dset = self._set( hiSpeed )
+    for d in ( dset or [] ):
+      if ( d.bDescriptorType() == 0x04 and d.bInterfaceNumber() == ifc ):
+        return d.bInterfaceClass()
+    return None
+
+# compare the bytes returned for a GET_DESCRIPTOR request with the
+# expected ones; return a description of the first difference (None
+# if they match)
+def _descCheck(exp, lst, got, wLen):
+  exp = exp[:wLen]
+  n   = min( len( exp ), len( got ) )
+  for i in range( n ):
+    if ( exp[i] != got[i] ):
+      off = i
+      for d in lst:
+        if ( off < len( d.cont ) ):
+          fld = d.nameAt( off )
+          return "MISMATCH @{:d} ({}+{:d}{}): expected 0x{:02x}, got 0x{:02x}".format(
+                 i, d.className(), off, "" if fld is None else " " + fld, exp[i], got[i] )
+        off -= len( d.cont )
+      return "MISMATCH @{:d}".format( i )
+  if ( len( got ) != len( exp ) ):
+    return "LENGTH: expected {:d}, got {:d}".format( len( exp ), len( got ) )
+  return None
+
+# A control request:
+#  addr, endp
+#  setup       : SETUP data
+#  name        : request name (w/o parameters)
+#  what        : description
+#  data        : data stage (delivered bytes)
+#  first, last : packet indices of the SETUP and last transaction
+#  t0          : time of the SETUP (or None)
+#  tRsp        : time of the device's answer (or None)
+#  t1          : time of the last transaction (or None)
+#  naks        : NAKed transactions
+#  status      : XFER_OK, XFER_STALL, XFER_ABORT (see UlpiTransactions)
+#  desc        : name of the descriptor served (GET_DESCRIPTOR; or None)
+#  check       : result of the descriptor check (None: OK or not checked)
+class UsbControlRequest(object):
+
+  __slots__ = ( "addr", "endp", "setup", "name", "what", "data", "first", "last",
+                "t0", "tRsp", "t1", "naks", "status", "desc", "check",
+                "_tgl", "_ifcCls" )
+
+  def __init__(self, tr, t0):
+    self.addr    = tr.addr
+    self.endp    = tr.endp
+    self.setup   = bytes( tr.data )
+    self.name    = None
+    self.what    = None
+    self.data    = bytearray()
+    self.first   = tr.idx
+    self.last    = tr.idx
+    self.t0      = t0
+    self.tRsp    = None
+    self.t1      = t0
+    self.naks    = 0
+    self.status  = None
+    self.desc    = None
+    self.check   = None
+    self._tgl    = PID_DATA1
+    self._ifcCls = None
+
+  @property
+  def isIn(self):
+    return ( self.setup[0] & 0x80 ) != 0
+
+  @property
+  def wLength(self):
+    return self.setup[6] | ( self.setup[7] << 8 )
+
+  # cycles from SETUP to the answer / end of the status stage (or None)
+  @property
+  def latency(self):
+    return None if ( self.tRsp is None or self.t0 is None ) else self.tRsp - self.t0
+
+  @property
+  def duration(self):
+    return None if ( self.t0 is None ) else self.t1 - self.t0
+
+  def __str__(self):
+    s = "#{:d}-#{:d} {:3d}/{:2d} {} [{}]".format( self.first, self.last, self.addr, self.endp, self.what, self.status )
+    d = dataStr( self.setup, self.data, self._ifcCls )
+    if ( not d is None ):
+      s += " " + d
+    if ( not self.desc is None ):
+      s += " -> " + self.desc
+    if ( not self.check is None ):
+      s += " " + self.check
+    return s
+
+# Latency statistics of one request type
+class CtlReqStats(object):
+
+  def __init__(self, name):
+    self.name   = name
+    self.count  = 0
+    self.naks   = 0
+    self.errors = 0
+    self.lats   = []
+
+  def add(self, r):
+    self.count += 1
+    self.naks  += r.naks
+    if ( r.status != XFER_OK or not r.check is None ):
+      self.errors += 1
+    if ( not r.latency is None ):
+      self.lats.append( r.latency )
+
+class UsbControlDecoder(object):
+
+  # 'ctx'    : Usb2DescContext of the firmware (or None)
+  # 'timeFn' : maps a packet index to its time (ulpi clock cycles)
+  # 'hiSpeed': speed assumed until UlpiLineState switches it
+  def __init__(self, ctx = None, timeFn = None, hiSpeed = True):
+    self._img     = None if ctx is None else UsbDescImage( ctx )
+    self._timeFn  = timeFn
+    self._dec     = UsbTransactionDecoder()
+    self._n       = 0
+    self._pend    = dict()
+    self.hiSpeed  = hiSpeed
+    # list of completed UsbControlRequest
+    self.requests = []
+
+  def _time(self, idx):
+    return None if self._timeFn is None else self._timeFn( idx )
+
+  def feed(self, pkt):
+    if ( isinstance( pkt, UlpiGap ) ):
+      for tr in self._dec.feed( pkt ):
+        self._xact( tr )
+      self._abort()
+      return
+    data, isRx = pkt
+    self._n   += 1
+    if ( not isRx and len( data ) >= 2 and pktKind( data, isRx )[0] == KIND_REGW
+         and ( data[0] & 0x3f ) == _REG_FUN_CTL and data[1] in ( _FUN_CTL_HS, _FUN_CTL_FS ) ):
+      self.hiSpeed = ( data[1] == _FUN_CTL_HS )
+    for tr in self._dec.feed( pkt ):
+      self._xact( tr )
+
+  def _xact(self, tr):
+    key = ( tr.addr, tr.endp )
+    r   = self._pend.get( key )
+    if ( tr.tok == PID_SETUP ):
+      if ( not r is None ):
+        self._done( key, r, XFER_ABORT )
+      if ( tr.hsk == PID_ACK and tr.nbytes == 8 ):
+        self._pend[key] = UsbControlRequest( tr, self._time( tr.idx ) )
+      return
+    if ( r is None or tr.tok == PID_PING ):
+      return
+    r.last = tr.last
+    r.t1   = self._time( tr.last )
+    if ( tr.hsk == PID_NAK ):
+      r.naks += 1
+      return
+    if ( tr.hsk == PID_STALL ):
+      if ( r.tRsp is None ):
+        r.tRsp = r.t1
+      self._done( key, r, XFER_STALL )
+      return
+    if ( tr.isIn == r.isIn and r.wLength > 0 ):
+      # data stage
+      if ( tr.isIn and r.tRsp is None and not tr.dat is None ):
+        r.tRsp = self._time( tr.dIdx )
+      if ( tr.dat == r._tgl and tr.hsk in ( PID_ACK, PID_NYET ) ):
+        r.data.extend( bytes( tr.data ) )
+        r._tgl = PID_DATA0 if r._tgl == PID_DATA1 else PID_DATA1
+    elif ( not tr.dat is None ):
+      # status stage
+      if ( not r.isIn and r.tRsp is None ):
+        r.tRsp = self._time( tr.dIdx )
+      if ( tr.hsk == PID_ACK ):
+        self._done( key, r, XFER_OK )
+
+  def _done(self, key, r, status):
+    del self._pend[key]
+    r.status = status
+    img      = self._img
+    cls      = None
+    if ( not img is None and ( r.setup[0] & 0x1f ) == 1 ):
+      cls = img.ifcClass( r.setup[4], self.hiSpeed )
+    r._ifcCls        = cls
+    r.name, r.what   = _setupNames( r.setup, cls )
+    if ( not img is None and r.setup[0] == 0x80 and r.setup[1] == USB_REQ_GET_DESCRIPTOR ):
+      found = img.lookup( r.setup[3], r.setup[2], self.hiSpeed )
+      if ( found is None ):
+        r.desc = "(not in context)"
+        if ( status == XFER_OK ):
+          r.check = "UNEXPECTED"
+      else:
+        r.desc = found[0]
+        if   ( status == XFER_OK ):
+          r.check = _descCheck( found[1], found[2], r.data, r.wLength )
+        elif ( status == XFER_STALL ):
+          r.check = "STALLED"
+    self.requests.append( r )
+
+  def _abort(self):
+    for key in list( self._pend ):
+      self._done( key, self._pend[key], XFER_ABORT )
+
+  def flush(self):
+    for tr in self._dec.flush():
+      self._xact( tr )
+    self._abort()
+
+  def run(self, pkts):
+    for p in pkts:
+      self.feed( p )
+    self.flush()
+    return self
+
+  # latency statistics (list of CtlReqStats, slowest first)
+  def stats(self):
+    st = dict()
+    for r in self.requests:
+      s = st.get( r.name )
+      if ( s is None ):
+        s = CtlReqStats( r.name )
+        st[r.name] = s
+      s.add( r )
+    return sorted( st.values(), key = lambda s: ( max( s.lats ) if len( s.lats ) > 0 else -1, s.naks ), reverse = True )
+
+  # print all requests followed by the per-request statistics; 'idxFn'
+  # maps the packet indices (e.g., to the capture if only part of it
+  # was fed)
+  def report(self, f = sys.stdout, idxFn = None):
+    if ( idxFn is None ):
+      idxFn = lambda i: i
+    us = lambda c: "{:10.3f}".format( ulpiCyclesToNs( c ) / 1000.0 ) if not c is None else "{:>10s}".format( "-" )
+    print("   LAT(us)    DUR(us)   NAKS  PACKETS          ADDR EP REQUEST", file = f)
+    for r in self.requests:
+      pkts = "#{:d}-#{:d}".format( idxFn( r.first ), idxFn( r.last ) )
+      s    = str( r )
+      print("{} {} {:6d}  {:16s} {}".format( us( r.latency ), us( r.duration ), r.naks, pkts, s[s.index(" ") + 1:] ), file = f)
+    print("", file = f)
+    print("REQUEST                                    COUNT ERRORS   NAKS  MIN(us)  AVG(us)  MAX(us)", file = f)
+    for s in self.stats():
+      if ( len( s.lats ) > 0 ):
+        lt = "{:8.3f} {:8.3f} {:8.3f}".format( *[ ulpiCyclesToNs( x ) / 1000.0 for x in
+                                               ( min( s.lats ), sum( s.lats ) / len( s.lats ), max( s.lats ) ) ] )
+      else:
+        lt = "{:>8s} {:>8s} {:>8s}".format( "-", "-", "-" )
+      print("{:42s} {:5d} {:6d} {:6d} {}".format( s.name, s.count, s.errors, s.naks, lt ), file = f)
+
+  # number of requests which failed (STALL/ABORT) or returned wrong descriptors
+  @property
+  def errors(self):
+    return sum( [ s.errors for s in self.stats() ] )
+
+# Load the Usb2DescContext of the firmware: 'spec' is the path of a
+# python module defining mkExampleDevDescriptors() (like the ones in
+# example/py) optionally followed by ',<yaml_file>' whose contents are
+# passed to the function.
+def loadDescContext(spec):
+  import os
+  import contextlib
+  import importlib.util
+  l   = spec.split(",")
+  d   = os.path.dirname( os.path.abspath( l[0] ) )
+  if ( not d in sys.path ):
+    sys.path.append( d )
+  ms  = importlib.util.spec_from_file_location( os.path.splitext( os.path.basename( l[0] ) )[0], l[0] )
+  mod = importlib.util.module_from_spec( ms )
+  ms.loader.exec_module( mod )
+  # wrapup() prints a summary
+  with contextlib.redirect_stdout( sys.stderr ):
+    if ( len( l ) > 1 ):
+      import yaml
+      with io.open( l[1] ) as f:
+        return mod.mkExampleDevDescriptors( yaml.safe_load( f ) )
+    return mod.mkExampleDevDescriptors()
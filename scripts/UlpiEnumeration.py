@@ -0,0 +1,174 @@
+# Module to analyze the enumeration of a device in ulpi log captures
+
+# Copyright Till Straumann, 2023. Licensed under the EUPL-1.2 or later.
+# You may obtain a copy of the license at
+#   https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# This notice must not be removed.
+
+# The timeline follows a capture from the reset of the PHY through the
+# bus reset/chirp handshake (visible as writes to the PHY's function
+# control register by UlpiLineState) and the control transfers on EP0
+# up to SET_CONFIGURATION:
+#
+#   FUNC_CTL 0x61 : PHY reset, terminations off   (RESET)
+#   FUNC_CTL 0x45 : full-speed terminations on    (INIT1; also leaving HS)
+#   FUNC_CTL 0x54 : bus reset detected, chirp K   (INIT_CHIRP)
+#   FUNC_CTL 0x40 : high-speed                    (HS_INIT)
+#
+# Every PHY reset (or a bus reset after the device was configured)
+# starts a new run. Steps are timed if the capture has time stamps
+# ('timeFn'); the EP0 NAKs counted during a control transfer reflect
+# the time Usb2StdCtlEp (or the application) was busy.
+#
+#   e = UsbEnumTimeline( timeFn = lambda i: t0[i] )
+#   e.run( UlpiLogParser.open( "capture.bin", recSize = ULPI_REC_SIZE_TS ).packets() )
+#   e.report()
+
+import sys
+
+from UlpiLogParser    import ( UlpiGap, ulpiCyclesToNs, KIND_REGW )
+from UlpiTransactions import ( UsbTransactionDecoder, UsbTransferDecoder, pktKind,
+  XFER_CTL, XFER_OK )
+from UlpiControl      import setupStr, USB_REQ_SET_CONFIGURATION
+
+ULPI_REG_FUN_CTL = 0x04
+
+# function control register values written by UlpiLineState
+FUN_CTL_REINI    = 0x61
+FUN_CTL_CHIRP    = 0x54
+
+FUN_CTL_NAMES = {
+  FUN_CTL_REINI : "PHY_RESET",
+  0x45          : "FS_TERM",
+  FUN_CTL_CHIRP : "BUS_RESET_CHIRP",
+  0x55          : "WAKEUP_K",
+  0x40          : "HS",
+}
+
+# One step of the enumeration:
+#  what        : description
+#  first, last : packet indices
+#  t0, t1      : times (ulpi clock cycles) of the first/last packet (or None)
+#  naks        : EP0 NAKs (control transfers)
+#  status      : transfer status (control transfers; None otherwise)
+class EnumStep(object):
+
+  __slots__ = ( "what", "first", "last", "t0", "t1", "naks", "status" )
+
+  def __init__(self, what, first, last, t0, t1, naks = 0, status = None):
+    self.what   = what
+    self.first  = first
+    self.last   = last
+    self.t0     = t0
+    self.t1     = t1
+    self.naks   = naks
+    self.status = status
+
+# An enumeration: a list of EnumStep objects
+#  configured : whether SET_CONFIGURATION completed
+class EnumRun(list):
+
+  def __init__(self):
+    super().__init__()
+    self.configured = False
+
+  @property
+  def naks(self):
+    return sum( [ s.naks for s in self ] )
+
+  # time (cycles) from the first step to the end of the last one (or None)
+  @property
+  def duration(self):
+    if ( len( self ) == 0 or self[0].t0 is None ):
+      return None
+    return self[-1].t1 - self[0].t0
+
+class UsbEnumTimeline(object):
+
+  # 'timeFn' maps a packet index to its time (ulpi clock cycles)
+  def __init__(self, timeFn = None):
+    self._timeFn = timeFn
+    self._xdec   = UsbTransactionDecoder()
+    # control transfers are never longer than 64 bytes per packet
+    self._tdec   = UsbTransferDecoder( dfltMps = 64 )
+    self._n      = 0
+    # list of EnumRun
+    self.runs    = []
+
+  def _time(self, idx):
+    return None if self._timeFn is None else self._timeFn( idx )
+
+  def _newRun(self):
+    self.runs.append( EnumRun() )
+
+  def _add(self, step):
+    if ( len( self.runs ) == 0 ):
+      self._newRun()
+    self.runs[-1].append( step )
+
+  def feed(self, pkt):
+    if ( isinstance( pkt, UlpiGap ) ):
+      self._xdec.feed( pkt )
+      return
+    data, isRx = pkt
+    idx        = self._n
+    self._n   += 1
+    if ( not isRx and len( data ) >= 2 and pktKind( data, isRx )[0] == KIND_REGW
+         and ( data[0] & 0x3f ) == ULPI_REG_FUN_CTL ):
+      val = data[1]
+      cur = self.runs[-1] if len( self.runs ) > 0 else None
+      new = ( val == FUN_CTL_REINI or ( val == FUN_CTL_CHIRP and not cur is None and cur.configured ) )
+      if ( new ):
+        self._newRun()
+      if ( new or cur is None or not cur.configured ):
+        t = self._time( idx )
+        self._add( EnumStep( "FUNC_CTL 0x{:02x} {}".format( val, FUN_CTL_NAMES.get( val, "" ) ), idx, idx, t, t ) )
+    # the decoder numbers all packets
+    for tr in self._xdec.feed( pkt ):
+      self._xfer( tr, idx )
+
+  def _xfer(self, tr, idx):
+    for x in self._tdec.feed( tr ):
+      if ( x.typ != XFER_CTL or x.endp != 0 or x.setup is None ):
+        continue
+      cur = self.runs[-1] if len( self.runs ) > 0 else None
+      if ( not cur is None and cur.configured ):
+        continue
+      # the transfer completes with the current packet (handshake)
+      self._add( EnumStep( setupStr( x.setup ), x.first, idx, self._time( x.first ), self._time( idx ), x.naks, x.status ) )
+      if ( x.setup[1] == USB_REQ_SET_CONFIGURATION and ( x.setup[2] | x.setup[3] ) != 0
+           and x.status == XFER_OK and ( x.setup[0] & 0x60 ) == 0 ):
+        self.runs[-1].configured = True
+
+  def flush(self):
+    for tr in self._xdec.flush():
+      self._xfer( tr, self._n - 1 )
+
+  def run(self, pkts):
+    for p in pkts:
+      self.feed( p )
+    self.flush()
+    return self
+
+  # print the timeline; 'idxFn' maps the packet indices (e.g., to the
+  # capture if only part of it was fed)
+  def report(self, f = sys.stdout, idxFn = None):
+    if ( idxFn is None ):
+      idxFn = lambda i: i
+    us = lambda c: "{:12.3f}".format( ulpiCyclesToNs( c ) / 1000.0 ) if not c is None else "{:>12s}".format( "-" )
+    for n, r in enumerate( r for r in self.runs if len( r ) > 0 ):
+      print("ENUMERATION #{:d}".format( n ), file = f)
+      print("    START(us)      DUR(us)     IDLE(us)   NAKS  PACKETS          STEP", file = f)
+      prev = None
+      for s in r:
+        st   = None if s.t0 is None else s.t0 - r[0].t0
+        dur  = None if s.t0 is None else s.t1 - s.t0
+        idle = None if s.t0 is None or prev is None else s.t0 - prev.t1
+        pkts = "#{:d}-#{:d}".format( idxFn( s.first ), idxFn( s.last ) )
+        print("{} {} {} {:6d}  {:16s} {}{}".format( us( st ), us( dur ), us( idle ), s.naks, pkts, s.what,
+              "" if s.status in ( None, XFER_OK ) else " [{}]".format( s.status ) ), file = f)
+        prev = s
+      d = r.duration
+      print("  {}: {} ms, EP0 NAKs: {:d}".format(
+            "time to configured" if r.configured else "NOT CONFIGURED; elapsed",
+            "-" if d is None else "{:.3f}".format( ulpiCyclesToNs( d ) / 1.0e6 ), r.naks ), file = f)
@@ -0,0 +1,231 @@
+# Module to export ulpi log packets to text, JSON-lines or CSV
+
+# Copyright Till Straumann, 2023. Licensed under the EUPL-1.2 or later.
+# You may obtain a copy of the license at
+#   https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# This notice must not be removed.
+
+# Exporters write packets (as produced by UlpiLogParser or
+# UlpiStreamParser) to any file-like object. Rows are formatted in bulk
+# and collected in a buffer which is written out once it exceeds
+# 'bufSize' characters, i.e., memory use is bounded.
+#
+#   with JsonlExporter( io.open( "capture.jsonl", "w" ) ) as ex:
+#     ex.writePkts( UlpiLogParser.open( "capture.bin" ).packets() )
+#
+# The 'text' format is identical to the output of UlpiLogParser.dump().
+# The 'pcap' exporter produces a binary file (open the target in binary
+# mode) which can be loaded into wireshark/tshark.
+
+import sys
+import time
+import struct
+
+from UlpiLogParser   import ( UlpiLogParser, UlpiGap, KIND_PKT, KIND_NOOP, KIND_REGW, KIND_REGR, KIND_REGD )
+from UlpiTransactions import pktKind
+
+KIND_NAMES = {
+  KIND_PKT  : "PKT",
+  KIND_NOOP : "NOOP",
+  KIND_REGW : "REGW",
+  KIND_REGR : "REGR",
+  KIND_REGD : "REGD",
+}
+
+class UlpiExporter(object):
+
+  # whether the target file must be opened in binary mode
+  binary = False
+
+  def __init__(self, f = None, bufSize = 1 << 20, verbose = True):
+    self._f       = sys.stdout if f is None else f
+    self._bufSize = bufSize
+    self._verbose = verbose
+    self._rows    = []
+    self._len     = 0
+    self._idx     = 0
+    self._regr    = False
+    hdr = self.header()
+    if ( not hdr is None ):
+      self._append( hdr )
+
+  # optional header row (override)
+  def header(self):
+    return None
+
+  # format a packet (override); 'idx' is the packet number, 'kind'
+  # and 'pid' as returned by pktKind() (but register read replies are
+  # KIND_REGD)
+  def fmt(self, idx, pkt, kind, pid):
+    raise NotImplementedError()
+
+  # format a gap marker (UlpiGap); None if the format has no
+  # representation for gaps (override)
+  def fmtGap(self, gap):
+    return None
+
+  def _append(self, s):
+    if ( s is None ):
+      return
+    self._rows.append( s )
+    self._len += len( s )
+    if ( self._len >= self._bufSize ):
+      self.flush()
+
+  # write a packet; 'idx' (if given) is its packet number
+  def write(self, pkt, idx = None):
+    if ( isinstance( pkt, UlpiGap ) ):
+      self._regr = False
+      self._append( self.fmtGap( pkt ) )
+      return
+    if ( not idx is None ):
+      self._idx = idx
+    data, isRx = pkt
+    if   ( len( data ) == 0 ):
+      kind, pid = KIND_PKT, None
+    elif ( isRx and self._regr ):
+      kind, pid = KIND_REGD, None
+    else:
+      kind, pid = pktKind( data, isRx )
+    self._regr = ( kind == KIND_REGR )
+    self._append( self.fmt( self._idx, pkt, kind, pid ) )
+    self._idx += 1
+
+  # write all packets of 'pkts'; 'first' (if given) is the
+  # packet number of the first one
+  def writePkts(self, pkts, first = None):
+    if ( not first is None ):
+      self._idx = first
+    for p in pkts:
+      self.write( p )
+
+  # write ( idx, packet ) records (e.g., from UlpiLogParser.filtered());
+  # records with idx None are numbered consecutively starting at 'first'
+  def writeRecs(self, recs, first = None):
+    if ( not first is None ):
+      self._idx = first
+    for i, p in recs:
+      self.write( p, i )
+
+  def flush(self):
+    if ( len( self._rows ) > 0 ):
+      self._f.write( ( b"" if self.binary else "" ).join( self._rows ) )
+      self._rows = []
+      self._len  = 0
+    self._f.flush()
+
+  def close(self):
+    self.flush()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+    return False
+
+# Human-readable text (same as UlpiLogParser.dump); the data bytes
+# are only listed if 'verbose' is set.
+class TextExporter(UlpiExporter):
+
+  def __init__(self, f = None, bufSize = 1 << 20, verbose = False):
+    super().__init__( f, bufSize, verbose )
+
+  def fmt(self, idx, pkt, kind, pid):
+    return UlpiLogParser.fmt( pkt, self._verbose )
+
+  def fmtGap(self, gap):
+    return "--- {} ---\n".format( gap )
+
+def _pidName(pid):
+  return "" if pid is None else UlpiLogParser.pidTbl[pid]
+
+# One JSON object per line:
+#  {"idx": <n>, "dir": "RX"|"TX", "kind": "PKT"|..., "pid": "DATA0", "len": <n>, "data": "<hex>"}
+# 'pid' is empty if the packet is not a (valid) USB packet; 'data' (all
+# bytes of the packet) is omitted unless 'verbose' is set.
+class JsonlExporter(UlpiExporter):
+
+  def fmt(self, idx, pkt, kind, pid):
+    data, isRx = pkt
+    s = '{{"idx": {:d}, "dir": "{}", "kind": "{}", "pid": "{}", "len": {:d}'.format(
+        idx, "RX" if isRx else "TX", KIND_NAMES[kind], _pidName( pid ), len( data ) )
+    if ( self._verbose ):
+      s += ', "data": "{}"'.format( bytes( data ).hex() )
+    return s + "}\n"
+
+  # {"gap": <dump>, "lost": true|false, "cycles": <n>|null, "uncertain": true|false}
+  def fmtGap(self, gap):
+    return '{{"gap": {:d}, "lost": {}, "cycles": {}, "uncertain": {}}}\n'.format(
+      gap.dump, "true" if gap.lost else "false", "null" if gap.cycles is None else gap.cycles,
+      "true" if gap.uncertain else "false" )
+
+# CSV with a header row; columns as for JsonlExporter
+class CsvExporter(UlpiExporter):
+
+  def header(self):
+    return "idx,dir,kind,pid,len" + ( ",data\n" if self._verbose else "\n" )
+
+  def fmt(self, idx, pkt, kind, pid):
+    data, isRx = pkt
+    s = "{:d},{},{},{},{:d}".format( idx, "RX" if isRx else "TX", KIND_NAMES[kind], _pidName( pid ), len( data ) )
+    if ( self._verbose ):
+      s += "," + bytes( data ).hex()
+    return s + "\n"
+
+# LINKTYPE_USB_2_0
+PCAP_LINKTYPE_USB_2_0 = 288
+# nanosecond-resolution pcap
+PCAP_MAGIC_NSEC       = 0xa1b23c4d
+
+# pcap file with link type USB 2.0 (wireshark: 'usbll' dissector).
+# Every record holds one USB packet (PID, payload, CRC) as seen on the
+# wire; register accesses are skipped. Packets are time-stamped with
+# 'tsBase' (ns since the epoch; default: now) plus the time passed to
+# write() (ns) or, if none is passed, 'tsFn( idx )' (ns) where 'idx' is
+# the packet number (e.g., derived from UlpiLogParser.times()) -- if the
+# capture carries no time information then all packets get the same
+# time stamp. At most 'snapLen' bytes of every packet are stored.
+class PcapExporter(UlpiExporter):
+
+  binary = True
+
+  def __init__(self, f = None, bufSize = 1 << 20, verbose = True, tsBase = None, snapLen = 65535, tsFn = None):
+    self._tsBase  = time.time_ns() if tsBase is None else tsBase
+    self._snapLen = snapLen
+    self._tsFn    = tsFn
+    super().__init__( f, bufSize, verbose )
+
+  def header(self):
+    return struct.pack( "<IHHiIII", PCAP_MAGIC_NSEC, 2, 4, 0, 0, self._snapLen, PCAP_LINKTYPE_USB_2_0 )
+
+  def write(self, pkt, idx = None, ts = None):
+    self._ts = ts
+    super().write( pkt, idx )
+
+  def fmt(self, idx, pkt, kind, pid):
+    if ( kind != KIND_PKT or pid is None ):
+      return None
+    data, isRx = pkt
+    if ( isRx ):
+      b = bytes( data )
+    else:
+      # ulpi TX command -> PID
+      b = bytes( [ pid | ( ( ~ pid & 0xf ) << 4 ) ] ) + bytes( data[1:] )
+    if ( not self._ts is None ):
+      t = self._tsBase + self._ts
+    elif ( not self._tsFn is None ):
+      t = self._tsBase + self._tsFn( idx )
+    else:
+      t = self._tsBase
+    # packets longer than the snap length are truncated (the original
+    # length is still recorded)
+    n = min( len( b ), self._snapLen )
+    return struct.pack( "<IIII", t // 1000000000, t % 1000000000, n, len( b ) ) + b[:n]
+
+EXPORTERS = {
+  "text"  : TextExporter,
+  "jsonl" : JsonlExporter,
+  "csv"   : CsvExporter,
+  "pcap"  : PcapExporter,
+}
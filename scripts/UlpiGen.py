@@ -0,0 +1,673 @@
+# Module to generate synthetic ulpi log captures
+
+# Copyright Till Straumann, 2023. Licensed under the EUPL-1.2 or later.
+# You may obtain a copy of the license at
+#   https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# This notice must not be removed.
+
+# The generator produces byte streams in the format written by the
+# UlpiLogger (see UlpiLogParser.py) from a scripted or randomized mix of
+# transactions as seen by a high-speed device:
+#
+#   with io.open( "synth.bin", "wb" ) as f:
+#     g = UlpiGen( f, seed = 1 )
+#     g.bulkIn( ep = 1, nbytes = 65536 )
+#     g.nakStorm( ep = 2, count = 100 )
+#     g.random( 1 << 30 )
+#     g.flush()
+#
+# Records are assembled from pre-encoded templates (the payloads are
+# drawn from a pool of random payloads per size whose CRCs are computed
+# once), i.e., the generator mostly joins byte strings and writes them
+# out in large blocks. Common transactions (and blocks of NAKs or
+# isochronous microframes) are cached as a whole in a few variants
+# (with different gaps and payloads). Only the transactions selected
+# for error injection are generated packet by packet; the per-packet
+# rates are scaled up accordingly so that the overall rates match the
+# requested ones.
+#
+# Record types (as produced by the logger):
+#   RX packet    : ( byte, DIR )...,  ( 0x00, 0 )       end marker
+#   TX packet    : ( 0x40|pid, 0 ), ( byte, 0 )...,  ( 0x00, DIR )   stop
+#   register wr. : ( 0x80|reg, 0 ), ( val,  0 ),     ( 0x00, DIR )   stop
+#   register rd. : ( 0xC0|reg, 0 ), ( 0x00, DIR ), ( val, DIR ), ( 0x00, 0 )
+#
+# Time-stamped records (recSize = ULPI_REC_SIZE_TS) carry the cycles
+# elapsed since the previous record; packet bytes are one cycle apart,
+# inter-packet gaps are randomized.
+
+import sys
+import random
+import numpy as np
+
+from UlpiLogParser import ( ULPI_REC_SIZE, ULPI_REC_SIZE_TS,
+  PID_OUT, PID_ACK, PID_DATA0, PID_PING, PID_SOF, PID_NYET, PID_IN,
+  PID_NAK, PID_DATA1, PID_SETUP )
+from UsbCrc        import crc5, crc16
+
+# number of distinct random payloads per packet size
+GEN_PAYLOAD_VARIANTS = 16
+
+# number of cached variants per transaction template
+GEN_XACT_VARIANTS    = 8
+
+# transactions per NAK storm / microframes per isochronous template
+GEN_STORM_BLOCK      = 32
+GEN_ISO_BLOCK        = 8
+
+# fraction of transactions generated packet by packet (relative to the
+# sum of the injection rates)
+GEN_SLOW_FACTOR      = 4.0
+
+# ulpi clock cycles per microframe
+GEN_UFRAME_CYCLES    = 7500
+
+# default mix of the random() generator (relative weights)
+GEN_DEFAULT_MIX = {
+  "bulkIn"   : 8,
+  "bulkOut"  : 8,
+  "nakStorm" : 2,
+  "iso"      : 4,
+  "reg"      : 1,
+  "control"  : 1,
+}
+
+def _pidByte(pid):
+  return pid | ( ( ~ pid & 0xf ) << 4 )
+
+class UlpiGen(object):
+
+  # 'f'          : binary file-like object to write to
+  # 'seed'       : random seed
+  # 'recSize'    : ULPI_REC_SIZE or ULPI_REC_SIZE_TS (time-stamped)
+  # 'addr'       : device address
+  # 'crcErrRate' : probability of a corrupted CRC (tokens, data)
+  # 'tornRate'   : probability of a torn (truncated) packet
+  # 'nullRate'   : probability of NULL markers (RXCMD) following an
+  #                RX packet
+  #                (all rates must be in [0, 1); corrupted packets are
+  #                retried until they get through)
+  # 'sof'        : emit SOF tokens (i.e., UlpiLogger w/o DROP_SOF_G)
+  # 'bufSize'    : output buffer size
+  def __init__(self, f, seed = None, recSize = ULPI_REC_SIZE, addr = 1, crcErrRate = 0.0, tornRate = 0.0,
+               nullRate = 0.0, sof = False, bufSize = 8 << 20):
+    for nm, r in ( ( "crcErrRate", crcErrRate ), ( "tornRate", tornRate ), ( "nullRate", nullRate ) ):
+      if ( not ( 0.0 <= r < 1.0 ) ):
+        raise ValueError("UlpiGen: {} must be in [0, 1) (got {})".format( nm, r ))
+    self._f       = f
+    self._rnd     = random.Random( seed )
+    self._rsz     = recSize
+    self._addr    = addr
+    self._crcErr  = crcErrRate
+    self._torn    = tornRate
+    self._null    = nullRate
+    # probability of a transaction to be generated packet by packet
+    # and scale factor for the injection rates of the current one
+    self._slow    = min( 1.0, GEN_SLOW_FACTOR * ( crcErrRate + tornRate + nullRate ) )
+    self._boost   = 1.0
+    self._sof     = sof
+    self._bufSize = bufSize
+    self._out     = []
+    self._len     = 0
+    self._tmpl    = dict()
+    self._heads   = dict()
+    self._xtmpl   = dict()
+    self._pool    = dict()
+    self._tgl     = dict()
+    # time (cycles), pending idle time, time of the next SOF and
+    # frame number
+    self._t       = 0
+    self._pend    = 0
+    self._tSof    = 0
+    self._frame   = 0
+    # statistics
+    self.written  = 0
+    self.packets  = 0
+    self.crcErrs  = 0
+    self.torn     = 0
+
+  # convert a list of ( byte, flag ) pairs into records with all deltas = 1
+  def _recs(self, pairs):
+    a = np.array( pairs, dtype = np.uint8 ).reshape( -1, 2 )
+    if ( self._rsz >= ULPI_REC_SIZE_TS ):
+      a = np.hstack( ( a, np.tile( np.array( [ 1, 0 ], dtype = np.uint8 ), ( len( a ), 1 ) ) ) )
+    return a.tobytes()
+
+  # first record of a packet with a delta of 'gap' cycles
+  def _head(self, byte, flag, gap):
+    if ( self._rsz < ULPI_REC_SIZE_TS ):
+      gap = 0
+    else:
+      gap = min( gap, 0xffff )
+    k = ( byte, flag, gap )
+    h = self._heads.get( k )
+    if ( h is None ):
+      if ( self._rsz < ULPI_REC_SIZE_TS ):
+        h = bytes( [ byte, flag ] )
+      else:
+        h = bytes( [ byte, flag, gap & 0xff, gap >> 8 ] )
+      self._heads[k] = h
+    return h
+
+  def _emit(self, b):
+    self._out.append( b )
+    self._len += len( b )
+    if ( self._len >= self._bufSize ):
+      self.flush()
+
+  # emit a packet (head + rest records) 'gap' cycles (plus pending idle
+  # time) after the previous one
+  def _pkt(self, byte, flag, rest, gap, isRx):
+    rnd = self._rnd
+    n   = len( rest ) // self._rsz + 1
+    gap += self._pend
+    self._pend = 0
+    if ( self._torn > 0.0 and rnd.random() < self._torn * self._boost ):
+      # recording interrupted; the tail of the payload is lost but the
+      # terminator still delimits the packet
+      rest       = rest[ : self._rsz * rnd.randrange( n - 1 ) ] + rest[ len( rest ) - self._rsz : ]
+      self.torn += 1
+    self._emit( self._head( byte, flag, gap ) )
+    self._emit( rest )
+    self._t      += gap + n - 1
+    self.packets += 1
+    if ( isRx and self._null > 0.0 and rnd.random() < self._null * self._boost ):
+      self._emit( self._recs( [ 0, 0 ] * rnd.randint( 1, 4 ) ) )
+
+  def _corrupt(self):
+    if ( self._crcErr > 0.0 and self._rnd.random() < self._crcErr * self._boost ):
+      self.crcErrs += 1
+      return True
+    return False
+
+  # start a transaction; returns True if it is to be emitted from a
+  # template, False if it is generated packet by packet (with errors
+  # injected at the scaled-up rates)
+  def _xbegin(self):
+    if ( self._slow > 0.0 and self._rnd.random() < self._slow ):
+      self._boost = 1.0 / self._slow
+      return False
+    self._boost = 0.0
+    return True
+
+  def _xend(self):
+    self._boost = 1.0
+
+  # emit a (cached) transaction template; 'build' returns its packets as a
+  # list of ( byte, flag, rest, gap ) tuples. The gap of the first packet
+  # may be None (random gap at emission time). If 'period' is nonzero the
+  # template is padded with idle time to occupy 'period' cycles (counted
+  # from the end of the pending idle time).
+  def _xact(self, key, build, period = 0):
+    k = ( key, int( self._rnd.random() * GEN_XACT_VARIANTS ) )
+    x = self._xtmpl.get( k )
+    if ( x is None ):
+      p    = build()
+      body = b''.join( [ p[0][2] ] + [ self._head( b, f, g ) + r for b, f, r, g in p[1:] ] )
+      cyc  = sum( [ len( r ) // self._rsz for b, f, r, g in p ] ) + sum( [ g for b, f, r, g in p[1:] ] )
+      x    = ( p[0][0], p[0][1], body, cyc, len( p ), p[0][3] )
+      self._xtmpl[k] = x
+    gap = self._sofs( self._gapXact() if x[5] is None else x[5] )
+    out = self._out
+    out.append( self._head( x[0], x[1], gap ) )
+    out.append( x[2] )
+    self._len += len( x[2] ) + self._rsz
+    if ( self._len >= self._bufSize ):
+      self.flush()
+    self._t      += gap + x[3]
+    self.packets += x[4]
+    if ( period > 0 ):
+      self._wait( max( period - x[5] - x[3], 0 ) )
+
+  # packet specs for templates
+  def _sTok(self, pid, endp, gap = None):
+    return ( _pidByte( pid ), 1, self._tokRest( self._addr, endp, False ), gap )
+
+  def _sHsk(self, pid, isRx):
+    if ( isRx ):
+      return ( _pidByte( pid ), 1, self._rest( ( "hsk", True ), [ 0, 0 ] ), self._gapRsp() )
+    return ( 0x40 | pid, 0, self._rest( ( "hsk", False ), [ 0, 1 ] ), self._gapRsp() )
+
+  def _sDat(self, pid, size, isRx):
+    t = self._datTmpl( size, isRx, False )
+    if ( isRx ):
+      return ( _pidByte( pid ), 1, t, self._gapRsp() )
+    return ( 0x40 | pid, 0, t, self._gapRsp() )
+
+  # template of the records following the PID/TX command
+  def _rest(self, key, pairs):
+    t = self._tmpl.get( key )
+    if ( t is None ):
+      t = self._recs( pairs )
+      self._tmpl[key] = t
+    return t
+
+  def _gapRsp(self):
+    # turnaround (packet -> response of the other side)
+    return 8 + int( self._rnd.random() * 33 )
+
+  def _gapXact(self):
+    # between transactions
+    return 4 + int( self._rnd.random() * 197 )
+
+  # idle time ahead of the next packet
+  def _wait(self, cycles):
+    self._pend += cycles
+
+  # emit the SOFs which are due before a transaction starting 'gap'
+  # cycles (plus pending idle time) from now; returns the remaining gap
+  def _sofs(self, gap):
+    gap       += self._pend
+    self._pend = 0
+    if ( self._sof ):
+      while ( self._t + gap >= self._tSof ):
+        g    = max( self._tSof - self._t, 1 )
+        gap -= g
+        self._sof1( g )
+    return max( gap, 1 )
+
+  def _sof1(self, gap):
+    fn          = self._frame >> 3
+    self._frame = ( self._frame + 1 ) & 0x3fff
+    self._tSof += GEN_UFRAME_CYCLES
+    self._pkt( _pidByte( PID_SOF ), 1, self._tokRest( fn & 0x7f, fn >> 7, False ), gap, True )
+
+  def _tokRest(self, addr, endp, bad):
+    k = ( "tok", addr, endp, bad )
+    t = self._tmpl.get( k )
+    if ( t is None ):
+      v = addr | ( endp << 7 )
+      v = v | ( crc5( v ) << 11 )
+      if ( bad ):
+        v ^= 0x8000
+      t = self._rest( k, [ v & 0xff, 1, v >> 8, 1, 0, 0 ] )
+    return t
+
+  # token (RX); returns False if it was corrupted (no response)
+  def token(self, pid, endp, addr = None, gap = None):
+    if ( addr is None ):
+      addr = self._addr
+    gap  = self._sofs( self._gapXact() if gap is None else gap )
+    bad  = self._corrupt()
+    self._pkt( _pidByte( pid ), 1, self._tokRest( addr, endp, bad ), gap, True )
+    return not bad
+
+  # handshake; 'isRx': sent by the host
+  def handshake(self, pid, isRx, gap = None):
+    gap = self._gapRsp() if gap is None else gap
+    if ( isRx ):
+      self._pkt( _pidByte( pid ), 1, self._rest( ( "hsk", True ), [ 0, 0 ] ), gap, True )
+    else:
+      self._pkt( 0x40 | pid, 0, self._rest( ( "hsk", False ), [ 0, 1 ] ), gap, False )
+
+  # random payload #v of 'size' bytes (and its CRC16)
+  def _payload(self, size, v):
+    k = ( size, v )
+    p = self._pool.get( k )
+    if ( p is None ):
+      d = bytes( self._rnd.getrandbits( 8 ) for i in range( size ) )
+      p = ( d, crc16( d ) )
+      self._pool[k] = p
+    return p
+
+  # data packet with a random payload of 'size' bytes; 'isRx': sent by
+  # the host. Returns False if the CRC was corrupted.
+  def data(self, pid, size, isRx, gap = None, payload = None):
+    gap = self._gapRsp() if gap is None else gap
+    bad = self._corrupt()
+    if ( payload is None ):
+      t = self._datTmpl( size, isRx, bad )
+    else:
+      t = self._datRest( None, payload, crc16( payload ), isRx, bad )
+    if ( isRx ):
+      self._pkt( _pidByte( pid ), 1, t, gap, True )
+    else:
+      self._pkt( 0x40 | pid, 0, t, gap, False )
+    return not bad
+
+  # data records (random payload variant)
+  def _datTmpl(self, size, isRx, bad):
+    v = self._rnd.randrange( GEN_PAYLOAD_VARIANTS )
+    k = ( "dat", size, v, isRx, bad )
+    t = self._tmpl.get( k )
+    if ( t is None ):
+      d, c = self._payload( size, v )
+      t    = self._datRest( k, d, c, isRx, bad )
+    return t
+
+  def _datRest(self, key, d, c, isRx, bad):
+    if ( bad ):
+      c ^= 0x0001
+    f = 1 if isRx else 0
+    p = np.empty( 2 * ( len( d ) + 2 ), dtype = np.uint8 )
+    p[0::2] = np.frombuffer( bytes( d ) + bytes( [ c & 0xff, c >> 8 ] ), dtype = np.uint8 )
+    p[1::2] = f
+    p       = p.tolist() + ( [ 0, 0 ] if isRx else [ 0, 1 ] )
+    if ( key is None ):
+      return self._recs( p )
+    return self._rest( key, p )
+
+  def regWrite(self, reg, val, gap = None):
+    gap = self._gapXact() if gap is None else gap
+    self._pkt( 0x80 | ( reg & 0x3f ), 0, self._rest( ( "regw", val ), [ val, 0, 0, 1 ] ), gap, False )
+
+  def regRead(self, reg, val, gap = None):
+    gap = self._gapXact() if gap is None else gap
+    self._pkt( 0xc0 | ( reg & 0x3f ), 0, self._rest( ( "regr", ), [ 0, 1 ] ), gap, False )
+    self._pkt( val, 1, self._rest( ( "hsk", True ), [ 0, 0 ] ), 1, True )
+
+  def _toggle(self, key):
+    return PID_DATA1 if self._tgl.get( key, 0 ) else PID_DATA0
+
+  def _flip(self, key):
+    self._tgl[key] = self._tgl.get( key, 0 ) ^ 1
+
+  # bulk IN transfer of 'nbytes'; the device NAKs with probability 'nakRate'
+  def bulkIn(self, ep, nbytes, mps = 512, nakRate = 0.0):
+    key = ( ep, True )
+    while True:
+      fast = self._xbegin()
+      nak  = ( nakRate > 0.0 and self._rnd.random() < nakRate )
+      n    = min( nbytes, mps )
+      tgl  = self._toggle( key )
+      if ( fast and nak ):
+        self._xact( ( "inNak", ep ),
+                    lambda: [ self._sTok( PID_IN, ep ), self._sHsk( PID_NAK, False ) ] )
+        continue
+      if ( fast and n == mps ):
+        self._xact( ( "in", ep, tgl, n ),
+                    lambda: [ self._sTok( PID_IN, ep ), self._sDat( tgl, n, False ), self._sHsk( PID_ACK, True ) ] )
+      else:
+        if ( not self.token( PID_IN, ep ) ):
+          continue
+        if ( nak ):
+          self.handshake( PID_NAK, False )
+          continue
+        if ( not self.data( tgl, n, False ) ):
+          # host does not acknowledge
+          continue
+        self.handshake( PID_ACK, True )
+      self._flip( key )
+      nbytes -= n
+      if ( n < mps ):
+        break
+    self._xend()
+
+  # bulk OUT transfer of 'nbytes' (high-speed: NYET/PING flow control)
+  def bulkOut(self, ep, nbytes, mps = 512, nakRate = 0.0, nyetRate = 0.0):
+    key  = ( ep, False )
+    rnd  = self._rnd
+    ping = False
+    while True:
+      fast = self._xbegin()
+      if ( ping ):
+        nak = ( nakRate > 0.0 and rnd.random() < nakRate )
+        hsk = PID_NAK if nak else PID_ACK
+        if ( fast ):
+          self._xact( ( "ping", ep, hsk ),
+                      lambda: [ self._sTok( PID_PING, ep ), self._sHsk( hsk, False ) ] )
+        else:
+          if ( not self.token( PID_PING, ep ) ):
+            continue
+          self.handshake( hsk, False )
+        if ( nak ):
+          continue
+        ping = False
+      n   = min( nbytes, mps )
+      tgl = self._toggle( key )
+      if   ( nakRate  > 0.0 and rnd.random() < nakRate ):
+        hsk = PID_NAK
+      elif ( nyetRate > 0.0 and rnd.random() < nyetRate ):
+        hsk = PID_NYET
+      else:
+        hsk = PID_ACK
+      if ( fast and n == mps ):
+        self._xact( ( "out", ep, tgl, n, hsk ),
+                    lambda: [ self._sTok( PID_OUT, ep ), self._sDat( tgl, n, True ), self._sHsk( hsk, False ) ] )
+      else:
+        if ( not self.token( PID_OUT, ep ) ):
+          continue
+        if ( not self.data( tgl, n, True ) ):
+          # device does not respond
+          continue
+        self.handshake( hsk, False )
+      if ( hsk == PID_NAK ):
+        ping = True
+        continue
+      ping = ( hsk == PID_NYET )
+      self._flip( key )
+      nbytes -= n
+      if ( n < mps ):
+        break
+    self._xend()
+
+  # 'count' NAKed IN (or PINGed OUT) transactions
+  def nakStorm(self, ep, count, isIn = True):
+    pid = PID_IN if isIn else PID_PING
+    # SOFs can only be inserted between templates
+    blk = 1 if self._sof else GEN_STORM_BLOCK
+    while ( count > 0 ):
+      n      = min( count, blk )
+      count -= n
+      if ( self._xbegin() ):
+        self._xact( ( "storm", ep, pid, n ), lambda: self._stormSpecs( pid, ep, n ) )
+      else:
+        for i in range( n ):
+          if ( self.token( pid, ep ) ):
+            self.handshake( PID_NAK, False )
+    self._xend()
+
+  def _stormSpecs(self, pid, ep, n):
+    p = []
+    for i in range( n ):
+      p.append( self._sTok( pid, ep, None if i == 0 else self._gapXact() ) )
+      p.append( self._sHsk( PID_NAK, False ) )
+    return p
+
+  # isochronous audio stream: one packet of 'size' bytes per microframe
+  # during 'uframes' microframes (IN: device -> host)
+  def iso(self, ep, size, uframes, isIn = True):
+    pid = PID_IN if isIn else PID_OUT
+    blk = 1 if self._sof else GEN_ISO_BLOCK
+    while ( uframes > 0 ):
+      n        = min( uframes, blk )
+      uframes -= n
+      if ( self._xbegin() ):
+        self._xact( ( "iso", ep, pid, size, n ), lambda: self._isoSpecs( pid, ep, size, n, isIn ),
+                    n * GEN_UFRAME_CYCLES )
+      else:
+        for i in range( n ):
+          # start of the microframe
+          u = self._t + self._pend
+          if ( self.token( pid, ep ) ):
+            self.data( PID_DATA0, size, not isIn )
+          self._wait( max( u + GEN_UFRAME_CYCLES - self._t - self._pend, 0 ) )
+    self._xend()
+
+  # 'n' microframes; each token starts a random gap after the start of
+  # its microframe
+  def _isoSpecs(self, pid, ep, size, n, isIn):
+    p = []
+    r = 0
+    for i in range( n ):
+      j = self._gapXact()
+      t = self._sTok( pid, ep, j + r )
+      d = self._sDat( PID_DATA0, size, not isIn )
+      p.extend( [ t, d ] )
+      # remainder of this microframe
+      r = GEN_UFRAME_CYCLES - j - len( t[2] ) // self._rsz - d[3] - len( d[2] ) // self._rsz
+    return p
+
+  # control transfer on EP0; 'setup' is the 8-byte request, 'data' the
+  # device's response (IN data stage) or the host's data (OUT data
+  # stage). The device NAKs every data/status stage 'naks' times (busy).
+  def control(self, setup, data = b'', mps = 64, naks = 0):
+    setup = bytes( setup )
+    self._xbegin()
+    while True:
+      if ( self.token( PID_SETUP, 0 ) and self.data( PID_DATA0, 0, True, payload = setup ) ):
+        break
+    self.handshake( PID_ACK, False )
+    isIn = ( setup[0] & 0x80 ) != 0
+    tgl  = PID_DATA1
+    off  = 0
+    wlen = setup[6] | ( setup[7] << 8 )
+    # a response shorter than wLength ending on a full packet needs a ZLP
+    zlp  = ( len( data ) < wlen and len( data ) % mps == 0 )
+    while ( wlen > 0 and isIn and ( off < len( data ) or ( zlp and off == len( data ) ) ) ):
+      self._ctlNaks( PID_IN, naks )
+      if ( not self.token( PID_IN, 0 ) ):
+        continue
+      chunk = data[off : off + mps]
+      if ( not self.data( tgl, len( chunk ), False, payload = chunk ) ):
+        continue
+      self.handshake( PID_ACK, True )
+      tgl  ^= ( PID_DATA0 ^ PID_DATA1 )
+      off  += mps
+      if ( len( chunk ) < mps ):
+        break
+    while ( wlen > 0 and not isIn and off < len( data ) ):
+      self._ctlNaks( PID_OUT, naks )
+      if ( not self.token( PID_OUT, 0 ) ):
+        continue
+      chunk = data[off : off + mps]
+      if ( not self.data( tgl, len( chunk ), True, payload = chunk ) ):
+        continue
+      self.handshake( PID_ACK, False )
+      tgl  ^= ( PID_DATA0 ^ PID_DATA1 )
+      off  += mps
+    # status stage
+    while True:
+      self._ctlNaks( PID_OUT if isIn else PID_IN, naks )
+      if ( not self.token( PID_OUT if isIn else PID_IN, 0 ) ):
+        continue
+      if ( self.data( PID_DATA1, 0, isIn, payload = b'' ) ):
+        break
+    self.handshake( PID_ACK, not isIn )
+    self._xend()
+
+  def _ctlNaks(self, pid, naks):
+    for i in range( naks ):
+      if ( self.token( pid, 0 ) ):
+        if ( pid == PID_OUT ):
+          self.data( PID_DATA1, 0, True, payload = b'' )
+        self.handshake( PID_NAK, False )
+
+  # generate (at least) 'nbytes' of random traffic according to 'mix'
+  # (maps the names of GEN_DEFAULT_MIX to relative weights)
+  def random(self, nbytes, mix = None):
+    mix  = GEN_DEFAULT_MIX if mix is None else mix
+    nams = [ k for k in mix if mix[k] > 0 ]
+    wgts = [ mix[k] for k in nams ]
+    rnd  = self._rnd
+    end  = self.written + self._len + nbytes
+    while ( self.written + self._len < end ):
+      what = rnd.choices( nams, wgts )[0]
+      if   ( what == "bulkIn" ):
+        self.bulkIn( rnd.randint( 1, 3 ), rnd.randint( 1, 64 ) * 512 + rnd.choice( [ 0, 0, 0, rnd.randrange( 512 ) ] ),
+                     nakRate = 0.1 )
+      elif ( what == "bulkOut" ):
+        self.bulkOut( rnd.randint( 1, 3 ), rnd.randint( 1, 64 ) * 512 + rnd.choice( [ 0, 0, 0, rnd.randrange( 512 ) ] ),
+                      nakRate = 0.05, nyetRate = 0.1 )
+      elif ( what == "nakStorm" ):
+        self.nakStorm( rnd.randint( 1, 3 ), rnd.randint( 10, 1000 ), rnd.random() < 0.5 )
+      elif ( what == "iso" ):
+        # 48kHz, 24-bit stereo
+        self.iso( 4, 36, rnd.randint( 8, 64 ), rnd.random() < 0.5 )
+      elif ( what == "reg" ):
+        r = rnd.randrange( 0x40 )
+        if ( rnd.random() < 0.5 ):
+          self.regWrite( r, rnd.randrange( 256 ) )
+        else:
+          self.regRead( r, rnd.randrange( 256 ) )
+      elif ( what == "control" ):
+        # GET_DESCRIPTOR( DEVICE )
+        self.control( [ 0x80, 0x06, 0x00, 0x01, 0x00, 0x00, 0x12, 0x00 ], bytes( range( 18 ) ) )
+
+  def flush(self):
+    if ( len( self._out ) > 0 ):
+      self._f.write( b''.join( self._out ) )
+      self.written += self._len
+      self._out     = []
+      self._len     = 0
+    self._f.flush()
+
+def _parseSize(s):
+  m = { "K": 1 << 10, "M": 1 << 20, "G": 1 << 30 }
+  if ( s[-1].upper() in m ):
+    return int( float( s[:-1] ) * m[ s[-1].upper() ] )
+  return int( s, 0 )
+
+if __name__ == "__main__":
+  import getopt
+  import io
+  import time
+
+  seed    = None
+  size    = 1 << 20
+  recSize = ULPI_REC_SIZE
+  crcErr  = 0.0
+  torn    = 0.0
+  nulls   = 0.0
+  sof     = False
+  mix     = None
+  verbose = False
+
+  ( opts, args ) = getopt.getopt( sys.argv[1:], "hvTSs:n:c:t:z:x:" )
+  for opt in opts:
+    if   opt[0] in ("-h"):
+      print("usage: {} [-hvTS] [-s seed] [-n size] [-c crc_err_rate] [-t torn_rate] [-z null_rate] [-x mix] <output_file>".format( sys.argv[0] ))
+      print("          -h               : this message")
+      print("          output_file      : file to write; '-' writes to stdout")
+      print("          -v               : print statistics and throughput (stderr)")
+      print("          -T               : time-stamped records (UlpiLogger TIMESTAMP_G)")
+      print("          -S               : include SOF tokens")
+      print("          -s seed          : random seed")
+      print("          -n size          : (approximate) size of the capture; suffixes K, M, G (default 1M)")
+      print("          -c crc_err_rate  : probability of a CRC error (tokens, data); 0 <= rate < 1")
+      print("          -t torn_rate     : probability of a torn packet; 0 <= rate < 1")
+      print("          -z null_rate     : probability of NULL markers after an RX packet; 0 <= rate < 1")
+      print("          -x mix           : transaction mix, e.g., bulkIn=8,bulkOut=8,nakStorm=2,iso=4,reg=1,control=1")
+      sys.exit(0)
+    elif opt[0] in ("-v"):
+      verbose = True
+    elif opt[0] in ("-T"):
+      recSize = ULPI_REC_SIZE_TS
+    elif opt[0] in ("-S"):
+      sof     = True
+    elif opt[0] in ("-s"):
+      seed    = int( opt[1], 0 )
+    elif opt[0] in ("-n"):
+      size    = _parseSize( opt[1] )
+    elif opt[0] in ("-c"):
+      crcErr  = float( opt[1] )
+    elif opt[0] in ("-t"):
+      torn    = float( opt[1] )
+    elif opt[0] in ("-z"):
+      nulls   = float( opt[1] )
+    elif opt[0] in ("-x"):
+      mix     = dict()
+      for x in opt[1].split(","):
+        k, v     = x.split("=")
+        if ( not k in GEN_DEFAULT_MIX ):
+          raise RuntimeError("Unknown transaction type '{}'".format( k ))
+        mix[k]   = float( v )
+
+  if ( len( args ) < 1 ):
+    raise RuntimeError("Need an output file")
+
+  for r in ( crcErr, torn, nulls ):
+    if ( not ( 0.0 <= r < 1.0 ) ):
+      raise RuntimeError("Error rates must be in [0, 1) (got {})".format( r ))
+
+  f = sys.stdout.buffer if args[0] == "-" else io.open( args[0], "wb" )
+  t = time.monotonic()
+  g = UlpiGen( f, seed = seed, recSize = recSize, crcErrRate = crcErr, tornRate = torn, nullRate = nulls, sof = sof )
+  g.random( size, mix )
+  g.flush()
+  t = time.monotonic() - t
+  if ( not f is sys.stdout.buffer ):
+    f.close()
+  if ( verbose ):
+    print("{:d} bytes, {:d} packets, {:d} CRC errors, {:d} torn; {:.1f} MB/s".format(
+          g.written, g.packets, g.crcErrs, g.torn, g.written / t / 1.0e6 if t > 0 else 0.0 ), file = sys.stderr)
@@ -0,0 +1,344 @@
+# Continuous capture of ulpi log data
+
+# Copyright Till Straumann, 2023. Licensed under the EUPL-1.2 or later.
+# You may obtain a copy of the license at
+#   https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# This notice must not be removed.
+
+# A capture daemon drains the stream of a UlpiLogger through a pluggable
+# source and concurrently
+#
+#   - writes the raw data to disk (a plain file or a UlpiCaptureWriter
+#     container) and
+#   - parses them (UlpiStreamParser or, for sources delivering logger
+#     dumps, UlpiCaptureSession), handing the packets to a callback.
+#
+# The three stages run as asyncio tasks; the blocking work (reading the
+# source, parsing, writing) is done in worker threads. Stages are
+# connected by bounded queues holding 'depth' chunks (2: double
+# buffering), i.e., the source is drained while the previous chunk is
+# parsed and written.
+#
+# Back-pressure: if the parser or the writer falls behind then the
+# queues fill up and the reader waits ('stalls' counts how often), i.e.,
+# the logger is throttled (it stops recording while it is not drained).
+# With 'drop' set the reader never waits; chunks that find a full queue
+# are discarded ('dropped' counts them) and parsing starts over with
+# the next chunk. Dropping is meant for dump sources: the data on disk
+# remain a sequence of complete dumps (UlpiCaptureSession recognizes the
+# missing data as a wrapped logger memory).
+#
+#   src = UlpiFileSource( "capture.bin" )
+#   with UlpiCaptureWriter( "capture.ulpz" ) as w:
+#     d = UlpiCaptureDaemon( src, sink = w, onPackets = lambda pkts: ... )
+#     asyncio.run( d.run() )
+
+import sys
+import io
+import os
+import mmap
+import time
+import asyncio
+
+from UlpiLogParser import ( UlpiStreamParser, UlpiCaptureSession, UlpiCaptureWriter, UlpiGap,
+  ULPI_REC_SIZE, ULPI_REC_SIZE_TS )
+
+# Sources
+#
+# A source has a (blocking) 'read' method returning the next chunk of
+# data (b'' at the end of the stream) and a 'close' method. If 'dumps'
+# is True then every chunk is a complete logger dump.
+
+# Read a capture from a file, a named pipe or stdin ('-'); this is the
+# local stand-in for the hardware. If 'dumpSize' is given then the
+# stream consists of dumps of 'dumpSize' bytes.
+class UlpiFileSource(object):
+
+  def __init__(self, fnam, chunkSize = 1 << 20, dumpSize = None):
+    self._own      = ( fnam != "-" )
+    self._f        = io.open( fnam, "rb" ) if self._own else sys.stdin.buffer
+    self._n        = chunkSize if dumpSize is None else dumpSize
+    self.dumps     = not dumpSize is None
+
+  def read(self):
+    if ( not self.dumps ):
+      return self._f.read( self._n )
+    # pipes may deliver short reads
+    rv = bytearray()
+    while ( len( rv ) < self._n ):
+      d = self._f.read( self._n - len( rv ) )
+      if ( len( d ) == 0 ):
+        # incomplete dump at the end
+        return b''
+      rv += d
+    return bytes( rv )
+
+  def close(self):
+    if ( self._own ):
+      self._f.close()
+
+# Register layout of the logger readout (AXI) in the firmware; the data
+# register follows the convention of the ACM FIFO in the example design
+# (see example/sw/zynq-demo.c):
+#
+#   data register : bits 7..0 data, bit 8 FIFO empty, bit 9 last byte
+#                   of the dump ('datLst'); reading pops the FIFO
+#   halt register : writing 1 pulses 'halt', i.e., starts a dump
+ULPI_MMAP_DAT_OFF   = 0x00
+ULPI_MMAP_HALT_OFF  = 0x04
+ULPI_MMAP_EMPTY     = ( 1 << 8 )
+ULPI_MMAP_LAST      = ( 1 << 9 )
+
+# Read logger dumps from registers mapped (mmap) from a UIO device
+# (offset 0) or from /dev/mem ('offset': physical address of the
+# register block; must be page aligned). Every read() halts the logger
+# and drains the resulting dump; the logger resumes recording once the
+# dump is complete. 'poll' is the time (s) to sleep while the FIFO is
+# empty; read() gives up (returns b'') after 'timeout' seconds without
+# data.
+class UlpiMmapSource(object):
+
+  def __init__(self, dev = "/dev/uio0", offset = 0, datOff = ULPI_MMAP_DAT_OFF, haltOff = ULPI_MMAP_HALT_OFF,
+               poll = 0.0001, timeout = 1.0):
+    sz             = mmap.PAGESIZE
+    fd             = os.open( dev, os.O_RDWR | os.O_SYNC )
+    try:
+      self._mem    = mmap.mmap( fd, sz, mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE, offset = offset )
+    finally:
+      os.close( fd )
+    # 32-bit accesses
+    self._regs     = memoryview( self._mem ).cast( 'I' )
+    self._dat      = datOff  // 4
+    self._halt     = haltOff // 4
+    self._poll     = poll
+    self._timo     = timeout
+    self.dumps     = True
+
+  def read(self):
+    r              = self._regs
+    r[self._halt]  = 1
+    rv             = bytearray()
+    tmo            = time.monotonic() + self._timo
+    while True:
+      v = r[self._dat]
+      if ( ( v & ULPI_MMAP_EMPTY ) != 0 ):
+        if ( time.monotonic() > tmo ):
+          return b''
+        time.sleep( self._poll )
+        continue
+      rv.append( v & 0xff )
+      if ( ( v & ULPI_MMAP_LAST ) != 0 ):
+        return bytes( rv )
+      tmo = time.monotonic() + self._timo
+
+  def close(self):
+    if ( not self._regs is None ):
+      self._regs.release()
+      self._regs = None
+      self._mem.close()
+
+# capture statistics
+class UlpiCaptureStats(object):
+
+  __slots__ = ( "bytes", "chunks", "packets", "gaps", "stalls", "dropped", "t0" )
+
+  def __init__(self):
+    self.bytes   = 0
+    self.chunks  = 0
+    self.packets = 0
+    self.gaps    = 0
+    self.stalls  = 0
+    self.dropped = 0
+    self.t0      = time.monotonic()
+
+  def __str__(self):
+    dt = max( time.monotonic() - self.t0, 1.0e-6 )
+    return "{:d} bytes ({:.2f} MB/s), {:d} chunks, {:d} packets, {:d} gaps, {:d} stalls, {:d} dropped".format(
+           self.bytes, self.bytes / dt / 1.0e6, self.chunks, self.packets, self.gaps, self.stalls, self.dropped )
+
+# queue marker: data were dropped (the parser starts over)
+_DROPPED = object()
+
+class UlpiCaptureDaemon(object):
+
+  # 'source'    : chunk source (see above)
+  # 'sink'      : object with a 'write' method (e.g., a binary file or a
+  #               UlpiCaptureWriter) receiving the raw data; None: don't
+  #               store
+  # 'onPackets' : called with the list of packets (and UlpiGap markers)
+  #               parsed from every chunk; None: don't parse
+  # 'flt'       : packet filter (UlpiFilter) applied by the parser
+  # 'depth'     : number of chunks buffered between the stages
+  # 'drop'      : drop chunks rather than throttle the source
+  def __init__(self, source, sink = None, onPackets = None, recSize = ULPI_REC_SIZE, flt = None, depth = 2, drop = False):
+    self._src   = source
+    self._sink  = sink
+    self._cb    = onPackets
+    self._rsz   = recSize
+    self._flt   = flt
+    self._depth = depth
+    self._drop  = drop
+    self._stop  = None
+    self.stats  = UlpiCaptureStats()
+
+  def _mkParser(self):
+    if ( self._src.dumps ):
+      return UlpiCaptureSession( recSize = self._rsz, flt = self._flt )
+    # first one may be corrupt
+    return UlpiStreamParser( dropFirst = True, flt = self._flt, recSize = self._rsz )
+
+  # request the daemon to stop (after the current chunk)
+  def stop(self):
+    if ( not self._stop is None ):
+      self._stop.set()
+
+  async def _reader(self, loop, queues):
+    while not self._stop.is_set():
+      d = await loop.run_in_executor( None, self._src.read )
+      if ( len( d ) == 0 ):
+        break
+      self.stats.bytes  += len( d )
+      self.stats.chunks += 1
+      if ( self._drop ):
+        if ( any( [ q.full() for q in queues ] ) ):
+          self.stats.dropped += 1
+          for q in queues:
+            if ( not q.full() ):
+              q.put_nowait( _DROPPED )
+          continue
+      elif ( any( [ q.full() for q in queues ] ) ):
+        self.stats.stalls += 1
+      for q in queues:
+        await q.put( d )
+    for q in queues:
+      await q.put( None )
+
+  async def _parser(self, loop, q):
+    p = self._mkParser()
+    while True:
+      d = await q.get()
+      if ( d is None ):
+        break
+      if ( d is _DROPPED ):
+        if ( not self._src.dumps ):
+          p = self._mkParser()
+        continue
+      pkts = await loop.run_in_executor( None, p.feed, d )
+      for x in pkts:
+        if ( isinstance( x, UlpiGap ) ):
+          self.stats.gaps    += 1
+        else:
+          self.stats.packets += 1
+      self._cb( pkts )
+
+  async def _writer(self, loop, q):
+    while True:
+      d = await q.get()
+      if ( d is None ):
+        break
+      if ( not d is _DROPPED ):
+        await loop.run_in_executor( None, self._sink.write, d )
+
+  # capture until the source is exhausted or stop() is called
+  async def run(self):
+    loop       = asyncio.get_running_loop()
+    self._stop = asyncio.Event()
+    self.stats = UlpiCaptureStats()
+    queues     = []
+    tasks      = []
+    if ( not self._cb is None ):
+      queues.append( asyncio.Queue( self._depth ) )
+      tasks.append( self._parser( loop, queues[-1] ) )
+    if ( not self._sink is None ):
+      queues.append( asyncio.Queue( self._depth ) )
+      tasks.append( self._writer( loop, queues[-1] ) )
+    await asyncio.gather( self._reader( loop, queues ), *tasks )
+    return self.stats
+
+if __name__ == "__main__":
+  import getopt
+  import signal
+
+  recSize = ULPI_REC_SIZE
+  ldDepth = None
+  dev     = None
+  offset  = 0
+  ofnam   = None
+  depth   = 2
+  drop    = False
+  parse   = True
+  period  = 10.0
+
+  ( opts, args ) = getopt.getopt( sys.argv[1:], "hTdnM:m:O:o:q:p:" )
+  for opt in opts:
+    if   opt[0] in ("-h"):
+      print("usage: {} [-hTdn] [-M ld_mem_depth] [-m device] [-O offset] [-o output_file] [-q depth] [-p period] [capture_file]".format( sys.argv[0] ))
+      print("          -h               : this message")
+      print("          capture_file     : read the logger stream from a file or pipe ('-': stdin)")
+      print("          -m device        : read logger dumps from registers mapped from 'device' (e.g., /dev/uio0)")
+      print("          -O offset        : offset of the registers (physical address if 'device' is /dev/mem)")
+      print("          -M ld_mem_depth  : the stream holds logger dumps (2**ld_mem_depth records each)")
+      print("          -T               : time-stamped records (UlpiLogger TIMESTAMP_G)")
+      print("          -o output_file   : store the capture; a '.ulpz' file is a compressed container")
+      print("          -q depth         : number of chunks buffered between reading, parsing and writing (default 2)")
+      print("          -d               : drop data rather than throttle the logger if parsing/writing falls behind")
+      print("          -n               : do not parse (only store)")
+      print("          -p period        : print statistics every 'period' seconds (default 10)")
+      sys.exit(0)
+    elif opt[0] in ("-T"):
+      recSize = ULPI_REC_SIZE_TS
+    elif opt[0] in ("-d"):
+      drop    = True
+    elif opt[0] in ("-n"):
+      parse   = False
+    elif opt[0] in ("-M"):
+      ldDepth = int( opt[1], 0 )
+    elif opt[0] in ("-m"):
+      dev     = opt[1]
+    elif opt[0] in ("-O"):
+      offset  = int( opt[1], 0 )
+    elif opt[0] in ("-o"):
+      ofnam   = opt[1]
+    elif opt[0] in ("-q"):
+      depth   = int( opt[1], 0 )
+    elif opt[0] in ("-p"):
+      period  = float( opt[1] )
+
+  if ( not dev is None ):
+    src = UlpiMmapSource( dev, offset )
+  elif ( len( args ) > 0 ):
+    src = UlpiFileSource( args[0], dumpSize = None if ldDepth is None else ( 1 << ldDepth ) * recSize )
+  else:
+    raise RuntimeError("Need a capture file or a device")
+
+  if   ( ofnam is None ):
+    sink = None
+  elif ( ofnam.endswith( ".ulpz" ) ):
+    sink = UlpiCaptureWriter( ofnam, recSize = recSize )
+  else:
+    sink = io.open( ofnam, "ab" )
+
+  d = UlpiCaptureDaemon( src, sink = sink, onPackets = ( lambda pkts: None ) if parse else None,
+                         recSize = recSize, depth = depth, drop = drop )
+
+  async def main():
+    loop = asyncio.get_running_loop()
+    for s in ( signal.SIGINT, signal.SIGTERM ):
+      loop.add_signal_handler( s, d.stop )
+    async def report():
+      while True:
+        await asyncio.sleep( period )
+        print( d.stats, file = sys.stderr )
+    rep = asyncio.ensure_future( report() )
+    try:
+      return await d.run()
+    finally:
+      rep.cancel()
+
+  try:
+    st = asyncio.run( main() )
+    print( st, file = sys.stderr )
+  finally:
+    src.close()
+    if ( not sink is None ):
+      sink.close()
@@ -0,0 +1,281 @@
+# Command line tool to dump, export and analyze ulpi log captures
+
+# Copyright Till Straumann, 2023. Licensed under the EUPL-1.2 or later.
+# You may obtain a copy of the license at
+#   https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# This notice must not be removed.
+
+# Run as 'UlpiLogParser.py [options] <capture_file>' ('-h' lists the
+# options). The tool lives in a module of its own so that the parser,
+# the analyzers and the exporters are all imported by their proper
+# names (and only once), i.e., the parser module does not depend on
+# any of them.
+
+import sys
+import io
+import getopt
+import numpy as np
+
+from UlpiLogParser import ( UlpiLogParser, UlpiStreamParser, UlpiCaptureSession, UlpiFilter,
+  UlpiCaptureReader, UlpiCaptureWriter, ulpiOpenCapture, ulpiCyclesToNs, ULPI_REC_SIZE, ULPI_REC_SIZE_TS )
+
+def main():
+
+  verbose = False
+  stats   = False
+  hist    = False
+  crc     = False
+  dfltMps = 512
+  jobs    = 1
+  fmt     = "text"
+  ofnam   = None
+  flt     = UlpiFilter()
+  useFlt  = False
+  recSize = ULPI_REC_SIZE
+  lat     = False
+  ldDepth = None
+  reasm   = None
+  anom    = False
+  enum    = False
+  ctl     = False
+  descs   = None
+  zfnam   = None
+  codec   = "lzma"
+
+  ( opts, args ) = getopt.getopt( sys.argv[1:], "hvsHcTlAECm:j:f:o:a:e:P:D:L:M:R:d:Z:z:" )
+  for opt in opts:
+    if   opt[0] in ("-h"):
+      print("usage: {} [-hvsHcTlAEC] [-m max_pkt_size] [-j jobs] [-M ld_mem_depth] [-f format] [-o output_file] [-R prefix] [-d desc_module] [-Z container_file] [-z codec] [filter_options] <capture_file>".format( sys.argv[0] ))
+      print("          -h               : this message")
+      print("          capture_file     : capture to analyze (raw or compressed container); '-' streams from stdin")
+      print("          -Z container_file: compress the capture (e.g., streamed from stdin) into 'container_file'")
+      print("                             (appended to if it exists) and exit")
+      print("          -z codec         : compression codec: lzma (default), zlib")
+      print("          -T               : capture has time-stamped records (UlpiLogger TIMESTAMP_G)")
+      print("          -M ld_mem_depth  : capture holds successive logger dumps (2**ld_mem_depth records each);")
+      print("                             join them into one stream (packet dump only)")
+      print("          -v               : verbose packet dump (show data)")
+      print("          -f format        : packet dump format: text (default), jsonl, csv, pcap")
+      print("          -o output_file   : write packet dump to 'output_file' (default: stdout)")
+      print("          -s               : print per-endpoint statistics instead of packets")
+      print("          -H               : include packet-size histograms in statistics")
+      print("          -c               : verify CRC5/CRC16 of all packets; list failures")
+      print("          -l               : print turnaround latency statistics (needs -T; -H adds histograms)")
+      print("          -A               : print anomaly report (NAK streaks, PING storms, retries, toggle")
+      print("                             errors, missed iso microframes); exit status 1 if there are any")
+      print("          -E               : print enumeration timeline (reset, chirp, EP0 requests up")
+      print("                             to SET_CONFIGURATION; durations need -T)")
+      print("          -C               : print control requests and per-request EP0 latency statistics")
+      print("                             (latencies need -T); exit status 1 if any failed")
+      print("          -d desc_module   : check the descriptors returned by GET_DESCRIPTOR against the ones")
+      print("                             made by mkExampleDevDescriptors() in python file 'desc_module'; use")
+      print("                             'desc_module,yaml_file' to pass a configuration (e.g., example/py)")
+      print("          -R prefix        : reassemble the delivered payload of every endpoint into")
+      print("                             files <prefix><addr>-<endp>-<in|out>.bin (-a, -e select endpoints)")
+      print("          -m max_pkt_size  : max. packet size (short-packet detection; default 512)")
+      print("          -j jobs          : parse using 'jobs' worker processes (0: one per CPU)")
+      print("        filter options (only matching packets are dumped/checked):")
+      print("          -a addr          : device address (entire transactions)")
+      print("          -e endp          : endpoint number (entire transactions)")
+      print("          -P pid[,pid]     : PIDs (names or numbers), e.g., -P IN,DATA0,DATA1")
+      print("          -D rx|tx         : direction")
+      print("          -L min[:max]     : packet length range (data bytes)")
+      sys.exit(0)
+    elif opt[0] in ("-v"):
+      verbose = True
+    elif opt[0] in ("-s"):
+      stats   = True
+    elif opt[0] in ("-H"):
+      stats   = True
+      hist    = True
+    elif opt[0] in ("-c"):
+      crc     = True
+    elif opt[0] in ("-T"):
+      recSize = ULPI_REC_SIZE_TS
+    elif opt[0] in ("-l"):
+      lat     = True
+    elif opt[0] in ("-M"):
+      ldDepth = int( opt[1], 0 )
+    elif opt[0] in ("-R"):
+      reasm   = opt[1]
+    elif opt[0] in ("-A"):
+      anom    = True
+    elif opt[0] in ("-E"):
+      enum    = True
+    elif opt[0] in ("-C"):
+      ctl     = True
+    elif opt[0] in ("-d"):
+      ctl     = True
+      descs   = opt[1]
+    elif opt[0] in ("-Z"):
+      zfnam   = opt[1]
+    elif opt[0] in ("-z"):
+      codec   = opt[1]
+    elif opt[0] in ("-m"):
+      dfltMps = int( opt[1], 0 )
+    elif opt[0] in ("-j"):
+      jobs    = int( opt[1], 0 ) or None
+    elif opt[0] in ("-f"):
+      fmt     = opt[1]
+    elif opt[0] in ("-o"):
+      ofnam   = opt[1]
+    elif opt[0] in ("-a"):
+      flt.addr   = int( opt[1], 0 )
+      useFlt     = True
+    elif opt[0] in ("-e"):
+      flt.endp   = int( opt[1], 0 )
+      useFlt     = True
+    elif opt[0] in ("-P"):
+      flt.pids   = set()
+      for x in opt[1].split(","):
+        x = x.strip().upper()
+        flt.pids.add( UlpiLogParser.pidTbl.index( x ) if x in UlpiLogParser.pidTbl else int( x, 0 ) )
+      useFlt     = True
+    elif opt[0] in ("-D"):
+      flt.isRx   = ( opt[1].lower() == "rx" )
+      useFlt     = True
+    elif opt[0] in ("-L"):
+      l          = opt[1].split(":")
+      flt.minLen = int( l[0], 0 ) if len( l[0] ) > 0 else None
+      flt.maxLen = int( l[1], 0 ) if len( l ) > 1 and len( l[1] ) > 0 else None
+      useFlt     = True
+
+  if ( len( args ) < 1 ):
+    raise RuntimeError("Need a capture file")
+
+  if ( not zfnam is None ):
+    src = sys.stdin.buffer if args[0] == "-" else ulpiOpenCapture( args[0] )
+    if ( isinstance( src, UlpiCaptureReader ) ):
+      recSize = src.recSize
+    with UlpiCaptureWriter( zfnam, recSize = recSize, codec = codec ) as w:
+      for c in iter( lambda: src.read( 1 << 20 ), b'' ):
+        w.write( c )
+    with UlpiCaptureReader( zfnam ) as z:
+      print("{}: {:d} chunks, {:d} bytes ({:d} compressed)".format( zfnam, len( z ), z.size, z.compressedSize ), file = sys.stderr)
+    sys.exit(0)
+
+  if ( not useFlt ):
+    flt = None
+  elif ( not reasm is None or anom or enum or ctl ):
+    # reassembly, anomaly detection, enumeration and control requests need entire transactions;
+    # only the address and endpoint filters apply
+    flt = UlpiFilter( addr = flt.addr, endp = flt.endp )
+
+  # per-packet times of the streaming paths (pcap export)
+  tpkts = None
+  if ( not ldDepth is None ):
+    if ( crc or stats or lat ):
+      raise RuntimeError("Statistics and CRC checks are not supported for joined dumps")
+    p    = None
+    src  = sys.stdin.buffer if args[0] == "-" else ulpiOpenCapture( args[0] )
+    if ( isinstance( src, UlpiCaptureReader ) ):
+      recSize = src.recSize
+    tmd  = ( fmt == "pcap" and recSize >= ULPI_REC_SIZE_TS )
+    ses  = UlpiCaptureSession( recSize = recSize, flt = flt, times = tmd )
+    if ( tmd ):
+      tpkts = ses.parseTimed( src, ( 1 << ldDepth ) * recSize )
+      recs  = ( ( None, x ) for x, t in tpkts )
+    else:
+      recs  = ( ( None, x ) for x in ses.parse( src, ( 1 << ldDepth ) * recSize ) )
+  elif ( args[0] == "-" ):
+    # stream from stdin; first one may be corrupt
+    p    = None
+    tmd  = ( fmt == "pcap" and recSize >= ULPI_REC_SIZE_TS )
+    sp   = UlpiStreamParser( dropFirst = True, flt = flt, recSize = recSize, times = tmd )
+    if ( tmd ):
+      tpkts = sp.parseTimed( sys.stdin.buffer )
+      recs  = ( ( None, x ) for x, t in tpkts )
+    else:
+      recs  = ( ( None, x ) for x in sp.parse( sys.stdin.buffer ) )
+    if ( crc or stats or lat ):
+      raise RuntimeError("Statistics and CRC checks need a capture file")
+  else:
+    p    = UlpiLogParser.open( args[0], jobs = jobs, recSize = recSize )
+    # first one may be corrupt
+    if ( flt is None ):
+      recs = ( ( None, x ) for x in p.packets( first = 1 ) )
+    else:
+      recs = p.filtered( flt, first = 1 )
+  if ( crc ):
+    import UsbCrc
+    tbl       = p.table()
+    chk, ok   = UsbCrc.crcCheck( p.buf, tbl, p.recSize )
+    if ( not flt is None ):
+      sel     = flt.mask( tbl )
+      chk    &= sel
+      ok     |= ~ sel
+    idx       = np.flatnonzero( ~ ok )
+    for i in idx:
+      print("CRC error: packet #{:d} @ offset 0x{:x}: PID {:5s} ({:d} bytes)".format(
+            i, tbl['off'][i], UlpiLogParser.pidTbl[ tbl['pid'][i] ], tbl['len'][i] ))
+    print("{:d} packets checked, {:d} CRC errors".format( np.count_nonzero( chk ), len( idx ) ))
+  elif ( lat ):
+    import UlpiAnalysis
+    if ( not p.hasTimes ):
+      raise RuntimeError("Latency statistics need a time-stamped capture (-T)")
+    eps, gaps, occ = UlpiAnalysis.latStats( p.table(), *p.times() )
+    if ( not flt is None ):
+      eps = [ x for x in eps if ( flt.addr is None or x.addr == flt.addr ) and ( flt.endp is None or x.endp == flt.endp ) ]
+    UlpiAnalysis.printLatStats( eps, gaps, occ, hist = hist )
+  elif ( not reasm is None ):
+    import UlpiTransactions
+    with UlpiTransactions.UsbPayloadFiles( reasm ) as sink:
+      ras = UlpiTransactions.reassemble( ( x for i, x in recs ), sink )
+    for k in sorted( ras.streams ):
+      print( "{} -> {}".format( ras.streams[k], sink.names.get( k, "(no data)" ) ) )
+  elif ( anom or enum or ctl ):
+    # map packet numbers of the stream fed to the analyzer to the capture
+    ifn = None
+    tfn = None
+    if ( not p is None ):
+      idx  = np.arange( 1, len( p.segments() ) ) if flt is None else p.select( flt )
+      idx  = idx[ idx >= 1 ]
+      recs = ( ( None, p.pkt( int( i ) ) ) for i in idx )
+      ifn  = lambda i: int( idx[i] )
+      if ( p.hasTimes ):
+        t0  = p.times()[0]
+        tfn = lambda i: int( t0[idx[i]] )
+    if ( ctl ):
+      import UlpiControl
+      ctx = None if descs is None else UlpiControl.loadDescContext( descs )
+      dec = UlpiControl.UsbControlDecoder( ctx = ctx, timeFn = tfn ).run( ( x for i, x in recs ) )
+      dec.report( idxFn = ifn )
+      sys.exit( 1 if dec.errors > 0 else 0 )
+    elif ( enum ):
+      import UlpiEnumeration
+      UlpiEnumeration.UsbEnumTimeline( timeFn = tfn ).run( ( x for i, x in recs ) ).report( idxFn = ifn )
+    else:
+      import UlpiAnomalies
+      det = UlpiAnomalies.UlpiAnomalyDetector( timeFn = tfn ).run( ( x for i, x in recs ) )
+      det.report( idxFn = ifn )
+      sys.exit( 1 if det.total > 0 else 0 )
+  elif ( stats ):
+    import UlpiAnalysis
+    st = UlpiAnalysis.epStats( p.table(), dfltMps = dfltMps )
+    if ( not flt is None ):
+      # statistics need entire transactions; only address and
+      # endpoint filters apply
+      st = [ x for x in st if ( flt.addr is None or x.addr == flt.addr ) and ( flt.endp is None or x.endp == flt.endp ) ]
+    UlpiAnalysis.printEpStats( st, hist = hist )
+  else:
+    import UlpiExport
+    clz = UlpiExport.EXPORTERS[fmt]
+    if ( ofnam is None ):
+      f = sys.stdout.buffer if clz.binary else sys.stdout
+    else:
+      f = io.open( ofnam, "wb" if clz.binary else "w" )
+    kw  = dict()
+    if ( clz is UlpiExport.PcapExporter and not p is None and p.hasTimes ):
+      t0         = p.times()[0]
+      kw['tsFn'] = lambda i: ulpiCyclesToNs( int( t0[i] ) )
+    with clz( f, verbose = verbose, **kw ) as ex:
+      if ( clz is UlpiExport.PcapExporter and not tpkts is None ):
+        for x, t in tpkts:
+          ex.write( x, ts = None if t is None else ulpiCyclesToNs( int( t ) ) )
+      else:
+        ex.writeRecs( recs, first = 1 )
+    if ( not ofnam is None ):
+      f.close()
+
+if __name__ == "__main__":
+  main()
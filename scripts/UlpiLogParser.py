@@ -5,7 +5,7 @@
 #   https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
 # This notice must not be removed.
 
-# The ulpi log data are presented in a bytarray of the following
+# The ulpi log data are presented in a buffer of the following
 # format:
 #
 #    data_byte, flag_byte, data_byte, flag_byte, ...
@@ -36,51 +36,985 @@
 # null markers can appear due to RXCMD in the ulpi data stream.
 # Note that RXCMD can not be represented by this data format and
 # must be dropped before storing data + flag bytes.
+#
+# If the logger is built with TIMESTAMP_G then every record is
+# extended by a (little-endian) 16-bit word holding the number of
+# ulpi clock cycles elapsed since the previous record (saturated at
+# 0xffff):
+#
+#    data_byte, flag_byte, delta_lo, delta_hi, data_byte, ...
+#
+# All routines take the record size (ULPI_REC_SIZE or ULPI_REC_SIZE_TS)
+# as an argument; offsets are always byte offsets into the buffer.
+
+# Packet boundaries are computed for the entire buffer in a single
+# vectorized pass (see 'ulpiSegment'); the packet accessors and the
+# dump routines are built on top of the resulting index arrays.
 
 # THIS IS WIP
 
-class UlpiLogParser(bytearray):
+import sys
+import io
+import os
+import mmap
+import zlib
+import lzma
+import struct
+import bisect
+import itertools
+import numpy as np
+
+# USB PIDs (4-bit)
+PID_OUT   = 0x1
+PID_ACK   = 0x2
+PID_DATA0 = 0x3
+PID_PING  = 0x4
+PID_SOF   = 0x5
+PID_NYET  = 0x6
+PID_DATA2 = 0x7
+PID_SPLIT = 0x8
+PID_IN    = 0x9
+PID_NAK   = 0xa
+PID_DATA1 = 0xb
+PID_PRE   = 0xc
+PID_SETUP = 0xd
+PID_STALL = 0xe
+PID_MDATA = 0xf
+
+# Record sizes (bytes) of plain and time-stamped captures
+ULPI_REC_SIZE    = 2
+ULPI_REC_SIZE_TS = 4
+
+# ulpi clock (high-speed)
+ULPI_CLK_HZ      = 60000000
+
+# convert ulpi clock cycles to ns
+def ulpiCyclesToNs(c):
+  return c * 1000000000 // ULPI_CLK_HZ
+
+# Result of segmenting a ulpi log buffer.
+#
+# 'off', 'len' and 'dir' are index arrays (one entry per complete
+# packet): the byte offset of the first data byte in the buffer,
+# the number of data bytes and the DIR flag.
+# 'nul' holds the number of null markers skipped ahead of each packet,
+# 'trn' the byte offsets of all DIR transitions (these two are not
+# available when the segments are loaded from a persistent index).
+# 'end' is the byte offset of the first unconsumed record (the start
+# of the trailing, unterminated run) and 'delim' tells whether
+# that record is a delimiter (i.e., the state to resume parsing with).
+class UlpiSegments(object):
+  def __init__(self, off, len, dir, nul, trn, end, delim):
+    self.off   = off
+    self.len   = len
+    self.dir   = dir
+    self.nul   = nul
+    self.trn   = trn
+    self.end   = end
+    self.delim = delim
+
+  def __len__(self):
+    return len(self.off)
+
+# Compute all packet boundaries of a ulpi log buffer in one pass.
+#
+# 'buf' may be any object supporting the buffer protocol. 'delim'
+# states whether the first record in 'buf' is a delimiter (which is
+# the case when resuming after a complete packet); 'rsz' is the
+# record size.
+# Returns a 'UlpiSegments' object.
+def ulpiSegment(buf, delim = False, rsz = ULPI_REC_SIZE):
+  a    = np.frombuffer( buf, dtype = np.uint8 )
+  n    = len(a) // rsz
+  dat  = a[0:rsz*n:rsz]
+  drf  = ( a[1:rsz*n:rsz] & UlpiLogParser.DIR ) != 0
+  # every run of identical DIR is terminated by the first record
+  # of the next run; the last run is thus always incomplete.
+  trn  = np.flatnonzero( drf[1:] != drf[:-1] ) + 1
+  rs   = np.concatenate( ( [0], trn ) ).astype( np.int64 )
+  re   = np.concatenate( ( trn, [n] ) ).astype( np.int64 )
+  if ( n == 0 ):
+    e = np.zeros( 0, dtype = np.int64 )
+    return UlpiSegments( e, e, e.astype(bool), e, e, 0, delim )
+  K    = len(rs)
+  rdir = drf[rs]
+  # a run that is led by a delimiter skips the delimiter; if the
+  # delimiter is a null marker then all subsequent null markers
+  # (left by RXCMD) are skipped, too.
+  nulD = ( ~ rdir ) & ( dat[rs] == 0 )
+  nz   = np.flatnonzero( dat != 0 )
+  i    = np.searchsorted( nz, rs + 1 )
+  nzp  = np.append( nz, n )[i]
+  s1   = np.where( nulD, np.minimum( nzp, re ), rs + 1 )
+  # runs that yield a packet even if led by a delimiter ('always')
+  # vs. runs that are entirely consumed by a delimiter ('toggle').
+  # A toggle run yields a packet only if it is *not* led by a delimiter,
+  # i.e., if the previous run yielded no packet.
+  alw  = s1 < re
+  tgl  = ~ alw
+  k    = np.arange( K )
+  lstA = np.maximum.accumulate( np.where( alw, k, -1 ) )
+  cT   = np.cumsum( tgl )
+  c    = cT - np.where( lstA >= 0, cT[ np.maximum( lstA, 0 ) ], 0 )
+  prv  = np.where( lstA >= 0, True, bool( delim ) )
+  prod = np.where( alw, True, ( c & 1 ) == np.where( prv, 0, 1 ) )
+  dlm  = np.concatenate( ( [ bool( delim ) ], prod[:-1] ) )
+  ps   = np.where( dlm, s1, rs )
+  # the last run is unterminated
+  vld  = prod.copy()
+  vld[-1] = False
+  nul  = np.where( dlm & nulD, s1 - rs - 1, 0 )
+  return UlpiSegments(
+    rsz*ps[vld],
+    ( re - ps )[vld],
+    rdir[vld],
+    nul[vld],
+    rsz*trn,
+    int( rsz*rs[-1] ),
+    bool( dlm[-1] ) )
+
+# Return the times (ulpi clock cycles since the first record of 'buf')
+# at which the first and the last data byte of every packet identified
+# by 'seg' were recorded; ( t0, t1 ) are arrays. 'buf' must hold
+# time-stamped records (rsz >= ULPI_REC_SIZE_TS).
+# Note that the deltas saturate, i.e., idle periods of more than
+# 0xffff cycles are under-estimated.
+def ulpiTimes(buf, seg, rsz = ULPI_REC_SIZE_TS):
+  a    = np.frombuffer( buf, dtype = np.uint8 )
+  n    = len(a) // rsz
+  d    = a[2:rsz*n:rsz].astype( np.uint64 ) | ( a[3:rsz*n:rsz].astype( np.uint64 ) << 8 )
+  # the first delta refers to a record we don't have
+  d[0:1] = 0
+  t    = np.cumsum( d )
+  r    = seg.off.astype( np.int64 ) // rsz
+  if ( len( r ) == 0 ):
+    return t[r], t[r]
+  return t[r], t[ r + seg.len.astype( np.int64 ) - 1 ]
+
+# Packet classification ('kind' column of the packet table)
+KIND_PKT  = 0 # USB packet (RX or TX)
+KIND_NOOP = 1 # TX NOOP
+KIND_REGW = 2 # PHY register write
+KIND_REGR = 3 # PHY register read (command)
+KIND_REGD = 4 # PHY register read (reply data)
+
+# Columnar packet table (one record per packet):
+#   off   : byte offset of the first data byte in the capture
+#   len   : number of data bytes
+#   dir   : ulpi DIR (i.e., RX)
+#   kind  : KIND_XXX
+#   pid   : 4-bit USB PID (valid for KIND_PKT only)
+#   pidOk : PID check bits (RX) are correct
+#   addr  : device address (tokens only; -1 otherwise)
+#   endp  : endpoint       (tokens only; -1 otherwise)
+UlpiPktDtype = np.dtype( [
+  ( 'off',   np.uint64 ),
+  ( 'len',   np.uint32 ),
+  ( 'dir',   np.bool_  ),
+  ( 'kind',  np.uint8  ),
+  ( 'pid',   np.uint8  ),
+  ( 'pidOk', np.bool_  ),
+  ( 'addr',  np.int8   ),
+  ( 'endp',  np.int8   ),
+] )
+
+# Build the packet table (a numpy structured array of UlpiPktDtype)
+# for the packets of 'buf' identified by 'seg' (UlpiSegments).
+# 'prevKind' is the kind of the packet preceding 'buf' (if known).
+def ulpiPktTable(buf, seg, prevKind = None, rsz = ULPI_REC_SIZE):
+  a    = np.frombuffer( buf, dtype = np.uint8 )
+  n    = len( seg )
+  rv   = np.zeros( n, dtype = UlpiPktDtype )
+  if ( n == 0 ):
+    return rv
+  off  = seg.off
+  ln   = seg.len
+  rx   = seg.dir
+  b0   = a[off]
+  # 2nd and 3rd data bytes (if present)
+  lim  = len(a) - 1
+  b1   = np.where( ln > 1, a[ np.minimum( off +   rsz, lim ) ], 0 )
+  b2   = np.where( ln > 2, a[ np.minimum( off + 2*rsz, lim ) ], 0 )
+  cmd  = b0 >> 6
+  kind = np.where( rx, KIND_PKT,
+         np.select( [ cmd == 0, cmd == 1, cmd == 2 ], [ KIND_NOOP, KIND_PKT, KIND_REGW ], KIND_REGR ) )
+  # the RX packet following a register read command is the reply
+  regd = np.zeros( n, dtype = bool )
+  regd[1:] = rx[1:] & ( kind[:-1] == KIND_REGR )
+  regd[0]  = rx[0] and ( prevKind == KIND_REGR )
+  kind = np.where( regd, KIND_REGD, kind )
+  pkt  = ( kind == KIND_PKT )
+  pid  = b0 & 0xf
+  pOk  = np.where( rx, ( ( ( b0 >> 4 ) ^ b0 ) & 0xf ) == 0xf, True )
+  tok  = pkt & rx & ( ln == 3 ) & np.isin( pid, [ PID_OUT, PID_IN, PID_SETUP, PID_PING ] )
+  rv['off']   = off
+  rv['len']   = ln
+  rv['dir']   = rx
+  rv['kind']  = kind
+  rv['pid']   = np.where( pkt, pid, 0 )
+  rv['pidOk'] = pkt & pOk
+  rv['addr']  = np.where( tok, b1 & 0x7f, -1 )
+  rv['endp']  = np.where( tok, ( ( b2 & 0x07 ) << 1 ) | ( b1 >> 7 ), -1 )
+  return rv
+
+# Mark the packets of a packet table which start a transaction
+# (OUT, IN, SETUP, PING tokens) or end one (SOF, SPLIT).
+def ulpiBoundary(tbl):
+  return ( tbl['kind'] == KIND_PKT ) & tbl['dir'] & np.isin( tbl['pid'],
+           [ PID_OUT, PID_IN, PID_SETUP, PID_PING, PID_SOF, PID_SPLIT ] )
+
+# Attribute every packet of a packet table to the token of its
+# transaction. Returns ( ti, own ): 'ti' is the index of the most recent
+# boundary packet (-1 if there is none) and 'own' tells whether packet
+# belongs to an endpoint, i.e., 'ti' is a token. The address and
+# endpoint of packet #i are thus tbl['addr'][ti[i]], tbl['endp'][ti[i]].
+def ulpiOwner(tbl):
+  bnd = ulpiBoundary( tbl )
+  ti  = np.maximum.accumulate( np.where( bnd, np.arange( len( tbl ) ), -1 ) )
+  own = ( tbl['kind'] == KIND_PKT ) & ( ti >= 0 )
+  own[own] = ( tbl['addr'][ ti[own] ] >= 0 )
+  return ti, own
+
+# Packet filter; all criteria which are not None must be met:
+#  isRx   : direction
+#  pids   : set of (4-bit) PIDs; implies USB packets only
+#  kinds  : set of KIND_XXX
+#  addr   : device address   (of the token of the transaction)
+#  endp   : endpoint number  (of the token of the transaction)
+#  minLen : min. number of data bytes
+#  maxLen : max. number of data bytes
+# The filter is evaluated on the packet table, i.e., vectorized and
+# before any packet data are touched.
+class UlpiFilter(object):
+
+  def __init__(self, isRx = None, pids = None, kinds = None, addr = None, endp = None, minLen = None, maxLen = None):
+    self.isRx   = isRx
+    self.pids   = pids
+    self.kinds  = kinds
+    self.addr   = addr
+    self.endp   = endp
+    self.minLen = minLen
+    self.maxLen = maxLen
+
+  # return a boolean array selecting the packets of 'tbl'
+  def mask(self, tbl):
+    m = np.ones( len( tbl ), dtype = bool )
+    if ( not self.isRx is None ):
+      m &= ( tbl['dir'] == bool( self.isRx ) )
+    if ( not self.pids is None ):
+      m &= ( tbl['kind'] == KIND_PKT ) & np.isin( tbl['pid'], list( self.pids ) )
+    if ( not self.kinds is None ):
+      m &= np.isin( tbl['kind'], list( self.kinds ) )
+    if ( not self.minLen is None ):
+      m &= ( tbl['len'] >= self.minLen )
+    if ( not self.maxLen is None ):
+      m &= ( tbl['len'] <= self.maxLen )
+    if ( not self.addr is None or not self.endp is None ):
+      ti, own = ulpiOwner( tbl )
+      ti      = np.maximum( ti, 0 )
+      m      &= own
+      if ( not self.addr is None ):
+        m &= ( tbl['addr'][ti] == self.addr )
+      if ( not self.endp is None ):
+        m &= ( tbl['endp'][ti] == self.endp )
+    return m
+
+# Convert a packet table into a pandas DataFrame (pandas is only
+# required if this adapter is used).
+def toDataFrame(tbl):
+  import pandas
+  return pandas.DataFrame( tbl )
+
+# Persistent packet index ('sidecar' file stored next to the capture).
+#
+# The index holds the packet table and a list of checkpoints, i.e., the
+# indices of the first token at or after every 'K'th packet. Checkpoints
+# are transaction boundaries from where decoding of a window may start.
+# A signature of the capture (size, modification time and a checksum of
+# the head and tail) is recorded; the index is rebuilt automatically if
+# the signature does not match.
+
+ULPI_INDEX_VERSION = 2
+ULPI_INDEX_SUFFIX  = ".idx.npz"
+ULPI_INDEX_CKPT    = 4096
+
+def ulpiIndexName(fnam):
+  return fnam + ULPI_INDEX_SUFFIX
+
+# signature of the capture file 'f' (open file object) mapped by 'buf'
+def ulpiCaptureSig(f, buf):
+  st  = os.fstat( f.fileno() )
+  blk = 1 << 16
+  crc = zlib.crc32( buf[:blk] )
+  crc = zlib.crc32( buf[-blk:], crc )
+  return np.array( [ st.st_size, st.st_mtime_ns, crc ], dtype = np.uint64 )
+
+# compute the checkpoints of a packet table
+def ulpiCheckpoints(tbl, K = ULPI_INDEX_CKPT):
+  tok = np.flatnonzero( ( tbl['kind'] == KIND_PKT ) & ( tbl['addr'] >= 0 ) )
+  i   = np.searchsorted( tok, np.arange( 0, len( tbl ), K ) )
+  return np.unique( tok[ i[ i < len( tok ) ] ] )
+
+def ulpiSaveIndex(fnam, sig, seg, tbl, K = ULPI_INDEX_CKPT, rsz = ULPI_REC_SIZE):
+  hdr = np.array( [ ULPI_INDEX_VERSION, K, seg.end, seg.delim, rsz ], dtype = np.uint64 )
+  tmp = ulpiIndexName( fnam ) + ".tmp"
+  with io.open( tmp, "wb" ) as f:
+    np.savez( f, hdr = hdr, sig = sig, tbl = tbl, ckpt = ulpiCheckpoints( tbl, K ) )
+  os.replace( tmp, ulpiIndexName( fnam ) )
+
+# load the index of 'fnam'; returns ( seg, tbl, ckpt ) or None if there
+# is no valid index matching 'sig' and record size 'rsz'
+def ulpiLoadIndex(fnam, sig, rsz = ULPI_REC_SIZE):
+  try:
+    with np.load( ulpiIndexName( fnam ), allow_pickle = False ) as z:
+      hdr = z['hdr']
+      if ( hdr[0] != ULPI_INDEX_VERSION or hdr[4] != rsz or not np.array_equal( z['sig'], sig ) ):
+        return None
+      tbl  = z['tbl']
+      ckpt = z['ckpt']
+  except ( OSError, KeyError, ValueError ):
+    return None
+  seg = UlpiSegments( tbl['off'].astype( np.int64 ), tbl['len'].astype( np.int64 ), tbl['dir'],
+                      None, None, int( hdr[2] ), bool( hdr[3] ) )
+  return seg, tbl, ckpt
+
+# Parallel parsing
+#
+# The capture is cut into chunks which are segmented (and tabulated)
+# in a pool of worker processes; each worker maps the capture file
+# itself so that the pages are shared via the OS cache.
+#
+# Chunks are cut at the end of an RX packet of at least two bytes,
+# i.e., at the first record of a DIR == 0 run which follows a DIR == 1
+# run of length >= 2. Such a run always yields a packet, hence the
+# record at the cut is known to be a delimiter and the segmentation of
+# the chunks is identical to the serial one.
+
+# return the (byte) offsets at which to cut 'buf' into chunks of
+# approximately 'chunkSize' bytes (the list starts with 0)
+def ulpiCutPoints(buf, chunkSize, rsz = ULPI_REC_SIZE):
+  a    = np.frombuffer( buf, dtype = np.uint8 )
+  n    = len(a) - len(a) % rsz
+  rv   = [ 0 ]
+  cs   = max( chunkSize - chunkSize % rsz, rsz )
+  p    = cs
+  while ( p < n ):
+    w = 1 << 16
+    while True:
+      e   = min( p + w, n )
+      f   = ( a[p + 1 : e : rsz] & UlpiLogParser.DIR ) != 0
+      c   = np.flatnonzero( f[:-2] & f[1:-1] & ~ f[2:] )
+      if ( len(c) > 0 or e == n ):
+        break
+      w <<= 1
+    if ( len(c) == 0 ):
+      break
+    cut = p + rsz*( int( c[0] ) + 2 )
+    rv.append( cut )
+    p   = cut + cs
+  return rv
+
+# worker: segment and tabulate buf[b:e] of capture 'fnam'
+def ulpiParseChunk(fnam, b, e, delim, rsz = ULPI_REC_SIZE):
+  with io.open( fnam, "rb" ) as f:
+    m = mmap.mmap( f.fileno(), 0, access = mmap.ACCESS_READ )
+  try:
+    v   = memoryview( m )[b:e]
+    seg = ulpiSegment( v, delim, rsz )
+    tbl = ulpiPktTable( v, seg, rsz = rsz )
+    v.release()
+  finally:
+    m.close()
+  seg.off   += b
+  seg.trn   += b
+  seg.end   += b
+  tbl['off'] = seg.off
+  return seg, tbl
+
+# Segment and tabulate capture file 'fnam' using 'jobs' worker processes.
+# Returns ( seg, tbl ) which are identical to the serial
+# ulpiSegment()/ulpiPktTable() results.
+def ulpiParallelParse(fnam, jobs = None, chunkSize = 64 << 20, rsz = ULPI_REC_SIZE):
+  import concurrent.futures
+  with io.open( fnam, "rb" ) as f:
+    m = mmap.mmap( f.fileno(), 0, access = mmap.ACCESS_READ )
+  try:
+    cuts = ulpiCutPoints( m, chunkSize, rsz )
+    n    = len( m )
+  finally:
+    m.close()
+  with concurrent.futures.ProcessPoolExecutor( max_workers = jobs ) as ex:
+    futs = []
+    for i in range( len( cuts ) ):
+      b = cuts[i]
+      # include the delimiter at the next cut
+      e = cuts[i + 1] + rsz if i + 1 < len( cuts ) else n
+      futs.append( ex.submit( ulpiParseChunk, fnam, b, e, i > 0, rsz ) )
+    res = [ f.result() for f in futs ]
+  segs = [ r[0] for r in res ]
+  seg  = UlpiSegments(
+           np.concatenate( [ x.off for x in segs ] ),
+           np.concatenate( [ x.len for x in segs ] ),
+           np.concatenate( [ x.dir for x in segs ] ),
+           np.concatenate( [ x.nul for x in segs ] ),
+           np.concatenate( [ x.trn for x in segs ] ),
+           segs[-1].end,
+           segs[-1].delim )
+  tbl  = np.concatenate( [ r[1] for r in res ] )
+  return seg, tbl
+
+# Compressed captures
+#
+# A capture container holds the records of a capture in independently
+# compressed chunks (zlib or lzma) followed by a chunk index:
+#
+#   file header   : magic 'ULPZ', version, codec, record size, chunk size
+#   chunk         : magic 'ULCK', flags, compressed size, raw size, data
+#   chunk         : ...
+#   index         : magic 'ULIX', number of chunks, one entry per chunk
+#                   ( file offset, raw offset, compressed size, raw size,
+#                   flags )
+#   trailer       : file offset of the index, magic 'ULPZIEND'
+#
+# The index is written when the container is closed and removed again
+# when more data are appended. Chunks are self-describing, i.e., a
+# container which is still being written (or was never closed) is read
+# by scanning the chunk headers (an incomplete chunk at the end is
+# ignored).
+#
+# Chunks are cut (if possible) at the end of an RX packet (see
+# ulpiCutPoints) and flagged accordingly; parsing may start at any such
+# chunk without decompressing anything ahead of it.
+#
+#   with UlpiCaptureWriter( "capture.ulpz", recSize = ULPI_REC_SIZE_TS ) as w:
+#     for d in dumps:
+#       w.write( d )
+#
+#   with UlpiCaptureReader( "capture.ulpz" ) as z:
+#     for p in UlpiStreamParser( recSize = z.recSize ).parse( z ):
+#       ...
+#
+# UlpiLogParser.open() and ulpiOpenCapture() recognize containers
+# transparently.
+
+ULPI_Z_MAGIC     = b'ULPZ'
+ULPI_Z_VERSION   = 1
+ULPI_Z_CHUNK     = 4 << 20
+ULPI_Z_CODECS    = ( "zlib", "lzma" )
+# the captures are very repetitive; a fast lzma preset compresses them
+# better (and faster) than zlib
+ULPI_Z_PRESET    = 1
+
+# chunk flags
+ULPI_Z_BOUNDARY  = 0x1  # chunk starts with a packet delimiter
+
+_Z_HDR           = struct.Struct( "<4sBBBxII" )
+_Z_CHUNK         = struct.Struct( "<4sIII" )
+_Z_CHUNK_MAGIC   = b'ULCK'
+_Z_IDX           = struct.Struct( "<4sI" )
+_Z_IDX_MAGIC     = b'ULIX'
+_Z_IDX_ENT       = struct.Struct( "<QQIII" )
+_Z_TRAILER       = struct.Struct( "<Q8s" )
+_Z_TRAILER_MAGIC = b'ULPZIEND'
+
+# whether the open (binary) file 'f' is a capture container; the file
+# position is preserved
+def ulpiIsCompressed(f):
+  pos = f.tell()
+  try:
+    f.seek( 0 )
+    return f.read( len( ULPI_Z_MAGIC ) ) == ULPI_Z_MAGIC
+  finally:
+    f.seek( pos )
+
+# open a capture file for reading: returns a UlpiCaptureReader for
+# containers and a plain (binary) file object otherwise
+def ulpiOpenCapture(fnam):
+  f = io.open( fnam, "rb" )
+  if ( ulpiIsCompressed( f ) ):
+    f.close()
+    return UlpiCaptureReader( fnam )
+  return f
+
+# read the header and the chunk index of the container file 'f';
+# returns ( codec, recSize, chunkSize, chunks, end ) where 'chunks' is
+# a list of index entries and 'end' the file offset following the last
+# complete chunk
+def _zReadIndex(f, chunks = None, end = None):
+  f.seek( 0 )
+  h = f.read( _Z_HDR.size )
+  if ( len( h ) < _Z_HDR.size ):
+    raise ValueError("Not a ulpi capture container (truncated header)")
+  mgc, ver, cod, rsz, csz, rsv = _Z_HDR.unpack( h )
+  if ( mgc != ULPI_Z_MAGIC or ver != ULPI_Z_VERSION or cod >= len( ULPI_Z_CODECS ) ):
+    raise ValueError("Not a ulpi capture container (or unsupported version)")
+  if ( chunks is None ):
+    chunks = []
+    fsz    = f.seek( 0, io.SEEK_END )
+    if ( fsz >= _Z_HDR.size + _Z_IDX.size + _Z_TRAILER.size ):
+      f.seek( fsz - _Z_TRAILER.size )
+      ioff, mgc = _Z_TRAILER.unpack( f.read( _Z_TRAILER.size ) )
+      if ( mgc == _Z_TRAILER_MAGIC and ioff >= _Z_HDR.size ):
+        f.seek( ioff )
+        mgc, n = _Z_IDX.unpack( f.read( _Z_IDX.size ) )
+        if ( mgc == _Z_IDX_MAGIC and ioff + _Z_IDX.size + n * _Z_IDX_ENT.size + _Z_TRAILER.size == fsz ):
+          raw    = f.read( n * _Z_IDX_ENT.size )
+          chunks = [ _Z_IDX_ENT.unpack_from( raw, i * _Z_IDX_ENT.size ) for i in range( n ) ]
+          return ULPI_Z_CODECS[cod], rsz, csz, chunks, ioff
+  # no (valid) index; scan the chunk headers
+  if ( end is None ):
+    end  = _Z_HDR.size
+  roff   = chunks[-1][1] + chunks[-1][3] if len( chunks ) > 0 else 0
+  fsz    = f.seek( 0, io.SEEK_END )
+  while ( end + _Z_CHUNK.size <= fsz ):
+    f.seek( end )
+    mgc, flg, clen, rlen = _Z_CHUNK.unpack( f.read( _Z_CHUNK.size ) )
+    if ( mgc != _Z_CHUNK_MAGIC or end + _Z_CHUNK.size + clen > fsz ):
+      break
+    chunks.append( ( end, roff, clen, rlen, flg ) )
+    end  += _Z_CHUNK.size + clen
+    roff += rlen
+  return ULPI_Z_CODECS[cod], rsz, csz, chunks, end
+
+# Write (or append to) a capture container. Data are buffered and
+# compressed in chunks of approximately 'chunkSize' bytes; flush()
+# forces the buffered (complete) records out, e.g., to make them
+# visible to a reader while capturing. When appending to an existing
+# container its codec and chunk size are retained; the record size
+# must match.
+#  codec : "zlib" or "lzma"
+#  level : compression level (zlib) or preset (lzma); None: default
+class UlpiCaptureWriter(object):
+
+  def __init__(self, fnam, recSize = ULPI_REC_SIZE, codec = "lzma", level = None, chunkSize = ULPI_Z_CHUNK, append = True):
+    if ( not codec in ULPI_Z_CODECS ):
+      raise ValueError("UlpiCaptureWriter: unknown codec '{}'".format( codec ))
+    self._rsz   = recSize
+    self._lvl   = level
+    self._buf   = bytearray()
+    self._bnd   = False
+    self._f     = None
+    ex          = append and os.path.exists( fnam ) and os.path.getsize( fnam ) > 0
+    f           = io.open( fnam, "r+b" if ex else "wb" )
+    try:
+      if ( ex ):
+        codec, rsz, chunkSize, self._chunks, end = _zReadIndex( f )
+        if ( rsz != recSize ):
+          raise ValueError("UlpiCaptureWriter: record size of '{}' is {:d}".format( fnam, rsz ))
+        # drop the index (and an incomplete chunk)
+        f.truncate( end )
+        f.seek( end )
+      else:
+        f.write( _Z_HDR.pack( ULPI_Z_MAGIC, ULPI_Z_VERSION, ULPI_Z_CODECS.index( codec ), recSize, chunkSize, 0 ) )
+        self._chunks = []
+        # the capture starts at a packet boundary
+        self._bnd    = True
+    except:
+      f.close()
+      raise
+    self._f     = f
+    self._codec = codec
+    self._csz   = max( chunkSize - chunkSize % recSize, recSize )
+
+  @property
+  def recSize(self):
+    return self._rsz
+
+  # number of (raw) bytes written so far
+  @property
+  def size(self):
+    n = self._chunks[-1][1] + self._chunks[-1][3] if len( self._chunks ) > 0 else 0
+    return n + len( self._buf )
+
+  def _compress(self, d):
+    if ( self._codec == "lzma" ):
+      return lzma.compress( d, preset = ULPI_Z_PRESET if self._lvl is None else self._lvl )
+    return zlib.compress( d ) if self._lvl is None else zlib.compress( d, self._lvl )
+
+  def _put(self, n, bnd):
+    d     = bytes( self._buf[:n] )
+    del self._buf[:n]
+    c     = self._compress( d )
+    off   = self._f.tell()
+    roff  = self._chunks[-1][1] + self._chunks[-1][3] if len( self._chunks ) > 0 else 0
+    flg   = ULPI_Z_BOUNDARY if self._bnd else 0
+    self._f.write( _Z_CHUNK.pack( _Z_CHUNK_MAGIC, flg, len( c ), len( d ) ) )
+    self._f.write( c )
+    self._chunks.append( ( off, roff, len( c ), len( d ), flg ) )
+    self._bnd = bnd
+
+  def write(self, data):
+    self._buf += data
+    cs         = self._csz
+    while ( len( self._buf ) >= cs ):
+      cuts = ulpiCutPoints( self._buf, cs, self._rsz )
+      if ( len( cuts ) > 1 ):
+        self._put( cuts[1], True )
+      elif ( len( self._buf ) >= 2*cs ):
+        # no packet boundary in sight
+        self._put( cs, False )
+      else:
+        break
+    return len( data )
+
+  # compress all buffered complete records
+  def flush(self):
+    n = len( self._buf ) - len( self._buf ) % self._rsz
+    if ( n > 0 ):
+      self._put( n, False )
+    self._f.flush()
+
+  # write all buffered data and the index
+  def close(self):
+    if ( self._f is None ):
+      return
+    try:
+      if ( len( self._buf ) > 0 ):
+        self._put( len( self._buf ), False )
+      ioff = self._f.tell()
+      self._f.write( _Z_IDX.pack( _Z_IDX_MAGIC, len( self._chunks ) ) )
+      self._f.write( b''.join( [ _Z_IDX_ENT.pack( *c ) for c in self._chunks ] ) )
+      self._f.write( _Z_TRAILER.pack( ioff, _Z_TRAILER_MAGIC ) )
+    finally:
+      self._f.close()
+      self._f = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+    return False
+
+# Read a capture container. The reader is a (read-only, binary) file-like
+# object streaming the raw records; in addition any chunk may be
+# decompressed individually. refresh() picks up chunks appended since
+# the container was opened (e.g., while capturing).
+class UlpiCaptureReader(object):
+
+  def __init__(self, fnam):
+    self._f = io.open( fnam, "rb" )
+    try:
+      self._codec, self._rsz, self._csz, self._chunks, self._end = _zReadIndex( self._f )
+    except:
+      self._f.close()
+      raise
+    # current chunk, its raw offset, position therein and the index
+    # of the next chunk
+    self._cur = b''
+    self._off = 0
+    self._pos = 0
+    self._ci  = 0
+
+  @property
+  def recSize(self):
+    return self._rsz
+
+  @property
+  def codec(self):
+    return self._codec
+
+  # total (raw) size of the capture
+  @property
+  def size(self):
+    return self._chunks[-1][1] + self._chunks[-1][3] if len( self._chunks ) > 0 else 0
+
+  # compressed size (bytes of chunk data)
+  @property
+  def compressedSize(self):
+    return sum( [ c[2] for c in self._chunks ] )
+
+  def __len__(self):
+    return len( self._chunks )
+
+  # scan for chunks appended since the last scan; returns the number of
+  # new chunks
+  def refresh(self):
+    n = len( self._chunks )
+    self._chunks, self._end = _zReadIndex( self._f, self._chunks, self._end )[3:]
+    return len( self._chunks ) - n
+
+  # raw offset of chunk 'i'
+  def chunkOffset(self, i):
+    return self._chunks[i][1]
+
+  # whether chunk 'i' starts with a packet delimiter (parsing can start
+  # there, see UlpiStreamParser.reset)
+  def boundary(self, i):
+    return ( self._chunks[i][4] & ULPI_Z_BOUNDARY ) != 0
+
+  # index of the chunk holding raw offset 'off'
+  def chunkAt(self, off):
+    i = bisect.bisect_right( [ c[1] for c in self._chunks ], off ) - 1
+    if ( i < 0 or off >= self.size ):
+      raise IndexError("UlpiCaptureReader: offset out of range")
+    return i
+
+  # decompress chunk 'i'
+  def chunk(self, i):
+    off, roff, clen, rlen, flg = self._chunks[i]
+    self._f.seek( off + _Z_CHUNK.size )
+    c = self._f.read( clen )
+    d = lzma.decompress( c ) if self._codec == "lzma" else zlib.decompress( c )
+    if ( len( d ) != rlen ):
+      raise ValueError("UlpiCaptureReader: chunk {:d} is corrupt".format( i ))
+    return d
+
+  # iterate over the (decompressed) chunks first..last-1
+  def chunks(self, first = 0, last = None):
+    if ( last is None ):
+      last = len( self._chunks )
+    for i in range( first, last ):
+      yield self.chunk( i )
+
+  # decompress the entire capture
+  def readall(self):
+    rv = bytearray()
+    for c in self.chunks():
+      rv += c
+    return rv
+
+  def read(self, n = -1):
+    if ( n is None or n < 0 ):
+      rv = bytearray( self._cur[self._pos:] )
+      for c in self.chunks( self._ci ):
+        rv += c
+      self.seek( self.size )
+      return bytes( rv )
+    rv = bytearray()
+    while ( len( rv ) < n ):
+      if ( self._pos >= len( self._cur ) ):
+        if ( self._ci >= len( self._chunks ) ):
+          break
+        self._off  = self._chunks[self._ci][1]
+        self._cur  = self.chunk( self._ci )
+        self._ci  += 1
+        self._pos  = 0
+      e          = min( self._pos + n - len( rv ), len( self._cur ) )
+      rv        += self._cur[self._pos:e]
+      self._pos  = e
+    return bytes( rv )
+
+  # position the stream at raw offset 'off'
+  def seek(self, off, whence = io.SEEK_SET):
+    if ( whence == io.SEEK_CUR ):
+      off += self.tell()
+    elif ( whence == io.SEEK_END ):
+      off += self.size
+    off = max( off, 0 )
+    if ( off >= self.size ):
+      self._cur, self._off, self._pos, self._ci = b'', self.size, 0, len( self._chunks )
+    else:
+      i         = self.chunkAt( off )
+      self._cur = self.chunk( i )
+      self._off = self._chunks[i][1]
+      self._pos = off - self._off
+      self._ci  = i + 1
+    return self.tell()
+
+  def tell(self):
+    return self._off + self._pos
+
+  def close(self):
+    if ( not self._f is None ):
+      self._f.close()
+      self._f = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+    return False
+
+# The parser operates on any object supporting the buffer protocol
+# (bytes, bytearray, memoryview, mmap, numpy array, ...) without copying
+# it. Packets are returned as (strided) memoryviews into the underlying
+# buffer; use bytes() on them if a copy is required.
+# Time-stamped captures (UlpiLogger with TIMESTAMP_G) are parsed with
+# recSize = ULPI_REC_SIZE_TS.
+#
+#   with UlpiLogParser.open( "capture.bin" ) as p:
+#     p.dumpPkts()
+class UlpiLogParser(object):
 
   DIR = 0x1
 
-  def __init__(self, *args, **kwargs):
-    super().__init__( *args, **kwargs )
-    self._p   =  0
+  def __init__(self, buf = b'', recSize = ULPI_REC_SIZE):
+    self._mem = None
+    self._buf = memoryview( buf ).cast( 'B' )
+    self._rsz  = recSize
+    self._i    = 0
+    self._seg  = None
+    self._tbl  = None
+    self._ckpt = None
+    self._tim  = None
+
+  # map a capture file (read-only) into memory. If 'index' is True
+  # then the packet index is loaded from the sidecar file (which is
+  # created or rebuilt as necessary).
+  # If 'jobs' is not 1 then the capture is segmented and tabulated
+  # by a pool of 'jobs' worker processes (None: one per CPU).
+  # A capture container is decompressed into memory (serially); its
+  # record size overrides 'recSize'.
+  @classmethod
+  def open(clazz, fnam, index = False, ckptInterval = ULPI_INDEX_CKPT, jobs = 1, recSize = ULPI_REC_SIZE):
+    with io.open( fnam, "rb" ) as f:
+      if ( os.fstat( f.fileno() ).st_size == 0 ):
+        return clazz( recSize = recSize )
+      if ( ulpiIsCompressed( f ) ):
+        with UlpiCaptureReader( fnam ) as z:
+          recSize = z.recSize
+          rv      = clazz( z.readall(), recSize )
+        jobs      = 1
+      else:
+        m       = mmap.mmap( f.fileno(), 0, access = mmap.ACCESS_READ )
+        rv      = clazz( m, recSize )
+        rv._mem = m
+      ld      = None
+      if ( index ):
+        sig = ulpiCaptureSig( f, rv._buf )
+        ld  = ulpiLoadIndex( fnam, sig, recSize )
+      if ( ld is None and jobs != 1 ):
+        rv._seg, rv._tbl = ulpiParallelParse( fnam, jobs, rsz = recSize )
+      if   ( not ld is None ):
+        rv._seg, rv._tbl, rv._ckpt = ld
+      elif ( index ):
+        try:
+          ulpiSaveIndex( fnam, sig, rv.segments(), rv.table(), ckptInterval, recSize )
+        except OSError:
+          # cannot write the sidecar; proceed without
+          pass
+        rv._ckpt = ulpiCheckpoints( rv.table(), ckptInterval )
+    return rv
+
+  def close(self):
+    self._seg = None
+    self._tbl = None
+    self._tim = None
+    self._buf.release()
+    if ( not self._mem is None ):
+      self._mem.close()
+      self._mem = None
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+    return False
+
+  def __len__(self):
+    return len( self._buf )
+
+  def __getitem__(self, i):
+    return self._buf[i]
 
-  def dir(self, off = 0):
-    return bool( (self[self._p + off + 1] & 1) )
+  # the underlying buffer (a memoryview)
+  @property
+  def buf(self):
+    return self._buf
 
-  def nullmark(self):
-      return ( not self.dir() ) and ( self[self._p] == 0x00 )
+  # the record size (bytes)
+  @property
+  def recSize(self):
+    return self._rsz
+
+  # whether the records carry time stamps
+  @property
+  def hasTimes(self):
+    return self._rsz >= ULPI_REC_SIZE_TS
+
+  # return (and cache) the 'UlpiSegments' of this buffer
+  def segments(self):
+    if ( self._seg is None ):
+      self._seg = ulpiSegment( self._buf, rsz = self._rsz )
+    return self._seg
+
+  # return (and cache) the packet table of this buffer
+  def table(self):
+    if ( self._tbl is None ):
+      self._tbl = ulpiPktTable( self._buf, self.segments(), rsz = self._rsz )
+    return self._tbl
+
+  # return (and cache) the packet times ( t0, t1 ) (see ulpiTimes);
+  # requires a time-stamped capture
+  def times(self):
+    if ( not self.hasTimes ):
+      raise ValueError("UlpiLogParser: capture has no time stamps")
+    if ( self._tim is None ):
+      self._tim = ulpiTimes( self._buf, self.segments(), self._rsz )
+    return self._tim
+
+  # return the (offset, length) handle of packet #i; the data bytes
+  # are located at buf[offset : offset + recSize*length : recSize]
+  def handle(self, i):
+    s = self.segments()
+    return int( s.off[i] ), int( s.len[i] )
+
+  # return packet #i as a (data, isRx) tuple; 'data' is a view
+  def pkt(self, i):
+    s = self.segments()
+    o = int( s.off[i] )
+    r = self._rsz
+    return self._buf[o : o + r*int( s.len[i] ) : r], bool( s.dir[i] )
 
   def getpkt(self):
-    try:
-      e = 2
-      d = self.dir()
-      while ( self.dir( e ) == d ):
-        e += 2
-      e += self._p
-      rb      = self[self._p: e : 2]
-      self._p = e
-    except IndexError as ex:
-      raise(ex)
-
-    # skip mark
-    nullmark = self.nullmark()
-    # skip mark
-    self._p += 2
-
-    if nullmark:
-      # rxcommand may leave multiple 0x00 markers
-      try:
-        while self.nullmark():
-           self._p += 2
-      except IndexError:
-        pass
-    return rb, d
+    s = self.segments()
+    if ( self._i >= len(s) ):
+      raise IndexError("UlpiLogParser: no more packets")
+    rv       = self.pkt( self._i )
+    self._i += 1
+    return rv
+
+  # iterate over packets #first .. #last - 1 (default: all remaining)
+  def packets(self, first = 0, last = None):
+    n = len( self.segments() )
+    if ( last is None or last > n ):
+      last = n
+    for i in range( first, last ):
+      yield self.pkt( i )
+
+  # return the indices of the packets selected by filter 'flt'
+  def select(self, flt):
+    return np.flatnonzero( flt.mask( self.table() ) )
+
+  # iterate over the packets (starting at #first) selected by filter
+  # 'flt'; yields ( index, packet ) tuples
+  def filtered(self, flt, first = 0):
+    for i in self.select( flt ):
+      if ( i >= first ):
+        yield int( i ), self.pkt( i )
+
+  # position getpkt() at packet #i
+  def seek(self, i):
+    self._i = i
+
+  # return the checkpoints (see ulpiCheckpoints)
+  def checkpoints(self):
+    if ( self._ckpt is None ):
+      self._ckpt = ulpiCheckpoints( self.table() )
+    return self._ckpt
+
+  # return the index of the token starting the transaction that
+  # contains packet #i (or #i itself if there is none). The search
+  # starts at the closest checkpoint.
+  def xactStart(self, i):
+    ck  = self.checkpoints()
+    j   = np.searchsorted( ck, i, side = "right" ) - 1
+    b   = int( ck[j] ) if j >= 0 else 0
+    t   = self.table()[b : i + 1]
+    tok = np.flatnonzero( ( t['kind'] == KIND_PKT ) & ( t['addr'] >= 0 ) )
+    return b + int( tok[-1] ) if len( tok ) > 0 else i
+
+  # iterate over a window of 'count' packets starting at the
+  # transaction which contains packet #i
+  def window(self, i, count):
+    b = self.xactStart( i )
+    return self.packets( b, i + count )
 
   def rewind(self):
-    self._p = 0
+    self._i   = 0
 
   pidTbl = [
     "NULL",
@@ -101,47 +1035,432 @@ class UlpiLogParser(bytearray):
     "MDATA"
   ]
 
+  # format a packet (as printed by 'dump'); the returned string
+  # is terminated by a newline
   @staticmethod
-  def dump(tup, verbose = False):
+  def fmt(tup, verbose = False):
     buf   = tup[0]
     isRx  = tup[1]
     pid   = buf[0]
     isDat = ((pid & 3) == 3);
+    s     = ""
     if ( isRx ):
       if ( ( pid >> 4 ) ^ pid ) & 0xf != 0xf:
-        print("PID error 0x{:02x}".format(pid))
-      print("RX: PID {:5s}".format(UlpiLogParser.pidTbl[ (pid&0xf) ]), end="")
+        s += "PID error 0x{:02x}\n".format(pid)
+      s += "RX: PID {:5s}".format(UlpiLogParser.pidTbl[ (pid&0xf) ])
     else:
       if   ( pid & 0xc0 == 0x00 ):
-        print("TX: NOOP ?", end="")
+        s += "TX: NOOP ?"
         isDat = False
       elif ( pid & 0xc0 == 0x40 ):
-        print("TX: PID {:5s}".format(UlpiLogParser.pidTbl[ (pid&0xf) ]), end="")
+        s += "TX: PID {:5s}".format(UlpiLogParser.pidTbl[ (pid&0xf) ])
       elif ( pid & 0xc0 == 0x80 ):
-        print("WR: REG 0x{:2x}".format( pid & 0x3f ), end="")
+        s += "WR: REG 0x{:2x}".format( pid & 0x3f )
         isDat = False
       else:
-        print("RD: REG 0x{:2x}".format( pid & 0x3f ), end="")
+        s += "RD: REG 0x{:2x}".format( pid & 0x3f )
         isDat = False
     if ( isDat ):
-      print(" ({:d})".format( len(buf) - 3, end="" ), end="")
+      s += " ({:d})".format( len(buf) - 3 )
       if ( verbose ):
-        l = 0
-        for d in buf[0:-2]:
-          if ( 0 == l ):
-            print("\n     ", end = "")
-          print(" {:02X}".format(d), end="")
-          l = (l + 1) & 0xf
-    print()
-
-  def dumpPkts(self, verbose = False):
-    p = self._p
-    self.rewind()
-    try: 
+        d = bytes( buf[0:-2] )
+        for l in range( 0, len(d), 16 ):
+          s += "\n      " + d[l:l+16].hex(' ').upper()
+    return s + "\n"
+
+  @staticmethod
+  def dump(tup, verbose = False):
+    print( UlpiLogParser.fmt( tup, verbose ), end = "" )
+
+  def dumpPkts(self, verbose = False, f = None):
+    f = sys.stdout if f is None else f
+    # first one may be corrupt
+    f.writelines( UlpiLogParser.fmt( p, verbose ) for p in self.packets( first = 1 ) )
+
+# Incremental parser which is fed arbitrary chunks of a ulpi log stream
+# (e.g., as they arrive from the UlpiLogger 'datOut' stream or are read
+# from a file). Completed packets are returned as soon as their delimiter
+# has been seen; only the trailing, incomplete packet is retained between
+# calls.
+#
+#   p = UlpiStreamParser()
+#   for chunk in source:
+#     for pkt in p.feed( chunk ):
+#       UlpiLogParser.dump( pkt )
+#
+# Packets are (data, isRx) tuples as returned by UlpiLogParser.getpkt().
+#
+# If 'times' is set (time-stamped records only) then the times (ulpi
+# clock cycles since the first record fed, see ulpiTimes) of the first
+# data byte of the packets returned by the last call to feed() are
+# available in the list 't0'; parseTimed() yields ( packet, time ) tuples.
+class UlpiStreamParser(object):
+
+  # only packets matching 'flt' (UlpiFilter) are returned if a filter
+  # is given
+  def __init__(self, dropFirst = False, flt = None, recSize = ULPI_REC_SIZE, times = False):
+    if ( times and recSize < ULPI_REC_SIZE_TS ):
+      raise ValueError("UlpiStreamParser: times need time-stamped records")
+    self._dropFirst = dropFirst
+    self._flt       = flt
+    self._rsz       = recSize
+    self._times     = times
+    # time of the last record consumed (None: no record seen yet)
+    self._t         = None
+    self.t0         = []
+    self.reset()
+
+  # start over; e.g., when the next dump from the logger begins
+  # ('datLst' was seen). Any partial packet is discarded.
+  # Set 'delim' if the next record fed is known to be a packet
+  # delimiter (e.g., a container chunk flagged ULPI_Z_BOUNDARY).
+  def reset(self, delim = False):
+    self._buf   = bytearray()
+    self._delim = delim
+    self._drop  = self._dropFirst
+    # table rows of the last boundary and the last packet seen
+    # (context for filtering the next chunk)
+    self._ctx   = np.zeros( 0, dtype = UlpiPktDtype )
+
+  # number of bytes currently held back (partial packet)
+  def pending(self):
+    return len( self._buf )
+
+  # feed a chunk of data; returns a list of completed packets
+  def feed(self, chunk):
+    self._buf += chunk
+    r   = self._rsz
+    s   = ulpiSegment( self._buf, self._delim, r )
+    buf = self._buf
+    sel = np.ones( len( s ), dtype = bool )
+    if ( self._drop and len( s ) > 0 ):
       # first one may be corrupt
-      self.getpkt()
-      while True:
-        self.dump( self.getpkt(), verbose )
-    except IndexError:
-      pass
-    self._p = p
+      sel[0]     = False
+      self._drop = False
+    if ( not self._flt is None and len( s ) > 0 ):
+      nc        = len( self._ctx )
+      pk        = self._ctx['kind'][-1] if nc > 0 else None
+      tbl       = np.concatenate( ( self._ctx, ulpiPktTable( buf, s, pk, r ) ) )
+      sel      &= self._flt.mask( tbl )[nc:]
+      bnd       = np.flatnonzero( ulpiBoundary( tbl ) )
+      ctx       = [ len( tbl ) - 1 ]
+      if ( len( bnd ) > 0 and bnd[-1] != ctx[0] ):
+        ctx.insert( 0, bnd[-1] )
+      self._ctx = tbl[ctx]
+    rv  = [ ( buf[o : o + r*l : r], bool(d) ) for o, l, d in zip( s.off[sel].tolist(), s.len[sel].tolist(), s.dir[sel].tolist() ) ]
+    if ( self._times ):
+      t = self._deltas( 0, s.end )
+      if ( self._t is None and len( t ) > 0 ):
+        # the first delta refers to a record we don't have
+        t[0]    = 0
+        self._t = 0
+      t       = np.cumsum( t ) + self._t
+      self.t0 = t[ s.off[sel].astype( np.int64 ) // r ].tolist()
+      if ( len( t ) > 0 ):
+        self._t = int( t[-1] )
+    del buf[:s.end]
+    self._delim = s.delim
+    # a run of null markers following a delimiter may grow without
+    # bounds; only the leading delimiter needs to be kept.
+    n = len(buf) - len(buf) % r
+    if ( self._delim and n > r ):
+      if ( r == ULPI_REC_SIZE ):
+        nul = ( buf.count( 0, 0, n ) == n )
+      else:
+        nul = ( buf[0:n:r].count( 0 ) == n // r ) and ( buf[1:n:r].count( 0 ) == n // r )
+      if ( nul ):
+        if ( self._times and not self._t is None ):
+          self._t += int( np.sum( self._deltas( r, n ) ) )
+        del buf[r:n]
+    return rv
+
+  # time deltas of the records held in _buf[b:e]
+  def _deltas(self, b, e):
+    r = self._rsz
+    l = np.frombuffer( bytes( self._buf[b + 2 : e : r] ), dtype = np.uint8 ).astype( np.int64 )
+    h = np.frombuffer( bytes( self._buf[b + 3 : e : r] ), dtype = np.uint8 ).astype( np.int64 )
+    return l | ( h << 8 )
+
+  # iterate over all packets read from 'src' which is either a file-like
+  # object (with a 'read' method) or an iterable producing chunks.
+  def parse(self, src, chunkSize = 1 << 20):
+    if ( hasattr( src, "read" ) ):
+      chunks = iter( lambda: src.read( chunkSize ), b'' )
+    else:
+      chunks = src
+    for c in chunks:
+      for p in self.feed( c ):
+        yield p
+
+  # like parse() but yields ( packet, time ) tuples (requires 'times')
+  def parseTimed(self, src, chunkSize = 1 << 20):
+    if ( hasattr( src, "read" ) ):
+      chunks = iter( lambda: src.read( chunkSize ), b'' )
+    else:
+      chunks = src
+    for c in chunks:
+      pkts = self.feed( c )
+      for p, t in zip( pkts, self.t0 ):
+        yield p, t
+
+# Marker inserted into a packet stream where recording was interrupted
+# (see UlpiCaptureSession):
+#  dump   : number of the dump following the gap
+#  lost   : True if the logger memory wrapped, i.e., data were lost in
+#           addition to the time spent reading out the previous dump
+#  cycles : ulpi clock cycles elapsed between the last record of the
+#           previous and the first new record (time-stamped captures
+#           only, if no data were lost; saturated at 0xffff) or None
+#  uncertain : True if the dumps overlap in more than one way (repetitive
+#           traffic w/o time stamps); packets may have been dropped
+class UlpiGap(object):
+
+  __slots__ = ( "dump", "lost", "cycles", "uncertain" )
+
+  def __init__(self, dump, lost, cycles = None, uncertain = False):
+    self.dump      = dump
+    self.lost      = lost
+    self.cycles    = cycles
+    self.uncertain = uncertain
+
+  def __str__(self):
+    s = "GAP before dump #{:d}".format( self.dump )
+    if ( self.lost ):
+      s += " (data lost)"
+    if ( self.uncertain ):
+      s += " (overlap uncertain)"
+    if ( not self.cycles is None ):
+      s += " ({:d} cycles)".format( self.cycles )
+    return s
+
+# Minimal number of records two successive dumps must have in common
+# to be recognized as overlapping
+ULPI_MIN_OVERLAP = 16
+
+# Given two successive dumps of the same logger memory return the number
+# of records 'cur' holds in addition to 'prev' (cur == prev[k:] + new)
+# or None if they do not overlap (the memory wrapped). The smallest such
+# number (i.e., the largest overlap) is returned.
+def ulpiDumpOverlap(prev, cur, rsz = ULPI_REC_SIZE, minOverlap = ULPI_MIN_OVERLAP):
+  return next( ulpiDumpOverlaps( prev, cur, rsz, minOverlap ), None )
+
+# Iterate over all numbers of new records (in ascending order) for which
+# 'prev' and 'cur' overlap. Repetitive traffic (e.g., a NAK storm) w/o
+# time stamps matches at several offsets; the true one then cannot be
+# told (time-stamped records practically never repeat).
+def ulpiDumpOverlaps(prev, cur, rsz = ULPI_REC_SIZE, minOverlap = ULPI_MIN_OVERLAP):
+  n = len( cur )
+  L = minOverlap * rsz
+  if ( len( prev ) != n or n < L ):
+    return
+  key = cur[:L]
+  pos = prev.find( key )
+  while ( pos >= 0 ):
+    if ( pos % rsz == 0 and prev[pos:] == cur[:n - pos] ):
+      yield pos // rsz
+    pos = prev.find( key, pos + 1 )
+
+# Return the number of records (less than 'minOverlap') by which the
+# tail of 'prev' and the head of 'cur' overlap (0 if they don't).
+# Such a short overlap cannot be distinguished from a coincidence.
+def ulpiDumpTail(prev, cur, rsz = ULPI_REC_SIZE, minOverlap = ULPI_MIN_OVERLAP):
+  n = len( prev )
+  for m in range( min( minOverlap - 1, n // rsz, len( cur ) // rsz ), 0, -1 ):
+    if ( prev[n - m*rsz:] == cur[:m*rsz] ):
+      return m
+  return 0
+
+# Find the first packet boundary at the head of a dump which does not
+# continue the data seen so far (the memory wrapped). Returns ( o, delim ):
+# parsing starts at byte offset 'o' with 'delim' telling whether the
+# record there is a delimiter; anything ahead is (part of) a torn packet.
+#
+# In the data written by the logger a record with DIR set followed by
+# one without is either RX data followed by the (zero) end marker or a
+# TX stop (or register read) delimiter followed by the next TX command,
+# i.e., the first DIR 1 -> 0 transition is a packet boundary.
+#
+# If 'clean' is set then the head of the memory may never have been
+# written (first dump after configuration; the memory is initialized to
+# zero). Never written time-stamped records are recognized exactly
+# (written records have a non-zero delta); otherwise a run of at least
+# two zero records at the head is assumed to be never written if it is
+# followed by a valid packet start (RX PID or TX command).
+def ulpiDumpHead(buf, rsz = ULPI_REC_SIZE, clean = False):
+  a   = np.frombuffer( buf, dtype = np.uint8 )
+  n   = len(a) // rsz
+  dat = a[0:rsz*n:rsz]
+  flg = a[1:rsz*n:rsz]
+  if ( clean and n > 0 ):
+    if ( rsz >= ULPI_REC_SIZE_TS ):
+      nw = ( np.count_nonzero( a[0:rsz] ) == 0 )
+    else:
+      z  = np.flatnonzero( dat | flg )
+      nw = ( len( z ) == 0 )
+      if ( not nw and z[0] >= 2 ):
+        c  = int( dat[ z[0] ] )
+        if ( flg[ z[0] ] & UlpiLogParser.DIR ):
+          nw = ( ( ( c >> 4 ) ^ c ) & 0xf == 0xf )
+        else:
+          nw = ( ( c & 0xf0 ) == 0x40 ) or ( ( c & 0x80 ) != 0 )
+    if ( nw ):
+      return 0, True
+  drf = ( flg & UlpiLogParser.DIR ) != 0
+  t   = np.flatnonzero( drf[:-1] & ~ drf[1:] )
+  if ( len( t ) == 0 ):
+    return rsz*n, False
+  i   = int( t[0] ) + 1
+  return rsz*i, bool( dat[i] == 0 and flg[i] == 0 )
+
+# A capture session joins the successive dumps of a UlpiLogger (one dump
+# is streamed out every time 'halt' is pulsed) into one continuous packet
+# stream.
+#
+# When the logger memory did not wrap between two halts then the new
+# dump repeats part of the previous one; only the new records are parsed.
+# Recording resumes at a packet boundary, thus nothing is lost (except
+# for the traffic during readout). Otherwise the head of the new dump
+# is discarded up to the first packet boundary (see ulpiDumpHead),
+# i.e., the torn packet (and rarely a few intact TX packets preceding
+# the first RX packet).
+# If the memory wrapped only just (the dumps overlap by less than
+# ULPI_MIN_OVERLAP records) then the overlapping records are skipped,
+# too, so that no packet is ever reported twice.
+# Only time-stamped captures (UlpiLogger with TIMESTAMP_G) are joined
+# reliably: w/o time stamps repetitive traffic may overlap in several
+# ways. The largest overlap is assumed (packets may be dropped but none
+# is reported twice) and the gap is marked 'uncertain'; conversely, a
+# wrapped memory may by coincidence look like an overlap.
+# Set 'clean' if the logger memory was initialized (FPGA configured)
+# before the first dump (implied for time-stamped records).
+# The unterminated packet at the end of a dump is always discarded.
+#
+# A UlpiGap marker is inserted ahead of the packets of every dump but
+# the first one. Only the last dump is retained.
+# If a filter (UlpiFilter) is given then only matching packets are
+# returned; transactions do not extend across gaps.
+# With 'times' (time-stamped records) 't0' holds the times (ulpi clock
+# cycles since the first record) of the items returned by the last
+# feed() (None for the gap marker). Time is continuous across gaps
+# unless the memory wrapped; the unknown time lost then is not counted.
+#
+#   s = UlpiCaptureSession()
+#   for dump in dumps:
+#     for p in s.feed( dump ):
+#       if ( isinstance( p, UlpiGap ) ):
+#         print( p )
+#       else:
+#         UlpiLogParser.dump( p )
+class UlpiCaptureSession(object):
+
+  def __init__(self, recSize = ULPI_REC_SIZE, flt = None, clean = False, times = False):
+    if ( times and recSize < ULPI_REC_SIZE_TS ):
+      raise ValueError("UlpiCaptureSession: times need time-stamped records")
+    self._rsz  = recSize
+    self._flt  = flt
+    self._cln  = clean
+    self._tms  = times
+    self._prev = None
+    # time of the last record of the previous dump
+    self._t    = 0
+    self.t0    = []
+    # number of dumps seen
+    self.dumps = 0
+    # number of dumps which did not overlap with their predecessor
+    self.wraps = 0
+    # number of dumps which overlapped with their predecessor in more
+    # than one way
+    self.uncertain = 0
+
+  # feed the next dump; returns the list of packets (and the gap marker)
+  def feed(self, dump):
+    r    = self._rsz
+    d    = bytes( dump )
+    d    = d[: len(d) - len(d) % r]
+    rv   = []
+    k    = None
+    unc  = False
+    if ( not self._prev is None ):
+      ks = list( itertools.islice( ulpiDumpOverlaps( self._prev, d, r ), 2 ) )
+      k  = ks[0] if len( ks ) > 0 else None
+      unc = ( len( ks ) > 1 )
+    if ( k is None ):
+      # first dump or the memory wrapped
+      o  = 0
+      if ( not self._prev is None ):
+        o = ulpiDumpTail( self._prev, d, r ) * r
+      cln   = ( self._prev is None ) and ( self._cln or r >= ULPI_REC_SIZE_TS )
+      h, dl = ulpiDumpHead( memoryview( d )[o:], r, cln )
+      o    += h
+    else:
+      # only the last k records are new; recording resumed at a
+      # packet boundary
+      o  = len( d ) - k*r
+      dl = False
+    if ( self.dumps > 0 ):
+      cyc = None
+      if ( not k is None and r >= ULPI_REC_SIZE_TS and o < len( d ) ):
+        cyc = d[o + 2] | ( d[o + 3] << 8 )
+      rv.append( UlpiGap( self.dumps, k is None, cyc, unc ) )
+      if ( k is None ):
+        self.wraps += 1
+      if ( unc ):
+        self.uncertain += 1
+    v    = memoryview( d )[o:]
+    s    = ulpiSegment( v, dl, r )
+    sel  = np.ones( len( s ), dtype = bool )
+    if ( not k is None and len( s ) > 0 and not s.dir[0] ):
+      # logging may resume in the middle of a TX packet; a valid TX
+      # command is 0x4X (PID), 0x8X/0xCX (register access)
+      c      = v[ int( s.off[0] ) ]
+      sel[0] = ( ( c & 0xf0 ) == 0x40 ) or ( ( c & 0x80 ) != 0 )
+    if ( not self._flt is None ):
+      sel &= self._flt.mask( ulpiPktTable( v, s, rsz = r ) )
+    rv.extend( [ ( v[b : b + r*l : r], bool(x) ) for b, l, x in zip( s.off[sel].tolist(), s.len[sel].tolist(), s.dir[sel].tolist() ) ] )
+    if ( self._tms ):
+      self.t0 = [ None ] * ( len( rv ) - np.count_nonzero( sel ) )
+      dt      = np.frombuffer( d, dtype = '<u2' )[1::2].astype( np.int64 )
+      if ( len( dt ) > 0 ):
+        if ( k is None ):
+          # the first delta refers to a record we don't have
+          dt[0] = 0
+          t     = np.cumsum( dt ) + self._t
+        else:
+          # the record preceding the new ones is the last one of the
+          # previous dump
+          t     = np.cumsum( dt )
+          t    += self._t - t[ o // r - 1 ]
+        self.t0.extend( t[ ( s.off[sel].astype( np.int64 ) + o ) // r ].tolist() )
+        self._t = int( t[-1] )
+    self._prev  = d
+    self.dumps += 1
+    return rv
+
+  # iterate over all packets (and gaps) of a sequence of dumps; 'src' is
+  # either a file-like object holding concatenated dumps of 'dumpSize'
+  # bytes or an iterable producing dumps.
+  def parse(self, src, dumpSize = None):
+    if ( hasattr( src, "read" ) ):
+      dumps = iter( lambda: src.read( dumpSize ), b'' )
+    else:
+      dumps = src
+    for d in dumps:
+      for p in self.feed( d ):
+        yield p
+
+  # like parse() but yields ( item, time ) tuples (requires 'times')
+  def parseTimed(self, src, dumpSize = None):
+    if ( hasattr( src, "read" ) ):
+      dumps = iter( lambda: src.read( dumpSize ), b'' )
+    else:
+      dumps = src
+    for d in dumps:
+      pkts = self.feed( d )
+      for p, t in zip( pkts, self.t0 ):
+        yield p, t
+
+if __name__ == "__main__":
+  # the command line tool (see UlpiLogCli) uses this module by its
+  # proper name
+  import UlpiLogCli
+  UlpiLogCli.main()
@@ -0,0 +1,175 @@
+# Module to convert ulpi log captures into testbench stimulus
+
+# Copyright Till Straumann, 2023. Licensed under the EUPL-1.2 or later.
+# You may obtain a copy of the license at
+#   https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# This notice must not be removed.
+
+# A capture (recorded on the device side) is converted into a stimulus/
+# expected-response file which drives the host side of the ulpi interface
+# in simulation (see ulpiTstReplay in test/Usb2TstPkg.vhd): the packets
+# received by the PHY (tokens, host data and handshakes) are replayed and
+# the packets sent by the device are compared against the capture.
+#
+# File format (text, one record per line; numbers are decimal so the file
+# can be read with std.textio):
+#
+#   # ...                     comment
+#   W <cycles>                idle cycles before sending the next packet
+#   R <n> <b0> ... <bn-1>     host packet to send: PID and data (incl. CRC)
+#                             as received by the PHY
+#   T <n> <b0> ... <bn-1>     expected device packet: TX command byte and
+#                             data (incl. CRC)
+#   P <n> <b0>                expected device packet; only the TX command
+#                             byte and the length are checked
+#
+# Register accesses are not replayed (the line state is not part of the
+# capture). Idle periods are only known for time-stamped captures; they
+# are approximate (the testbench procedures add a few cycles of their
+# own around every packet) and are clamped to 'maxGap'.
+#
+# The conversion is streaming, i.e., captures of arbitrary length can be
+# converted:
+#
+#   with io.open( "stim.txt", "w" ) as f:
+#     w = UlpiReplayWriter( f, addr = 66 )
+#     for pkt, t in UlpiStreamParser( recSize = ULPI_REC_SIZE_TS, times = True ).parseTimed( src ):
+#       w.feed( pkt, t )
+
+import sys
+import io
+
+from UlpiLogParser    import ( UlpiStreamParser, UlpiGap, UlpiCaptureReader, ulpiOpenCapture,
+  ULPI_REC_SIZE, ULPI_REC_SIZE_TS, KIND_PKT, KIND_REGR, PID_OUT, PID_IN, PID_SETUP, PID_PING )
+from UlpiTransactions import pktKind
+from UsbCrc           import crc5
+
+# default max. idle period (cycles; a bit more than a microframe)
+REPLAY_MAX_GAP  = 8000
+
+# cycles spent by the testbench procedures around every packet (turn-
+# around, RX CMDs)
+REPLAY_OVERHEAD = 6
+
+class UlpiReplayWriter(object):
+
+  # 'addr'    : rewrite the device address of all tokens (e.g., to match
+  #             the address assigned by the testbench; None: keep)
+  # 'pidOnly' : only check the PID and length of device data packets
+  # 'maxGap'  : max. idle period (cycles)
+  def __init__(self, f, addr = None, pidOnly = False, maxGap = REPLAY_MAX_GAP):
+    self._f       = f
+    self._addr    = addr
+    self._pidOnly = pidOnly
+    self._maxGap  = maxGap
+    self._regr    = False
+    # end time of the previous packet
+    self._tEnd    = None
+    self.sent     = 0
+    self.expected = 0
+    self.skipped  = 0
+
+  def _tok(self, data):
+    v = ( data[1] | ( data[2] << 8 ) ) & 0x780
+    v = v | self._addr
+    v = v | ( crc5( v ) << 11 )
+    return bytes( ( data[0], v & 0xff, v >> 8 ) )
+
+  # convert one packet; 't' is its time (cycles; None if unknown)
+  def feed(self, pkt, t = None):
+    if ( isinstance( pkt, UlpiGap ) ):
+      self._f.write( "# gap: {}\n".format( pkt ) )
+      self._regr = False
+      self._tEnd = None
+      return
+    data, isRx = pkt
+    if ( len( data ) == 0 ):
+      return
+    if ( isRx and self._regr ):
+      # register read reply
+      self._regr     = False
+      self.skipped  += 1
+      return
+    kind, pid  = pktKind( data, isRx )
+    self._regr = ( kind == KIND_REGR )
+    if ( kind != KIND_PKT ):
+      self.skipped += 1
+      return
+    f = self._f
+    if ( isRx ):
+      if ( not t is None and not self._tEnd is None ):
+        w = min( t - self._tEnd - REPLAY_OVERHEAD, self._maxGap )
+        if ( w > 0 ):
+          f.write( "W {:d}\n".format( w ) )
+      if ( not self._addr is None and len( data ) == 3 and pid in ( PID_OUT, PID_IN, PID_SETUP, PID_PING ) ):
+        data = self._tok( data )
+      f.write( "R {:d} {}\n".format( len( data ), " ".join( map( str, data ) ) ) )
+      self.sent     += 1
+    else:
+      if ( self._pidOnly and len( data ) > 1 ):
+        f.write( "P {:d} {:d}\n".format( len( data ), data[0] ) )
+      else:
+        f.write( "T {:d} {}\n".format( len( data ), " ".join( map( str, data ) ) ) )
+      self.expected += 1
+    if ( not t is None ):
+      self._tEnd = t + len( data )
+
+  # convert a stream of packets or ( packet, time ) tuples
+  def run(self, pkts, timed = False):
+    if ( timed ):
+      for p, t in pkts:
+        self.feed( p, t )
+    else:
+      for p in pkts:
+        self.feed( p )
+    return self
+
+if __name__ == "__main__":
+  import getopt
+
+  recSize = ULPI_REC_SIZE
+  addr    = None
+  pidOnly = False
+  maxGap  = REPLAY_MAX_GAP
+  ofnam   = None
+
+  ( opts, args ) = getopt.getopt( sys.argv[1:], "hTpA:g:o:" )
+  for opt in opts:
+    if   opt[0] in ("-h"):
+      print("usage: {} [-hTp] [-A addr] [-g max_gap] [-o output_file] <capture_file>".format( sys.argv[0] ))
+      print("          -h               : this message")
+      print("          capture_file     : capture to convert; '-' streams from stdin")
+      print("          -T               : capture has time-stamped records (replay idle periods)")
+      print("          -A addr          : rewrite the device address of all tokens")
+      print("          -p               : check only PID and length of device data packets")
+      print("          -g max_gap       : clamp idle periods to 'max_gap' cycles (default {:d})".format( REPLAY_MAX_GAP ))
+      print("          -o output_file   : write stimulus to 'output_file' (default: stdout)")
+      sys.exit(0)
+    elif opt[0] in ("-T"):
+      recSize = ULPI_REC_SIZE_TS
+    elif opt[0] in ("-p"):
+      pidOnly = True
+    elif opt[0] in ("-A"):
+      addr    = int( opt[1], 0 )
+    elif opt[0] in ("-g"):
+      maxGap  = int( opt[1], 0 )
+    elif opt[0] in ("-o"):
+      ofnam   = opt[1]
+
+  if ( len( args ) < 1 ):
+    raise RuntimeError("Need a capture file")
+
+  src   = sys.stdin.buffer if args[0] == "-" else ulpiOpenCapture( args[0] )
+  if ( isinstance( src, UlpiCaptureReader ) ):
+    recSize = src.recSize
+  timed = ( recSize == ULPI_REC_SIZE_TS )
+  # first one may be corrupt
+  sp    = UlpiStreamParser( dropFirst = True, recSize = recSize, times = timed )
+  pkts  = sp.parseTimed( src ) if timed else sp.parse( src )
+  f     = sys.stdout if ofnam is None else io.open( ofnam, "w" )
+  f.write( "# converted from {} by {}\n".format( args[0], " ".join( sys.argv ) ) )
+  w     = UlpiReplayWriter( f, addr = addr, pidOnly = pidOnly, maxGap = maxGap ).run( pkts, timed )
+  if ( not ofnam is None ):
+    f.close()
+  print("{:d} host packets, {:d} device packets, {:d} register accesses skipped".format(
+        w.sent, w.expected, w.skipped ), file = sys.stderr)
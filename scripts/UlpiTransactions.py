@@ -0,0 +1,479 @@
+# Module to decode USB transactions and transfers from ulpi log packets
+
+# Copyright Till Straumann, 2023. Licensed under the EUPL-1.2 or later.
+# You may obtain a copy of the license at
+#   https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# This notice must not be removed.
+
+# The decoders in this module are 'push' style state machines which
+# consume packets (as produced by UlpiLogParser or UlpiStreamParser)
+# one at a time; the state kept is O(1) per endpoint so arbitrarily
+# long captures can be processed in a streaming fashion.
+#
+#   for xfer in transfers( UlpiLogParser.open( "capture.bin" ).packets() ):
+#     print( xfer )
+#
+# The delivered payload of every endpoint can be reassembled into a
+# byte stream (e.g., a file per endpoint, see reassemble()).
+#
+# Note that the log is recorded on the device side, i.e., tokens and
+# host data/handshakes are 'RX' and device data/handshakes are 'TX'.
+
+import io
+
+from UlpiLogParser import ( UlpiLogParser, UlpiGap,
+  KIND_PKT, KIND_NOOP, KIND_REGW, KIND_REGR,
+  PID_OUT, PID_ACK, PID_DATA0, PID_PING, PID_NYET, PID_IN, PID_NAK, PID_DATA1,
+  PID_SETUP, PID_STALL )
+
+# return ( kind, pid ) of a packet; register accesses are
+# identified by their ulpi TX command
+def pktKind(data, isRx):
+  b0 = data[0]
+  if ( isRx ):
+    if ( ( ( b0 >> 4 ) ^ b0 ) & 0xf != 0xf ):
+      return KIND_PKT, None
+    return KIND_PKT, b0 & 0xf
+  cmd = b0 >> 6
+  if   ( cmd == 0 ):
+    return KIND_NOOP, None
+  elif ( cmd == 1 ):
+    return KIND_PKT,  b0 & 0xf
+  elif ( cmd == 2 ):
+    return KIND_REGW, None
+  return KIND_REGR, None
+
+def isToken(pid):
+  return pid in ( PID_OUT, PID_IN, PID_SETUP, PID_PING )
+
+def isData(pid):
+  return ( pid & 3 ) == 3
+
+def isHandshake(pid):
+  return pid in ( PID_ACK, PID_NAK, PID_STALL, PID_NYET )
+
+# A USB transaction: token + (optional) data + (optional) handshake.
+#  idx  : index of the token packet in the packet stream
+#  tok  : token PID
+#  addr : device address
+#  endp : endpoint number
+#  dat  : data PID (or None)
+#  data : payload (w/o PID and CRC; or None)
+#  hsk  : handshake PID (or None; e.g., isochronous)
+#  dIdx : index of the data packet (or None)
+#  last : index of the last packet (handshake, data or token)
+class UsbTransaction(object):
+
+  __slots__ = ( "idx", "tok", "addr", "endp", "dat", "data", "hsk", "dIdx", "last" )
+
+  def __init__(self, idx, tok, addr, endp):
+    self.idx  = idx
+    self.tok  = tok
+    self.addr = addr
+    self.endp = endp
+    self.dat  = None
+    self.data = None
+    self.hsk  = None
+    self.dIdx = None
+    self.last = idx
+
+  @property
+  def isIn(self):
+    return self.tok == PID_IN
+
+  # payload length (0 if there was no data packet)
+  @property
+  def nbytes(self):
+    return 0 if self.data is None else len( self.data )
+
+  # whether the payload was delivered (isochronous data is
+  # never acknowledged)
+  @property
+  def delivered(self):
+    return ( not self.dat is None ) and ( self.hsk in ( PID_ACK, PID_NYET, None ) )
+
+  def __str__(self):
+    pt = UlpiLogParser.pidTbl
+    s  = "#{:d} {:5s} {:3d}/{:2d}".format( self.idx, pt[self.tok], self.addr, self.endp )
+    if ( not self.dat is None ):
+      s += " {:5s} ({:d})".format( pt[self.dat], self.nbytes )
+    if ( not self.hsk is None ):
+      s += " {:5s}".format( pt[self.hsk] )
+    return s
+
+# Group packets into transactions. Feed packets one at a time;
+# completed transactions are returned. A transaction is complete when
+# its handshake is seen or when the next token starts a new one
+# (isochronous transactions have no handshake). A gap in the recording
+# (UlpiGap) completes the pending transaction.
+class UsbTransactionDecoder(object):
+
+  def __init__(self):
+    self._n    = 0
+    self._cur  = None
+    self._regr = False
+    # RX packets with bad PID check bits
+    self.pidErrors = 0
+    # data/handshake packets not belonging to any transaction
+    self.orphans   = 0
+
+  def feed(self, pkt):
+    if ( isinstance( pkt, UlpiGap ) ):
+      self._regr = False
+      return self.flush()
+    data, isRx = pkt
+    idx        = self._n
+    self._n   += 1
+    rv         = []
+    if ( len( data ) == 0 ):
+      return rv
+    if ( isRx and self._regr ):
+      # register read reply
+      self._regr = False
+      return rv
+    kind, pid  = pktKind( data, isRx )
+    self._regr = ( kind == KIND_REGR )
+    if ( kind != KIND_PKT ):
+      return rv
+    if ( pid is None ):
+      self.pidErrors += 1
+      return rv
+    cur = self._cur
+    if   ( isToken( pid ) ):
+      if ( not cur is None ):
+        rv.append( cur )
+      self._cur = None
+      if ( len( data ) >= 3 ):
+        addr      = data[1] & 0x7f
+        endp      = ( ( data[2] & 0x07 ) << 1 ) | ( data[1] >> 7 )
+        self._cur = UsbTransaction( idx, pid, addr, endp )
+    elif ( isData( pid ) ):
+      if ( cur is None or not cur.dat is None or cur.tok == PID_PING ):
+        self.orphans += 1
+      else:
+        cur.dat  = pid
+        cur.data = data[1:-2]
+        cur.dIdx = idx
+        cur.last = idx
+    elif ( isHandshake( pid ) ):
+      if ( cur is None ):
+        self.orphans += 1
+      else:
+        cur.hsk   = pid
+        cur.last  = idx
+        self._cur = None
+        rv.append( cur )
+    # SOF, SPLIT, PRE are ignored
+    return rv
+
+  # return the pending transaction (if any); call at the end of the stream
+  def flush(self):
+    rv        = [] if self._cur is None else [ self._cur ]
+    self._cur = None
+    return rv
+
+# Transfer types
+XFER_CTL = "CTL"
+XFER_BLK = "BLK" # bulk or interrupt (indistinguishable on the wire)
+XFER_ISO = "ISO"
+
+# Transfer status
+XFER_OK    = "OK"
+XFER_STALL = "STALL"
+XFER_ABORT = "ABORT"
+
+# A USB transfer
+#  typ    : XFER_CTL, XFER_BLK, XFER_ISO
+#  addr   : device address
+#  endp   : endpoint number
+#  isIn   : direction (of the data stage for control transfers)
+#  setup  : SETUP data (control transfers only)
+#  first  : packet index of the first transaction
+#  last   : packet index of the last transaction
+#  nbytes : payload bytes delivered
+#  ntrans : number of transactions
+#  naks   : number of NAKed transactions
+#  nyets  : number of NYET handshakes
+#  pings  : number of PING transactions
+#  status : XFER_OK, XFER_STALL, XFER_ABORT
+class UsbTransfer(object):
+
+  __slots__ = ( "typ", "addr", "endp", "isIn", "setup", "first", "last",
+                "nbytes", "ntrans", "naks", "nyets", "pings", "status" )
+
+  def __init__(self, typ, tr):
+    self.typ    = typ
+    self.addr   = tr.addr
+    self.endp   = tr.endp
+    self.isIn   = tr.isIn
+    self.setup  = None
+    self.first  = tr.idx
+    self.last   = tr.idx
+    self.nbytes = 0
+    self.ntrans = 0
+    self.naks   = 0
+    self.nyets  = 0
+    self.pings  = 0
+    self.status = XFER_OK
+
+  def add(self, tr):
+    self.last    = tr.idx
+    self.ntrans += 1
+    if ( tr.tok == PID_PING ):
+      self.pings += 1
+    if   ( tr.hsk == PID_NAK  ):
+      self.naks  += 1
+    elif ( tr.hsk == PID_NYET ):
+      self.nyets += 1
+    elif ( tr.hsk == PID_STALL ):
+      self.status = XFER_STALL
+
+  def __str__(self):
+    return "#{:d}-#{:d} {:3s} {:3d}/{:2d} {:3s} {:6d} bytes, {:4d} trans, {:4d} NAK, {:4d} NYET, {:4d} PING {}".format(
+      self.first, self.last, self.typ, self.addr, self.endp, "IN" if self.isIn else "OUT",
+      self.nbytes, self.ntrans, self.naks, self.nyets, self.pings, self.status )
+
+# Group transactions into transfers. A bulk/interrupt transfer is
+# terminated by a short (less than max. packet size) or zero-length
+# packet, a control transfer by its status stage; every isochronous
+# transaction is a transfer of its own.
+# 'mps' maps ( addr, endp ) to the max. packet size; endpoints not
+# listed use 'dfltMps'.
+class UsbTransferDecoder(object):
+
+  def __init__(self, mps = None, dfltMps = 512):
+    self._mps    = dict() if mps is None else mps
+    self._dflt   = dfltMps
+    # open control transfers, keyed by (addr, endp)
+    self._ctl    = dict()
+    # open bulk transfers, keyed by (addr, endp, isIn)
+    self._blk    = dict()
+    # endpoints which have seen handshakes (i.e., are not isochronous)
+    self._hsk    = set()
+
+  def maxPktSize(self, addr, endp):
+    return self._mps.get( ( addr, endp ), self._dflt )
+
+  def feed(self, tr):
+    rv  = []
+    key = ( tr.addr, tr.endp )
+    ctl = self._ctl.get( key )
+    if ( tr.tok == PID_SETUP ):
+      if ( not ctl is None ):
+        ctl.status = XFER_ABORT
+        rv.append( ctl )
+      ctl = UsbTransfer( XFER_CTL, tr )
+      ctl.add( tr )
+      if ( tr.hsk == PID_ACK and tr.nbytes == 8 ):
+        ctl.setup      = bytes( tr.data )
+        ctl.isIn       = ( ctl.setup[0] & 0x80 ) != 0
+        self._ctl[key] = ctl
+      else:
+        self._ctl.pop( key, None )
+        ctl.status = XFER_ABORT
+        rv.append( ctl )
+      return rv
+    if ( not ctl is None ):
+      ctl.add( tr )
+      if ( ctl.status == XFER_STALL ):
+        del self._ctl[key]
+        rv.append( ctl )
+      elif ( tr.delivered and not tr.hsk is None ):
+        wlen = ctl.setup[6] | ( ctl.setup[7] << 8 )
+        if ( wlen > 0 and tr.isIn == ctl.isIn ):
+          # data stage
+          ctl.nbytes += tr.nbytes
+        else:
+          # status stage
+          del self._ctl[key]
+          rv.append( ctl )
+      return rv
+    key = ( tr.addr, tr.endp, tr.isIn )
+    if ( not tr.hsk is None ):
+      self._hsk.add( key )
+    elif ( not tr.dat is None and not key in self._hsk ):
+      # isochronous
+      iso        = UsbTransfer( XFER_ISO, tr )
+      iso.add( tr )
+      iso.nbytes = tr.nbytes
+      rv.append( iso )
+      return rv
+    blk = self._blk.get( key )
+    if ( blk is None ):
+      blk = UsbTransfer( XFER_BLK, tr )
+      self._blk[key] = blk
+    blk.add( tr )
+    if ( blk.status == XFER_STALL ):
+      del self._blk[key]
+      rv.append( blk )
+    elif ( tr.delivered and not tr.hsk is None ):
+      blk.nbytes += tr.nbytes
+      if ( tr.nbytes < self.maxPktSize( tr.addr, tr.endp ) ):
+        del self._blk[key]
+        rv.append( blk )
+    return rv
+
+  # return all pending (incomplete) transfers; call at the end of the stream
+  def flush(self):
+    rv = list( self._ctl.values() ) + list( self._blk.values() )
+    for x in rv:
+      x.status = XFER_ABORT
+    self._ctl = dict()
+    self._blk = dict()
+    rv.sort( key = lambda x: x.first )
+    return rv
+
+# iterate over all transactions of a packet stream
+def transactions(pkts):
+  dec = UsbTransactionDecoder()
+  for p in pkts:
+    for tr in dec.feed( p ):
+      yield tr
+  for tr in dec.flush():
+    yield tr
+
+# iterate over all transfers of a packet stream
+def transfers(pkts, mps = None, dfltMps = 512):
+  dec = UsbTransferDecoder( mps, dfltMps )
+  for tr in transactions( pkts ):
+    for x in dec.feed( tr ):
+      yield x
+  for x in dec.flush():
+    yield x
+
+# Per-endpoint payload stream (see UsbPayloadReassembler):
+#  addr, endp, isIn
+#  nbytes  : payload bytes delivered
+#  pkts    : data packets delivered
+#  dups    : retransmitted duplicates dropped (toggle unchanged)
+#  dropped : data packets not delivered (NAK, STALL, no handshake)
+#  gaps    : recording gaps (the stream may be incomplete)
+class UsbPayloadStream(object):
+
+  __slots__ = ( "addr", "endp", "isIn", "nbytes", "pkts", "dups", "dropped", "gaps", "_tgl", "_hsk" )
+
+  def __init__(self, addr, endp, isIn):
+    self.addr    = addr
+    self.endp    = endp
+    self.isIn    = isIn
+    self.nbytes  = 0
+    self.pkts    = 0
+    self.dups    = 0
+    self.dropped = 0
+    self.gaps    = 0
+    # expected data PID (None: unknown)
+    self._tgl    = None
+    # handshakes seen (i.e., not isochronous)
+    self._hsk    = False
+
+  def __str__(self):
+    return "{:3d}/{:2d} {:3s} {:10d} bytes, {:7d} pkts, {:5d} dups, {:5d} dropped, {:3d} gaps".format(
+      self.addr, self.endp, "IN" if self.isIn else "OUT", self.nbytes, self.pkts, self.dups, self.dropped, self.gaps )
+
+# Reassemble the application byte streams of all endpoints from a
+# sequence of transactions. A data packet is delivered if it was
+# acknowledged (ACK or NYET; isochronous data are always delivered);
+# a retransmission (the host missed the ACK) still carries the previous
+# toggle (DATA0/DATA1) and is dropped. Endpoints which have never seen a
+# handshake are considered isochronous. A SETUP resets the toggles of the
+# control endpoint (SETUP payloads are not part of the streams).
+#
+# The payload of every delivered packet is passed to
+#
+#   sink( stream, data )
+#
+# where 'stream' is the UsbPayloadStream and 'data' a view of the capture
+# (not copied; valid only during the call). The state kept is O(1) per
+# endpoint.
+class UsbPayloadReassembler(object):
+
+  def __init__(self, sink):
+    self._sink   = sink
+    # UsbPayloadStream objects keyed by ( addr, endp, isIn )
+    self.streams = dict()
+
+  def stream(self, addr, endp, isIn):
+    key = ( addr, endp, isIn )
+    s   = self.streams.get( key )
+    if ( s is None ):
+      s = UsbPayloadStream( addr, endp, isIn )
+      self.streams[key] = s
+    return s
+
+  def feed(self, tr):
+    if ( tr.tok == PID_SETUP ):
+      if ( tr.hsk == PID_ACK ):
+        for isIn in ( True, False ):
+          self.stream( tr.addr, tr.endp, isIn )._tgl = PID_DATA1
+      return
+    if ( tr.dat is None or tr.tok == PID_PING ):
+      return
+    s = self.stream( tr.addr, tr.endp, tr.isIn )
+    if ( not tr.hsk is None ):
+      s._hsk = True
+    if ( not tr.delivered or ( tr.hsk is None and s._hsk ) ):
+      s.dropped += 1
+      return
+    if ( not tr.hsk is None ):
+      if ( tr.dat == s._tgl or s._tgl is None ):
+        s._tgl = PID_DATA0 if tr.dat == PID_DATA1 else PID_DATA1
+      elif ( tr.dat in ( PID_DATA0, PID_DATA1 ) ):
+        s.dups += 1
+        return
+    s.pkts   += 1
+    s.nbytes += tr.nbytes
+    self._sink( s, tr.data )
+
+  # a recording gap; the toggle state is lost
+  def gap(self):
+    for s in self.streams.values():
+      s._tgl  = None
+      s.gaps += 1
+
+# Sink writing every stream to a file of its own:
+#   <prefix><addr>-<endp>-<in|out>.bin
+class UsbPayloadFiles(object):
+
+  def __init__(self, prefix):
+    self._prefix = prefix
+    self._files  = dict()
+    # file names keyed by ( addr, endp, isIn )
+    self.names   = dict()
+
+  def __call__(self, s, data):
+    key = ( s.addr, s.endp, s.isIn )
+    f   = self._files.get( key )
+    if ( f is None ):
+      nam = "{}{:d}-{:d}-{}.bin".format( self._prefix, s.addr, s.endp, "in" if s.isIn else "out" )
+      f   = io.open( nam, "wb" )
+      self._files[key] = f
+      self.names[key]  = nam
+    # views of the ulpi records are strided
+    m = memoryview( data )
+    f.write( m if m.contiguous else m.tobytes() )
+
+  def close(self):
+    for f in self._files.values():
+      f.close()
+    self._files = dict()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_val, exc_tb):
+    self.close()
+    return False
+
+# Reassemble the payload streams of a packet stream (which may contain
+# UlpiGap markers) into 'sink'; returns the UsbPayloadReassembler.
+def reassemble(pkts, sink):
+  dec = UsbTransactionDecoder()
+  ras = UsbPayloadReassembler( sink )
+  for p in pkts:
+    for tr in dec.feed( p ):
+      ras.feed( tr )
+    if ( isinstance( p, UlpiGap ) ):
+      ras.gap()
+  for tr in dec.flush():
+    ras.feed( tr )
+  return ras
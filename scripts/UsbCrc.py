@@ -0,0 +1,126 @@
+# Module to compute/verify USB CRC5 and CRC16
+
+# Copyright Till Straumann, 2023. Licensed under the EUPL-1.2 or later.
+# You may obtain a copy of the license at
+#   https://joinup.ec.europa.eu/collection/eupl/eupl-text-eupl-12
+# This notice must not be removed.
+
+# The CRCs are computed byte-wise with a lookup table exactly like the
+# firmware does it (UsbCrcTbl.vhd, Usb2PktRx.vhd):
+#
+#   crc = tbl[ (crc ^ byte) & 0xff ] ^ (crc >> 8)
+#
+# A packet (including its CRC) is good if the residual matches the
+# respective CHCK constant (see Usb2Pkg.vhd).
+#
+# 'crcCheck' verifies all tokens and data packets of a packet table
+# (see UlpiLogParser.table()) at once; the computation is vectorized
+# across packets.
+
+import numpy as np
+
+from UlpiLogParser import ( KIND_PKT, ULPI_REC_SIZE,
+  PID_OUT, PID_PING, PID_SOF, PID_IN, PID_SETUP )
+
+CRC5_POLY  = 0x0014
+CRC5_CHCK  = 0x0006
+CRC5_INIT  = 0x001F
+
+CRC16_POLY = 0xA001
+CRC16_CHCK = 0xB001
+CRC16_INIT = 0xFFFF
+
+# same as UsbCrcTbl.vhd
+def crcTbl(poly):
+  rv = np.zeros( 256, dtype = np.uint16 )
+  for x in range( 256 ):
+    v = x
+    for i in range( 8 ):
+      s = v & 1
+      v >>= 1
+      if ( s ):
+        v ^= poly
+    rv[x] = v
+  return rv
+
+CRC5_TBL  = crcTbl( CRC5_POLY  )
+CRC16_TBL = crcTbl( CRC16_POLY )
+
+def crcUpdate(tbl, crc, data):
+  for b in data:
+    crc = int( tbl[ ( crc ^ b ) & 0xff ] ) ^ ( crc >> 8 )
+  return crc
+
+# CRC16 to be appended (little-endian) to 'data'
+def crc16(data):
+  return crcUpdate( CRC16_TBL, CRC16_INIT, data ) ^ 0xffff
+
+# CRC5 to be merged into bits 15..11 of the 11-bit token data
+def crc5(tokDat):
+  c = crcUpdate( CRC5_TBL, CRC5_INIT, [ tokDat & 0xff ] )
+  for i in range( 3 ):
+    s = ( c ^ ( tokDat >> ( 8 + i ) ) ) & 1
+    c >>= 1
+    if ( s ):
+      c ^= CRC5_POLY
+  return c ^ 0x1f
+
+# check data packet payload + CRC16 (w/o PID)
+def crc16Ok(data):
+  return crcUpdate( CRC16_TBL, CRC16_INIT, data ) == CRC16_CHCK
+
+# check the two token bytes (w/o PID)
+def crc5Ok(data):
+  return crcUpdate( CRC5_TBL, CRC5_INIT, data ) == CRC5_CHCK
+
+# Batch-compute the residual of many byte sequences in parallel.
+# The sequence #i is located at a[ off[i] + stride * j ], j = 0..len[i]-1.
+def crcResidual(tbl, init, a, off, ln, stride = 2):
+  n   = len( off )
+  if ( n == 0 ):
+    return np.zeros( 0, dtype = np.uint32 )
+  # process the longest sequences first so that the active ones
+  # always form a prefix
+  o   = np.argsort( - ln, kind = "stable" )
+  off = off[o].astype( np.int64 )
+  ln  = ln[o].astype( np.int64 )
+  c   = np.full( n, init, dtype = np.uint32 )
+  t   = tbl.astype( np.uint32 )
+  act = n
+  for j in range( int( ln[0] ) ):
+    while ( ln[act - 1] <= j ):
+      act -= 1
+    x        = c[:act]
+    b        = a[ off[:act] + stride * j ]
+    c[:act]  = t[ ( x ^ b ) & 0xff ] ^ ( x >> 8 )
+  # back to the original order (every element is overwritten)
+  crc    = np.empty_like( c )
+  crc[o] = c
+  return crc
+
+# Verify the CRC of all tokens and data packets in a packet table.
+# Returns two boolean arrays ( checked, ok ); packets which carry
+# no CRC (handshakes, register accesses) are not 'checked' and are 'ok'.
+# 'rsz' is the record size of the capture.
+def crcCheck(buf, tbl, rsz = ULPI_REC_SIZE):
+  a   = np.frombuffer( buf, dtype = np.uint8 )
+  pkt = ( tbl['kind'] == KIND_PKT )
+  pid = tbl['pid']
+  ln  = tbl['len'].astype( np.int64 )
+  # skip the PID byte
+  off = tbl['off'].astype( np.int64 ) + rsz
+  tok = pkt & tbl['dir'] & ( ln == 3 ) & np.isin( pid, [ PID_OUT, PID_IN, PID_SETUP, PID_PING, PID_SOF ] )
+  dat = pkt & ( ( pid & 3 ) == 3 ) & ( ln >= 3 )
+  ok  = np.ones( len( tbl ), dtype = bool )
+  r5  = crcResidual( CRC5_TBL,  CRC5_INIT,  a, off[tok], ln[tok] - 1, rsz )
+  r16 = crcResidual( CRC16_TBL, CRC16_INIT, a, off[dat], ln[dat] - 1, rsz )
+  ok[tok] = ( r5  == CRC5_CHCK  )
+  ok[dat] = ( r16 == CRC16_CHCK )
+  return ( tok | dat ), ok
+
+# Return the packet indices and byte offsets (in the capture) of
+# all packets with a bad CRC
+def crcErrors(buf, tbl, rsz = ULPI_REC_SIZE):
+  chk, ok = crcCheck( buf, tbl, rsz )
+  idx     = np.flatnonzero( ~ ok )
+  return idx, tbl['off'][idx]
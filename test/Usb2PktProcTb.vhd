@@ -155,6 +155,11 @@ use     work.Usb2AppCfgPkg.all;
 use     work.Usb2DescPkg.all;
 
 entity Usb2PktProcTb is
+   generic (
+      -- replay a stimulus file (converted from a capture by
+      -- scripts/UlpiReplay.py) instead of running the tests
+      REPLAY_FILE_G : string := ""
+   );
 end entity Usb2PktProcTb;
 
 architecture sim of Usb2PktProcTb is
@@ -179,6 +184,7 @@ architecture sim of Usb2PktProcTb is
 
    signal framedInp                : std_logic := '1';
    signal haltInp                  : std_logic := '0';
+   signal replaying                : boolean   := false;
 
    constant d1 : Usb2ByteArray := ( x"01", x"02", x"03" );
    constant d2 : Usb2ByteArray := (
@@ -208,6 +214,7 @@ begin
       variable pid            : std_logic_vector(3 downto 0);
       variable reqval         : std_logic_vector(15 downto 0);
       variable reqidx         : std_logic_vector(15 downto 0);
+      variable mism           : natural;
 
       constant stridx         : natural                := usb2NthStringDescriptor(USB2_APP_DESCRIPTORS_C, 0);
       constant devdsc         : Usb2ByteArray(0 to 17) := USB2_APP_DESCRIPTORS_C(0  to 17);
@@ -240,6 +247,17 @@ report "SET_INTERFACE";
       -- propagate configuration to the test package
       usb2TstPkgConfig( epOb );
 
+      if ( REPLAY_FILE_G'length > 0 ) then
+         -- the device is addressed and configured; replay the capture, e.g.,
+         --   UlpiReplay.py -T -A 66 -o stim.txt capture.bin
+         --   ./usb2pktproctb -gREPLAY_FILE_G=stim.txt
+         replaying <= true;
+         report "REPLAYING " & REPLAY_FILE_G;
+         ulpiTstReplay( ulpiTstOb, REPLAY_FILE_G, mism );
+         report "REPLAY DONE: " & integer'image( mism ) & " mismatching device packets";
+         ulpiTstRun <= false;
+         wait;
+      end if;
 
 report "GET_INTERFACE";
       ulpiTstSendCtlReq(ulpiTstOb, USB2_REQ_STD_GET_INTERFACE_C, DEV_ADDR_C, idx => IFC_C, eda => (0 => x"01"));
@@ -432,7 +450,7 @@ report "GET_DESCRIPTOR(STR), nonexistent!";
                end if;
             end if;
          end if;
-         if ( epOb(TST_EP_IDX_C).mstOut.vld = '1' ) then
+         if ( epOb(TST_EP_IDX_C).mstOut.vld = '1' and not replaying ) then
             assert epOb(TST_EP_IDX_C).mstOut.dat = d2(oidx) report "OUT 0 endpoint data mismatch" severity failure;
             oidx := oidx + 1;
          elsif ( epOb(TST_EP_IDX_C).mstOut.don = '1' ) then
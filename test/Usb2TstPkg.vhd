@@ -3,6 +3,8 @@ use     ieee.std_logic_1164.all;
 use     ieee.numeric_std.all;
 use     ieee.math_real.all;
 
+use     std.textio.all;
+
 use     work.Usb2Pkg.all;
 use     work.UlpiPkg.all;
 use     work.Usb2UtilPkg.all;
@@ -246,6 +248,28 @@ package Usb2TstPkg is
       signal    ob : inout UlpiIbType
    );
 
+   -- receive any packet sent by the device: the TXCMD byte followed by
+   -- the data up to STP; 'len' returns the number of bytes (bytes beyond
+   -- the size of 'pkt' are dropped) or -1 on timeout
+   procedure ulpiTstRecvPkt(
+      signal   ob  : inout UlpiIbType;
+      variable pkt : inout Usb2ByteArray;
+      variable len : out   integer;
+      constant timo: in    natural := 30                 -- timeout waiting for TXCMD
+   );
+
+   -- replay a stimulus file (see scripts/UlpiReplay.py): host packets are
+   -- sent and device packets are received and compared. The file is read
+   -- line by line, i.e., it may hold an arbitrarily long capture. The
+   -- number of missing or mismatching device packets is returned in 'mism'.
+   procedure ulpiTstReplay(
+      signal   ob    : inout UlpiIbType;
+      constant fnam  : in    string;                      -- stimulus file
+      variable mism  : out   natural;
+      constant timo  : in    natural := 30;               -- timeout waiting for device packets
+      constant strict: in    boolean := false             -- fail at the first mismatch
+   );
+
 end package Usb2TstPkg;
 
 package body Usb2TstPkg is
@@ -1037,6 +1061,118 @@ report "status end";
 
    end procedure ulpiTstHandlePhyInit;
 
+   procedure ulpiTstRecvPkt(
+      signal   ob  : inout UlpiIbType;
+      variable pkt : inout Usb2ByteArray;
+      variable len : out   integer;
+      constant timo: in    natural := 30
+   ) is
+      variable cnt : natural := timo;
+      variable n   : natural := 0;
+   begin
+      len := -1;
+      while ulpiTstIb.dat = x"00" loop
+         if ( cnt = 0 ) then
+            return;
+         end if;
+         cnt := cnt - 1;
+         ulpiClkTick;
+      end loop;
+      ob.nxt <= '1';
+      ulpiClkTick;
+      while ( ulpiTstIb.stp = '0' ) loop
+         if ( n < pkt'length ) then
+            pkt(pkt'low + n) := ulpiTstIb.dat;
+         end if;
+         n := n + 1;
+         ulpiClkTick;
+      end loop;
+      ob.nxt <= '0';
+      ulpiClkTick;
+      ulpiTstSendRxCmd( ob, "000000" & ULPI_RXCMD_LINE_STATE_SE0_C );
+      ulpiTstSendRxCmd( ob, "000000" & ULPI_RXCMD_LINE_STATE_FS_J_C );
+      len := n;
+   end procedure ulpiTstRecvPkt;
+
+   procedure ulpiTstReplay(
+      signal   ob    : inout UlpiIbType;
+      constant fnam  : in    string;
+      variable mism  : out   natural;
+      constant timo  : in    natural := 30;
+      constant strict: in    boolean := false
+   ) is
+      -- max. HS isochronous packet + PID + CRC
+      constant MAX_PKT_C : natural := 1027;
+      -- max. number of mismatches reported
+      constant MAX_REP_C : natural := 20;
+      file     f         : text;
+      variable l         : line;
+      variable c         : character;
+      variable n         : integer;
+      variable v         : integer;
+      variable exp       : Usb2ByteArray(0 to MAX_PKT_C - 1);
+      variable got       : Usb2ByteArray(0 to MAX_PKT_C - 1);
+      variable len       : integer;
+      variable ok        : boolean;
+      variable lno       : natural := 0;
+      variable errs      : natural := 0;
+   begin
+      file_open( f, fnam, read_mode );
+      while not endfile( f ) loop
+         readline( f, l );
+         lno := lno + 1;
+         if ( l'length > 0 ) then
+            read( l, c );
+            case c is
+               when 'W' =>
+                  read( l, n );
+                  for i in 1 to n loop
+                     ulpiClkTick;
+                  end loop;
+
+               when 'R' | 'T' | 'P' =>
+                  read( l, n );
+                  assert n <= MAX_PKT_C report "ulpiTstReplay: packet too long, line " & integer'image( lno ) severity failure;
+                  for i in 0 to n - 1 loop
+                     exit when ( c = 'P' and i > 0 );
+                     read( l, v );
+                     exp(i) := std_logic_vector( to_unsigned( v, 8 ) );
+                  end loop;
+                  if ( c = 'R' ) then
+                     ulpiTstSendVec( ob, exp(0 to n - 1) );
+                  else
+                     ulpiTstRecvPkt( ob, got, len, timo );
+                     ok := ( len = n );
+                     if ( ok ) then
+                        if ( c = 'T' ) then
+                           ok := ( got(0 to n - 1) = exp(0 to n - 1) );
+                        else
+                           ok := ( got(0) = exp(0) );
+                        end if;
+                     end if;
+                     if ( not ok ) then
+                        errs := errs + 1;
+                        assert not strict
+                           report "ulpiTstReplay: device packet mismatch, line " & integer'image( lno )
+                           severity failure;
+                        if ( errs <= MAX_REP_C ) then
+                           report "ulpiTstReplay: device packet mismatch, line " & integer'image( lno )
+                                  & " (expected " & integer'image( n ) & " bytes, got " & integer'image( len ) & ")"
+                           severity warning;
+                        end if;
+                     end if;
+                  end if;
+
+               when others =>
+                  -- comment
+                  null;
+            end case;
+         end if;
+      end loop;
+      file_close( f );
+      mism := errs;
+   end procedure ulpiTstReplay;
+
 end package body Usb2TstPkg;
 
 library ieee;
@@ -9,6 +9,77 @@ import sys
 import random
 import io
 import getopt
+import struct
+import zlib
+
+# NTB codec
+#
+# NTBs (16-bit: NTH16/NDP16, 32-bit: NTH32/NDP32) are built and parsed
+# as plain bytes (bytearray/memoryview) using struct. Packet framing
+# (the LST bit of the bit-vector files, i.e., 'end of datagram') is kept
+# separately as a list of boundaries (end offsets) and only expanded by
+# the bit-vector writer.
+
+NTH16_SIG      = b'NCMH'
+NDP16_SIG      = b'NCM0'
+NDP16_SIG_CRC  = b'NCM1'
+NTH32_SIG      = b'ncmh'
+NDP32_SIG      = b'ncm0'
+NDP32_SIG_CRC  = b'ncm1'
+
+# bit-vector 'don' word (terminates an NTB in the test vectors)
+BV_DON         = 0x100
+
+_BV_FMT        = [ "{:09b}\n".format(i) for i in range(512) ]
+
+# Layout of the 16-bit or 32-bit NTB structures
+#   nth : signature, wHeaderLength, wSequence, (d)wBlockLength, (d)wNdpIndex
+#   ndp : signature, wLength, [wReserved6], (d)wNextNdpIndex, [dwReserved12]
+#   dpe : (d)wDatagramIndex, (d)wDatagramLength
+class NtbFormat(object):
+  def __init__(self, nam, wide, nthSig, ndpSig, ndpSigCrc):
+    self.nam       = nam
+    self.wide      = wide
+    self.nthSig    = nthSig
+    self.ndpSig    = ndpSig
+    self.ndpSigCrc = ndpSigCrc
+    self.nth       = struct.Struct( "<4sHHII"  if wide else "<4sHHHH" )
+    self.ndp       = struct.Struct( "<4sHHII"  if wide else "<4sHH"   )
+    self.dpe       = struct.Struct( "<II"      if wide else "<HH"     )
+    # header + terminating (zero) datagram pointer entry
+    self.ndpLenMin = self.ndp.size + self.dpe.size
+    self.maxBlock  = 0xffffffff if wide else 0xffff
+
+  def packNdpHdr(self, buf, off, addCRC, hl, nxt):
+    sig = self.ndpSigCrc if addCRC else self.ndpSig
+    if ( self.wide ):
+      self.ndp.pack_into( buf, off, sig, hl, 0, nxt, 0 )
+    else:
+      self.ndp.pack_into( buf, off, sig, hl, nxt )
+
+  # returns ( signature, wLength, (d)wNextNdpIndex )
+  def unpackNdpHdr(self, buf, off):
+    t = self.ndp.unpack_from( buf, off )
+    return t[0], t[1], t[-2] if self.wide else t[-1]
+
+NTB16_FMT      = NtbFormat( "NTB16", False, NTH16_SIG, NDP16_SIG, NDP16_SIG_CRC )
+NTB32_FMT      = NtbFormat( "NTB32", True,  NTH32_SIG, NDP32_SIG, NDP32_SIG_CRC )
+
+# return the format of the NTB at the head of 'buf'
+def ntbFormat(buf):
+  sig = bytes( buf[0:4] )
+  for fmt in ( NTB16_FMT, NTB32_FMT ):
+    if ( sig == fmt.nthSig ):
+      return fmt
+  raise RuntimeError("NTH Invalid signature")
+
+# write 'buf' as bit-vectors (one 9-bit word per line); the LST bit is
+# set on the last byte ahead of every boundary in 'bnds'
+def bitVecWrite(f, buf, bnds = ()):
+  lines = [ _BV_FMT[x] for x in bytes( buf ) ]
+  for e in bnds:
+    lines[e - 1] = _BV_FMT[ buf[e - 1] | 0x100 ]
+  f.write( "".join( lines ) )
 
 # read a bitvec file
 def bv2l(nm):
@@ -18,29 +89,145 @@ def bv2l(nm):
       rv.append( int( l, 2 ) )
   return rv
 
+# read a bitvec file; returns the bytes and the boundaries (end offsets
+# of the words with the LST bit set)
+def bv2b(nm):
+  buf  = bytearray()
+  bnds = []
+  with io.open(nm) as f:
+    for l in f:
+      x = int( l, 2 )
+      buf.append( x & 0xff )
+      if ( ( x & 0x100 ) != 0 ):
+        bnds.append( len( buf ) )
+  return buf, bnds
+
+# convert a list of (9-bit) ints or a bytes-like object to bytes
+def toBytes(l):
+  if ( isinstance( l, ( bytes, bytearray, memoryview ) ) ):
+    return l
+  return bytes( [ x & 0xff for x in l ] )
+
+def nthPack(buf, off, wSequence, wBlockLength, wNdpIndex, fmt = NTB16_FMT):
+  fmt.nth.pack_into( buf, off, fmt.nthSig, fmt.nth.size, wSequence, wBlockLength, wNdpIndex )
+
+# pack an NDP pointing to the datagrams 'dgs' (list of ( index, length ))
+def ndpPack(buf, off, dgs, addCRC = False, wNextNdpIndex = 0, fmt = NTB16_FMT):
+  hl = fmt.ndpLenMin + fmt.dpe.size*len( dgs )
+  fmt.packNdpHdr( buf, off, addCRC, hl, wNextNdpIndex )
+  o  = off + fmt.ndp.size
+  for i, l in dgs:
+    fmt.dpe.pack_into( buf, o, i, l )
+    o += fmt.dpe.size
+  fmt.dpe.pack_into( buf, o, 0, 0 )
+  return hl
+
+# Encode an NTB. 'ndps' is a list of ( addCRC, [ datagram, ... ] ).
+# The datagrams follow the NTH (or the NDPs if 'ndpFirst'); NDPs are
+# word-aligned and chained in order.
+# Returns ( buf, dgs ) with 'dgs' a list of ( index, length ) of all
+# datagrams (in NDP order).
+def ntbEncode(ndps, wSequence = 0, hasBlockLen = True, ndpFirst = False, fmt = NTB16_FMT):
+  hdrLen = fmt.nth.size
+  ndpLen = [ fmt.ndpLenMin + fmt.dpe.size*len( d ) for c, d in ndps ]
+  dgLen  = sum( [ sum( [ len( x ) for x in d ] ) for c, d in ndps ] )
+  if ( ndpFirst ):
+    ndpOff = hdrLen
+    dgOff  = hdrLen + sum( ndpLen )
+    tot    = dgOff + dgLen
+  else:
+    dgOff  = hdrLen
+    ndpOff = dgOff + dgLen
+    ndpOff = ndpOff + ( ( - ndpOff ) % 4 )
+    tot    = ndpOff + sum( ndpLen )
+  if ( tot > fmt.maxBlock ):
+    raise RuntimeError("{}: block too long ({:d} bytes)".format( fmt.nam, tot ))
+  buf    = bytearray( tot )
+  mv     = memoryview( buf )
+  rv     = []
+  o      = ndpOff
+  for n in range( len( ndps ) ):
+    ents = []
+    for x in ndps[n][1]:
+      mv[dgOff : dgOff + len( x )] = x
+      ents.append( ( dgOff, len( x ) ) )
+      dgOff += len( x )
+    nxt  = o + ndpLen[n] if n + 1 < len( ndps ) else 0
+    ndpPack( buf, o, ents, ndps[n][0], nxt, fmt )
+    rv.extend( ents )
+    o   += ndpLen[n]
+  nthPack( buf, 0, wSequence, tot if hasBlockLen else 0, ndpOff if len( ndps ) > 0 else 0, fmt )
+  return buf, rv
+
+class NdpInfo(object):
+  def __init__(self, off, addCRC, wHeaderLength, wNextNdpIndex, dgs):
+    self.off           = off
+    self.addCRC        = addCRC
+    self.wHeaderLength = wHeaderLength
+    self.wNextNdpIndex = wNextNdpIndex
+    # list of ( index, length )
+    self.dgs           = dgs
+
+# Parse the NTB (16- or 32-bit) at the head of 'buf'; returns
+# ( nth, ndps ) with 'nth' a tuple ( wSequence, wBlockLength, wNdpIndex )
+# and 'ndps' a list of NdpInfo (in chaining order).
+def ntbParse(buf):
+  mv  = memoryview( buf )
+  fmt = ntbFormat( mv )
+  sig, hl, seq, bl, b = fmt.nth.unpack_from( mv, 0 )
+  if ( hl != fmt.nth.size ):
+    raise RuntimeError("{}: invalid header length".format( fmt.nam ))
+  ndps = []
+  while ( b != 0 ):
+    sig, hl, nxt = fmt.unpackNdpHdr( mv, b )
+    if ( sig != fmt.ndpSig and sig != fmt.ndpSigCrc ):
+      raise RuntimeError("{}: NDP signature mismatch".format( fmt.nam ))
+    if ( hl < fmt.ndpLenMin or b + hl > len( mv ) ):
+      raise RuntimeError("{}: unreasonable NDP header length".format( fmt.nam ))
+    dgs = []
+    for o in range( b + fmt.ndp.size, b + hl - fmt.dpe.size + 1, fmt.dpe.size ):
+      i, l = fmt.dpe.unpack_from( mv, o )
+      if ( i == 0 ):
+        break
+      dgs.append( ( i, l ) )
+    ndps.append( NdpInfo( b, sig == fmt.ndpSigCrc, hl, nxt, dgs ) )
+    b = nxt
+  return ( seq, bl, ndps[0].off if len( ndps ) > 0 else 0 ), ndps
+
+# Write the datagrams of an NTB ( buf, [ ( index, length ), ... ] ) as
+# bit-vectors, LST marking the end of every datagram.
+def bitVecWriteDgrams(f, buf, dgs):
+  mv = memoryview( buf )
+  for i, l in dgs:
+    bitVecWrite( f, mv[i : i + l], ( l, ) )
+
+# The classes below are a facade for building NTBs (with arbitrary
+# layouts) object by object; they use the codec above.
+
 class NTB16(object):
+
+  FMT = NTB16_FMT
+
   def __init__(self, l=None):
     self.lst_  = list()
+    self.buf_  = None
     # Chain of NDPs
     self.tail_ = None
     self.lck_  = False
+    nthClz, ndpClz = ( NTH32, NDP32 ) if self.FMT.wide else ( NTH16, NDP16 )
     if l is None:
-      self.add( NTH16() )
+      self.add( nthClz() )
     else:
-      nth = NTH16(l = l)
-      b   = nth.wNdpIndex
-      e   = nth.wBlockLength
-      self.add(nth)
-      while b != 0:
-        ndp = NDP16( l = l[b:e] )
+      b         = toBytes( l )
+      if ( ntbFormat( b ) is not self.FMT ):
+        raise RuntimeError("{}: NTH Invalid signature".format( self.FMT.nam ))
+      nth, ndps = ntbParse( b )
+      self.add( nthClz( l = b[0:self.FMT.nth.size] ) )
+      for x in ndps:
+        ndp = ndpClz( l = b[x.off : x.off + x.wHeaderLength] )
         self.add( ndp )
-        idx = 0
-        b   = ndp.wDatagramIndex(idx)
-        while ( b > 0 ):
-         self.add( Dgram( ndp=ndp, l = l[b: b + ndp.wDatagramSize(idx)] ) )
-         idx += 1
-         b = ndp.wDatagramIndex(idx)
-        b = ndp.wNextNdpIndex
+        for i, n in x.dgs:
+          self.add( Dgram( ndp = ndp, l = b[i : i + n] ) )
       self.lck_ = True
 
   def getNTH(self):
@@ -57,14 +244,17 @@ class NTB16(object):
     if ( o in self.lst_ ):
       raise RuntimeError("Cannot add same object multiple times")
     if ( self.lck_ ):
-      raise RuntimeError("Cannot add to locked NTB16")
+      raise RuntimeError("Cannot add to locked {}".format( self.FMT.nam ))
     if isinstance(o, NDP16):
+      if ( o.FMT is not self.FMT ):
+        raise RuntimeError("Cannot add {} NDP to {}".format( o.FMT.nam, self.FMT.nam ))
       o.lock()
     self.lst_.append(o)
 
   def wrap(self, hasBlockLen = True):
     self.lck_ = True
-    idx = 0
+    idx  = 0
+    miss = 0
     # must word-align the first NDP16
     for i in range( len( self.lst_ ) ):
       if isinstance( self.lst_[i], NDP16 ):
@@ -74,12 +264,14 @@ class NTB16(object):
       idx += self.lst_[i].getLen()
     if ( miss != 0 ):
       print("Doing miss {:d}".format(miss))
-      self.lst_.insert( i, BitVecHolder( "PAD", [ 0 for i in range(miss)] ) )
+      self.lst_.insert( i, BitVecHolder( "PAD", bytes( miss ) ) )
     idx = 0
     # compute positions of everything
     for x in self.lst_:
       x.setIdx( idx )
       idx += x.getLen()
+    if ( idx > self.FMT.maxBlock ):
+      raise RuntimeError("{}: block too long ({:d} bytes)".format( self.FMT.nam, idx ))
     # set total length
     if ( hasBlockLen ):
       bl = idx
@@ -91,6 +283,20 @@ class NTB16(object):
     for x in self.lst_:
       x.fixup()
       nxt = x.nextNDP( nxt )
+    self.buf_ = bytearray( idx )
+    mv        = memoryview( self.buf_ )
+    for x in self.lst_:
+      mv[x.getIdx() : x.getIdx() + x.getLen()] = x.getBytes()
+
+  # the wrapped NTB
+  def getBytes(self):
+    if ( not self.lck_ or self.buf_ is None ):
+      raise RuntimeError("NTB not wrapped")
+    return self.buf_
+
+  # ( index, length ) of all datagrams
+  def getDgramIdx(self):
+    return [ ( x.getIdx(), x.getLen() ) for x in self.getDgrams() ]
 
   def dump(self):
     if ( not self.lck_ ):
@@ -99,22 +305,26 @@ class NTB16(object):
       l.dump()
 
   def bitVec(self, f=sys.stdout):
-    for x in self.lst_:
-      x.bitVec( f=f, m=0xff)
+    bitVecWrite( f, self.getBytes() )
     # this is a 'don' (not LST) flag
-    print("100000000", file=f)
+    f.write( _BV_FMT[BV_DON] )
 
   def bitVecDgram(self, f=sys.stdout, stripCRC = True):
     for x in self.lst_:
       if isinstance(x, Dgram):
         x.bitVec( f = f, stripCRC = stripCRC )
 
+# NTB with 32-bit structures (NTH32, NDP32)
+class NTB32(NTB16):
+
+  FMT = NTB32_FMT
+
+# List of 9-bit words (data + LST flag on the last one); kept for
+# users of the bit-vector representation.
 class BitVec(list):
 
   def __init__(self, l):
-    super().__init__()
-    for x in l:
-       self.append( x & 0xff )
+    super().__init__( [ x & 0xff for x in l ] )
     self.setLst()
 
   def setLst(self):
@@ -146,8 +356,7 @@ class BitVec(list):
 
   def extend(self, x):
     self.clrLst()
-    for y in x:
-      self.append( y & 0xff )
+    super().extend( [ y & 0xff for y in x ] )
     self.setLst()
 
   def getLen(self):
@@ -155,12 +364,15 @@ class BitVec(list):
 
 class BitVecHolder(object):
   def __init__(self, nam, l):
-    self.bv_  = BitVec( l )
+    self.b_   = bytearray( toBytes( l ) )
     self.nam_ = nam
     self.idx_ = 0
 
   def getLen(self):
-    return self.bv_.getLen()
+    return len( self.b_ )
+
+  def getBytes(self):
+    return self.b_
 
   def getIdx(self):
     return self.idx_
@@ -181,7 +393,7 @@ class BitVecHolder(object):
     pass
 
   def bitVec(self, f=sys.stdout, m=0x1ff, stripCRC=False):
-    self.bv_.bitVec( f = f, m = m, stripCRC = stripCRC )
+    bitVecWrite( f, self.b_, ( len( self.b_ ), ) if ( m & 0x100 ) != 0 else () )
 
 class Dgram(BitVecHolder):
   def __init__(self, ndp, l):
@@ -190,85 +402,93 @@ class Dgram(BitVecHolder):
     ndp.add( self )
 
   def extend(self, l):
-    self.bv_.extend( l )
+    self.b_ += toBytes( l )
 
   def dump(self):
     super().dump()
     print("  Raw Data     : ", end='')
-    for x in self.bv_:
-      print("{:02x} ".format( x & 0xff ), end ='')
-      if ( self.bv_.isLst( x ) ):
-        print(" (LST) ", end ='')
+    for x in self.b_:
+      print("{:02x} ".format( x ), end ='')
+    print(" (LST) ", end ='')
     print()
 
   def bitVec(self, f = sys.stdout, m = 0x1ff, stripCRC=False):
     super().bitVec( f = f, m = m, stripCRC = stripCRC )
 
   def getContent(self):
-    return self.bv_
+    return BitVec( self.b_ )
 
 class NTH16(BitVecHolder):
+
+  FMT = NTB16_FMT
+
   seq = 1
   def __init__(self, l=None):
-    sig = [0x4E, 0x43, 0x4D, 0x48]
+    fmt = self.FMT
+    nam = "NTH32" if fmt.wide else "NTH16"
     if l is None:
-      l = list()
-      l.extend( [0x4E, 0x43, 0x4D, 0x48] )
-      l.extend( [ 0,0] ) # Header Length
-      l.extend( [ 0,0] ) # seq
-      l.extend( [ 0,0] ) # block length
-      l.extend( [ 0,0] ) # sdpOff
-      super().__init__( "NTH16", l )
-      self.wHeaderLength = 12
-      self.wSequence     = self.seq
-      self.seq          += 1
+      super().__init__( nam, bytes( fmt.nth.size ) )
+      nthPack( self.b_, 0, self.seq, 0, 0, fmt )
+      self.seq += 1
     else:
-      for i in range( len( sig ) ):
-        if l[i] != sig[i]:
-           raise RuntimeError("NTH16 Invalid signature")
-      super().__init__("NTH16", l)
-      if self.wHeaderLength != 12:
-         raise RuntimeError("NTH16: invalid header length")
+      l = toBytes( l )
+      if ( bytes( l[0:4] ) != fmt.nthSig ):
+        raise RuntimeError("{} Invalid signature".format( nam ))
+      super().__init__(nam, l)
+      if self.wHeaderLength != fmt.nth.size:
+         raise RuntimeError("{}: invalid header length".format( nam ))
+
+  # fields: signature, wHeaderLength, wSequence, (d)wBlockLength, (d)wNdpIndex
+  def _get(self, i):
+    return self.FMT.nth.unpack_from( self.b_, 0 )[i]
+
+  def _set(self, i, v):
+    t    = list( self.FMT.nth.unpack_from( self.b_, 0 ) )
+    t[i] = v
+    self.FMT.nth.pack_into( self.b_, 0, *t )
 
   @property
   def wHeaderLength(self):
-    return self.bv_.get16LE(4)
+    return self._get(1)
 
   @wHeaderLength.setter
   def wHeaderLength(self, v):
-    self.bv_.set16LE(4, v)
+    self._set(1, v)
 
   @property
   def wSequence(self):
-    return self.bv_.get16LE(6)
+    return self._get(2)
 
   @wSequence.setter
   def wSequence(self, v):
-    self.bv_.set16LE(6, v)
+    self._set(2, v)
 
+  # dwBlockLength in NTH32
   @property
   def wBlockLength(self):
-    return self.bv_.get16LE(8)
+    return self._get(3)
 
   @wBlockLength.setter
   def wBlockLength(self, v):
-    self.bv_.set16LE(8, v)
+    self._set(3, v)
 
+  # dwNdpIndex in NTH32
   @property
   def wNdpIndex(self):
-    return self.bv_.get16LE(10)
+    return self._get(4)
 
   @wNdpIndex.setter
   def wNdpIndex(self, v):
-    self.bv_.set16LE(10, v)
+    self._set(4, v)
 
   def dump(self):
+    p = "dw" if self.FMT.wide else "w"
     super().dump()
-    print("  signature: {:c}{:c}{:c}{:c}".format( self.bv_[0], self.bv_[1], self.bv_[2], self.bv_[3] ))
+    print("  signature: {:c}{:c}{:c}{:c}".format( self.b_[0], self.b_[1], self.b_[2], self.b_[3] ))
     print("  wHeaderLength: {:4d}".format( self.wHeaderLength ) )
     print("  wSequence    : {:4d}".format( self.wSequence     ) )
-    print("  wBlockLength : {:4d}".format( self.wBlockLength  ) )
-    print("  wNdpIndex    : {:4d}".format( self.wNdpIndex     ) )
+    print("  {:13s}: {:4d}".format( p + "BlockLength", self.wBlockLength ) )
+    print("  {:13s}: {:4d}".format( p + "NdpIndex",    self.wNdpIndex    ) )
 
   def nextNDP(self, x):
     return self
@@ -276,37 +496,36 @@ class NTH16(BitVecHolder):
   def linkNDP(self, x):
     self.wNdpIndex = x.getIdx()
 
+class NTH32(NTH16):
+
+  FMT = NTB32_FMT
+
+  seq = 1
+
 class NDP16(BitVecHolder):
 
+  FMT = NTB16_FMT
+
   seq = 1
 
   def __init__(self, addCRC=False, l=None):
-    sig       = [0x4E, 0x43, 0x4D, 0x30]
+    fmt       = self.FMT
+    nam       = "NDP32" if fmt.wide else "NDP16"
     self.lck_ = False
     self.dgs_ = list()
+    # parsed NDPs already hold the datagram pointers
+    self.prs_ = not l is None
     if l is None:
-      l = list()
-      l.extend( [0x4E, 0x43, 0x4D, 0x30] )
-      if (addCRC):
-         l[3] |= 1
-      l.extend( [ 0,0] ) # Header Length
-      l.extend( [ 0,0] ) # Next NDP
-      l.extend( [ 0,0] ) # first PTR
-      l.extend( [ 0,0] ) # first LEN
-      l.extend( [ 0,0] ) # trailing zero index
-      l.extend( [ 0,0] ) # trailing zero length
-      super().__init__( "NDP16", l )
-      self.setHeaderLength()
+      super().__init__( nam, bytes( fmt.ndpLenMin + fmt.dpe.size ) )
+      ndpPack( self.b_, 0, [ ( 0, 0 ) ], addCRC, 0, fmt )
     else:
-      for i in range(3):
-        if ( sig[i] != l[i] ):
-          raise RuntimeError("NDP16: signature mismatch")
-      if   ( l[3] != 0x30 and  l[3] != 0x31 ):
-        raise RuntimeError("NDP16: signature mismatch")
-      hl = (l[5] << 8) + l[4]
-      if ( hl > 100 ):
-        raise RuntimeError("NDP16: unreasonable header length")
-      super().__init__( "NDP16", l[0:hl] )
+      l = toBytes( l )
+      if ( bytes( l[0:4] ) != fmt.ndpSig and bytes( l[0:4] ) != fmt.ndpSigCrc ):
+        raise RuntimeError("{}: signature mismatch".format( nam ))
+      hl = fmt.unpackNdpHdr( l, 0 )[1]
+      if ( hl < fmt.ndpLenMin or hl > len( l ) ):
+        raise RuntimeError("{}: unreasonable header length".format( nam ))
+      super().__init__( nam, l[0:hl] )
 
   def lock(self):
     if ( self.lck_ ):
@@ -315,57 +534,62 @@ class NDP16(BitVecHolder):
 
   @property
   def addCRC(self):
-    return (self.bv_[3] & 1) != 0
+    return (self.b_[3] & 1) != 0
 
   @property
   def wHeaderLength(self):
-    return self.bv_.get16LE(4)
+    return self.FMT.unpackNdpHdr( self.b_, 0 )[1]
 
+  # dwNextNdpIndex in NDP32
   @property
   def wNextNdpIndex(self):
-    return self.bv_.get16LE(6)
+    return self.FMT.unpackNdpHdr( self.b_, 0 )[2]
 
   @wNextNdpIndex.setter
   def wNextNdpIndex(self, v):
-    self.bv_.set16LE(6, v)
+    self.FMT.packNdpHdr( self.b_, 0, self.addCRC, self.wHeaderLength, v )
+
+  def _dpe(self, n):
+    return self.FMT.dpe.unpack_from( self.b_, self.FMT.ndp.size + n*self.FMT.dpe.size )
 
   def wDatagramIndex(self, n):
-    return self.bv_.get16LE( 8 + n*4 )
+    return self._dpe(n)[0]
 
   def wDatagramSize(self, n):
-    return self.bv_.get16LE( 8 + 2 + n*4 )
+    return self._dpe(n)[1]
 
   def setHeaderLength(self):
-    self.bv_.set16LE(4, self.getLen())
+    self.FMT.packNdpHdr( self.b_, 0, self.addCRC, self.getLen(), self.wNextNdpIndex )
 
   def add(self, dgram):
-    if ( len( self.dgs_ ) != 0 ):
-      self.bv_.extend( [0,0,0,0] )
+    if ( len( self.dgs_ ) != 0 and not self.prs_ ):
+      self.b_ += bytes( self.FMT.dpe.size )
     # else use first slot
     self.setHeaderLength()
     self.dgs_.append( dgram )
 
   def fixup(self):
-    pos = 8
+    pos = self.FMT.ndp.size
     for dg in self.dgs_:
-      self.bv_.set16LE( pos, dg.getIdx() )
-      pos += 2
-      self.bv_.set16LE( pos, dg.getLen() )
-      pos += 2
+      self.FMT.dpe.pack_into( self.b_, pos, dg.getIdx(), dg.getLen() )
+      pos += self.FMT.dpe.size
 
   def getDatagrams(self):
     return self.dgs_
 
   def dump(self):
+    p = "dw" if self.FMT.wide else "w"
     super().dump()
-    print("  signature: {:c}{:c}{:c}{:c}".format( self.bv_[0], self.bv_[1], self.bv_[2], self.bv_[3] ))
+    print("  signature: {:c}{:c}{:c}{:c}".format( self.b_[0], self.b_[1], self.b_[2], self.b_[3] ))
     print("  wHeaderLength: {:4d}".format( self.wHeaderLength ) )
-    print("  wNextNdpIndex: {:4d}".format( self.wNextNdpIndex ) )
-    i = 8
+    print("  {:13s}: {:4d}".format( p + "NextNdpIndex", self.wNextNdpIndex ) )
+    i = self.FMT.ndp.size
+    n = 0
     while i < self.getLen():
-      print("  wIdx[{:2d}]: {:4d}".format( (i - 8)>>2, self.bv_.get16LE(i    ) ))
-      print("  wLen[{:2d}]: {:4d}".format( (i - 8)>>2, self.bv_.get16LE(i + 2) ))
-      i += 4
+      print("  {}Idx[{:2d}]: {:4d}".format( p, n, self._dpe(n)[0] ))
+      print("  {}Len[{:2d}]: {:4d}".format( p, n, self._dpe(n)[1] ))
+      i += self.FMT.dpe.size
+      n += 1
 
   def nextNDP(self, x):
     x.linkNDP( self )
@@ -374,6 +598,10 @@ class NDP16(BitVecHolder):
   def linkNDP(self, x):
     self.wNextNdpIndex = x.getIdx()
 
+class NDP32(NDP16):
+
+  FMT = NTB32_FMT
+
 def genVecs(pre):
 
   n=NTB16()
@@ -429,19 +657,160 @@ def genVecs(pre):
     n1a.bitVecDgram(f = f)
     n2.bitVecDgram(f = f)
 
+# Vectors exercising large NTBs (close to the 64 KiB limit of NTB16 or
+# beyond with NTB32) made of MTU-sized and random-sized datagrams. The
+# overhead (NTH, NDPs, padding) is reported so that the throughput of
+# the layouts can be compared.
+def genVecsLarge(pre, fmt = NTB32_FMT, seed = 0):
+  rnd  = random.Random( seed )
+  mtu  = 1514
+  # datagrams that fit into a block
+  nmax = ( fmt.maxBlock - 256 ) // mtu if not fmt.wide else 150
+  ntbs = []
+  # one NDP, maximal number of MTU-sized datagrams
+  ntbs.append( ( [ ( False, [ rnd.randbytes( mtu ) for i in range( nmax ) ] ) ], True, False ) )
+  # two chained NDPs (one with CRC), random sizes, no block length
+  ntbs.append( ( [ ( False, [ rnd.randbytes( rnd.randint( 60, mtu ) ) for i in range( nmax // 2 ) ] ),
+                   ( True,  [ rnd.randbytes( rnd.randint( 60, mtu ) ) for i in range( nmax // 4 ) ] ) ], False, False ) )
+  # NDP ahead of the datagrams
+  ntbs.append( ( [ ( False, [ rnd.randbytes( mtu ) for i in range( nmax ) ] ) ], True, True ) )
+  pay = 0
+  tot = 0
+  with io.open(pre + "OutTst.txt","w") as ft, io.open(pre + "OutCmp.txt","w") as fc:
+    for seq in range( len( ntbs ) ):
+      ndps, hasBlockLen, ndpFirst = ntbs[seq]
+      buf, dgs = ntbEncode( ndps, seq, hasBlockLen, ndpFirst, fmt )
+      bitVecWrite( ft, buf )
+      ft.write( _BV_FMT[BV_DON] )
+      bitVecWriteDgrams( fc, buf, dgs )
+      pay += sum( [ l for i, l in dgs ] )
+      tot += len( buf )
+      print("{} #{:d}: {:6d} bytes, {:3d} datagrams".format( fmt.nam, seq, len( buf ), len( dgs ) ))
+  print("{}: {:d} bytes payload in {:d} bytes; overhead {:.2f}%".format( fmt.nam, pay, tot, 100.0*( tot - pay ) / tot ))
+
+# Traffic generator
+#
+# Streams NTBs made of datagrams with sizes drawn from a distribution:
+#
+#   tiny     : 1..32 bytes (default; fits the RAM of Usb2EpCDCNCMOutTb)
+#   imix     : 60, 590 and 1514 bytes (ethernet frames w/o FCS) at 7:4:1
+#   mtu      : 1514 bytes
+#   <n>      : <n> bytes
+#   <a>:<b>  : uniform in a..b
+#
+# Only 'tiny' vectors can be run through Usb2EpCDCNCMOutTb (its datagram
+# RAM holds 2**LD_DEPTH_C = 128 bytes); the others are meant for a larger
+# RAM or for other consumers.
+# The number of datagrams per NDP and of (chained) NDPs per NTB are
+# drawn uniformly from ranges ( min, max ). Datagrams of CRC NDPs carry
+# the ethernet FCS.
+#   crc      : "none", "all" or "mixed" (random per NDP)
+#   blockLen : "yes", "no" or "mixed" (random per NTB); NTBs without
+#              block length are padded so that their size is not a
+#              multiple of 'mps' (the endpoint needs a short packet to
+#              end the NTB)
+# The NDPs follow or (at random) precede the datagrams. Datagrams are
+# only added as long as the NTB does not exceed 'maxNtb' bytes.
+NCM_TB_MPS    = 15
+
+NCM_IMIX      = ( ( 60, 7 ), ( 590, 4 ), ( 1514, 1 ) )
+
+def ncmSizeDist(spec):
+  if ( spec == "imix" ):
+    sz = [ x[0] for x in NCM_IMIX ]
+    w  = [ x[1] for x in NCM_IMIX ]
+    return lambda rnd: rnd.choices( sz, w )[0]
+  if ( spec == "mtu" ):
+    return lambda rnd: 1514
+  if ( spec == "tiny" ):
+    return lambda rnd: rnd.randint( 1, 32 )
+  r = ncmRange( spec )
+  return lambda rnd: rnd.randint( r[0], r[1] )
+
+# parse '<n>' or '<a>:<b>' into a tuple ( min, max ); min must be >= 1
+def ncmRange(spec):
+  l = [ int( x, 0 ) for x in str( spec ).split(":") ]
+  if ( l[0] < 1 or l[-1] < l[0] ):
+    raise RuntimeError("Invalid range '{}' (need 1 <= min <= max)".format( spec ))
+  return ( l[0], l[-1] )
+
+def _choose(rnd, mode):
+  if ( mode == "mixed" ):
+    return rnd.random() < 0.5
+  return mode in ( "yes", "all" )
+
+# yields ( buf, dgs ) for 'count' NTBs (see ntbEncode)
+def ntbStream(count, seed = None, dist = "tiny", dgPerNdp = ( 1, 4 ), ndpsPerNtb = ( 1, 1 ),
+              crc = "none", blockLen = "yes", fmt = NTB16_FMT, maxNtb = None, mps = NCM_TB_MPS):
+  rnd  = random.Random( seed )
+  szFn = ncmSizeDist( dist )
+  if ( maxNtb is None or maxNtb > fmt.maxBlock ):
+    maxNtb = fmt.maxBlock
+  for seq in range( count ):
+    # NTH, alignment, trailing pad
+    tot  = fmt.nth.size + 3 + 1
+    ndps = []
+    for n in range( rnd.randint( *ndpsPerNtb ) ):
+      addCRC = _choose( rnd, crc )
+      tot   += fmt.ndpLenMin
+      dgs    = []
+      for i in range( rnd.randint( *dgPerNdp ) ):
+        d = rnd.randbytes( szFn( rnd ) )
+        if ( addCRC ):
+          d += struct.pack( "<I", zlib.crc32( d ) )
+        if ( tot + len( d ) + fmt.dpe.size > maxNtb ):
+          break
+        tot += len( d ) + fmt.dpe.size
+        dgs.append( d )
+      if ( len( dgs ) == 0 ):
+        tot -= fmt.ndpLenMin
+        break
+      ndps.append( ( addCRC, dgs ) )
+    if ( len( ndps ) == 0 ):
+      raise RuntimeError("NTB size limit too small for a datagram")
+    hasBlockLen = _choose( rnd, blockLen )
+    buf, dgs    = ntbEncode( ndps, seq & 0xffff, hasBlockLen, rnd.random() < 0.5, fmt )
+    if ( not hasBlockLen and not mps is None and len( buf ) % mps == 0 ):
+      buf.append( 0 )
+    yield buf, dgs
+
+# Stream 'count' NTBs to the <pre>OutTst.txt/<pre>OutCmp.txt vectors
+# (memory is bounded by one NTB); keyword arguments see ntbStream
+def genTraffic(pre, count, **kwargs):
+  pay  = 0
+  tot  = 0
+  ndg  = 0
+  with io.open(pre + "OutTst.txt","w") as ft, io.open(pre + "OutCmp.txt","w") as fc:
+    for buf, dgs in ntbStream( count, **kwargs ):
+      bitVecWrite( ft, buf )
+      ft.write( _BV_FMT[BV_DON] )
+      bitVecWriteDgrams( fc, buf, dgs )
+      ndg += len( dgs )
+      pay += sum( [ l for i, l in dgs ] )
+      tot += len( buf )
+  print("{:d} NTBs, {:d} datagrams, {:d} bytes payload in {:d} bytes; overhead {:.2f}%".format(
+        count, ndg, pay, tot, 100.0*( tot - pay ) / max( tot, 1 ) ))
+
 def inpVerify(pre):
-  cmp  = bv2l( pre+"InpCmp.txt" )
+  cmp, cb = bv2b( pre+"InpCmp.txt" )
   b    = 0
-  ntbs = list()
-  dgs  = list()
+  dgs  = bytearray()
+  bnds = []
   while b < len(cmp):
-    ntb = NTB16( l = cmp[b:] )
-    ntbs.append(ntb)
-    for dg in ntb.getDgrams():
-      dgs.extend( dg.getContent() )
-    b  += ntb.getNTH().wBlockLength
-  tst = bv2l( pre+"InpTst.txt" )
-  if ( tst != dgs ):
+    nth, ndps = ntbParse( memoryview( cmp )[b:] )
+    if ( nth[1] == 0 ):
+      raise RuntimeError("NTB without block length @ {:d}".format( b ))
+    for ndp in ndps:
+      for i, l in ndp.dgs:
+        dgs += cmp[b + i : b + i + l]
+        bnds.append( len( dgs ) )
+    b  += nth[1]
+  tst, tb = bv2b( pre+"InpTst.txt" )
+  if ( tst != dgs or tb != bnds ):
+    tb   = set( tb )
+    bnds = set( bnds )
+    tst  = [ x | ( 0x100 if i + 1 in tb   else 0 ) for i, x in enumerate( tst ) ]
+    dgs  = [ x | ( 0x100 if i + 1 in bnds else 0 ) for i, x in enumerate( dgs ) ]
     for i in range(len(tst)):
       if ( tst[i] != dgs[i] ):
         mrk = "****<<<<<"
@@ -452,20 +821,80 @@ def inpVerify(pre):
 
 if __name__ == "__main__":
 
-  pre = "NCM"
-  gen = False
-  chk = False
+  pre  = "NCM"
+  gen  = False
+  chk  = False
+  lrg  = False
+  fmt  = None
+  cnt  = None
+  kw   = dict()
 
-  ( opts, args ) = getopt.getopt(sys.argv[1:], "p:oi")
+  ( opts, args ) = getopt.getopt(sys.argv[1:], "hp:oiLw:G:s:d:n:c:C:B:N:P:")
   for opt in opts:
-    if   opt[0] in ("-p"):
+    if   opt[0] in ("-h"):
+      print("usage: {} [-hoiL] [-p prefix] [-w width] [-G count [generator_options]]".format( sys.argv[0] ))
+      print("          -h               : this message")
+      print("          -p prefix        : file name prefix (default 'NCM')")
+      print("          -o               : generate <prefix>OutTst.txt/<prefix>OutCmp.txt vectors")
+      print("          -i               : verify <prefix>InpCmp.txt against <prefix>InpTst.txt")
+      print("          -L               : generate large-block vectors (with -o)")
+      print("          -w width         : NTB16 or NTB32 (16/32); default: 32 for -L, 16 otherwise")
+      print("          -G count         : generate 'count' NTBs of random traffic (implies -o)")
+      print("        generator options:")
+      print("          -s seed          : random seed")
+      print("          -d dist          : datagram sizes: tiny (default; fits the test bench), imix, mtu,")
+      print("                             <n> or <a>:<b>")
+      print("          -n n|a:b         : datagrams per NDP (default 1:4)")
+      print("          -c n|a:b         : (chained) NDPs per NTB (default 1)")
+      print("          -C none|all|mixed: CRC NDPs (default none)")
+      print("          -B yes|no|mixed  : block length in the NTH (default yes)")
+      print("          -N max_ntb_size  : max. NTB size (bytes)")
+      print("          -P max_pkt_size  : avoid NTBs w/o block length that are a multiple of this (default {:d})".format( NCM_TB_MPS ))
+      sys.exit(0)
+    elif opt[0] in ("-p"):
       pre = opt[1]
     elif opt[0] in ("-o"):
       gen = True
     elif opt[0] in ("-i"):
       chk = True
+    elif opt[0] in ("-L"):
+      # large-block vectors
+      lrg = True
+    elif opt[0] in ("-w"):
+      # NTB width (16 or 32)
+      fmt = NTB16_FMT if int( opt[1] ) == 16 else NTB32_FMT
+    elif opt[0] in ("-G"):
+      gen = True
+      cnt = int( opt[1], 0 )
+    elif opt[0] in ("-s"):
+      kw['seed']       = int( opt[1], 0 )
+    elif opt[0] in ("-d"):
+      kw['dist']       = opt[1]
+    elif opt[0] in ("-n"):
+      kw['dgPerNdp']   = ncmRange( opt[1] )
+    elif opt[0] in ("-c"):
+      kw['ndpsPerNtb'] = ncmRange( opt[1] )
+    elif opt[0] in ("-C"):
+      if ( not opt[1] in ( "none", "all", "mixed" ) ):
+        raise RuntimeError("Invalid CRC mode '{}'".format( opt[1] ))
+      kw['crc']        = opt[1]
+    elif opt[0] in ("-B"):
+      if ( not opt[1] in ( "yes", "no", "mixed" ) ):
+        raise RuntimeError("Invalid block length mode '{}'".format( opt[1] ))
+      kw['blockLen']   = opt[1]
+    elif opt[0] in ("-N"):
+      kw['maxNtb']     = int( opt[1], 0 )
+      if ( kw['maxNtb'] < 1 ):
+        raise RuntimeError("Invalid max. NTB size {:d}".format( kw['maxNtb'] ))
+    elif opt[0] in ("-P"):
+      kw['mps']        = int( opt[1], 0 )
 
   if ( gen ) :
-    genVecs( pre )
+    if   ( not cnt is None ):
+      genTraffic( pre, cnt, fmt = NTB16_FMT if fmt is None else fmt, **kw )
+    elif ( lrg ):
+      genVecsLarge( pre, NTB32_FMT if fmt is None else fmt )
+    else:
+      genVecs( pre )
   if ( chk ):
     inpVerify( pre )